@@ -0,0 +1,55 @@
+import re
+import unicodedata
+
+from logger import logger
+from redis_util import async_redis_client, get_redis_client
+from utils import get_from_env_or_config, get_settings, LRUCache, TwoTierCache, make_cache_key
+
+ANSWER_CACHE_ENABLED = get_from_env_or_config('cache', 'answer_cache_enabled', 'true').lower() == "true"
+ANSWER_CACHE_TTL = int(get_from_env_or_config('cache', 'answer_cache_ttl', 86400))
+ANSWER_CACHE_MAX_SIZE = int(get_from_env_or_config('cache', 'answer_cache_max_size', 1024))
+# How long a worker trusts its last read of an index version before asking Redis again
+INDEX_VERSION_REFRESH_SECONDS = int(get_from_env_or_config('cache', 'index_version_refresh_seconds', 10))
+INDEX_VERSION_KEY = "index_version:{}"
+
+answer_cache = TwoTierCache("answer", async_redis_client, ttl=ANSWER_CACHE_TTL,
+                            max_size=ANSWER_CACHE_MAX_SIZE, enabled=ANSWER_CACHE_ENABLED)
+_index_versions = LRUCache(max_size=64, ttl=INDEX_VERSION_REFRESH_SECONDS)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes an English query so that trivially different spellings share a cache entry.
+    """
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = re.sub(r"\s+", " ", query)
+    return query.strip(" ?!.,;:'\"")
+
+
+async def get_index_version(index_id: str) -> str:
+    """
+    Returns the current version of an index. The version is bumped by `index_documents.py`
+    after every successful indexing run, which invalidates all cached answers for that index.
+    """
+    version = _index_versions.get(index_id) if INDEX_VERSION_REFRESH_SECONDS else None
+    if version is None:
+        try:
+            version = await async_redis_client.get(INDEX_VERSION_KEY.format(index_id))
+            version = version.decode("utf-8") if version else "0"
+        except Exception as e:
+            logger.warning(f"Unable to read index version for {index_id}: {e}")
+            return "0"
+        _index_versions.set(index_id, version)
+    return version
+
+
+def bump_index_version(index_id: str) -> int:
+    """
+    Marks an index as changed so that answers cached against the previous contents are not served again.
+    """
+    return get_redis_client().incr(INDEX_VERSION_KEY.format(index_id))
+
+
+async def get_answer_cache_key(context: str, index_id: str, query: str) -> str:
+    index_version = await get_index_version(index_id)
+    return make_cache_key("answer", context, index_id, index_version, get_settings().get_prompt_version(context), normalize_query(query))
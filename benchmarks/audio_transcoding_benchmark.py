@@ -0,0 +1,90 @@
+"""
+Cost of preparing a voice query for ASR with `get_encoded_string`.
+
+Compares the previous pydub pipeline (temp mp3, re-encode to mp3, decode again,
+resample, temp wav, read back) with the current single in-memory ffmpeg decode,
+on synthetic voice notes of typical lengths and formats. Both receive the audio
+as base64, like the API does. Needs `ffmpeg` and `ffprobe` on the PATH.
+
+Usage (from the repository root, with the usual .env):
+    python -m benchmarks.audio_transcoding_benchmark [--runs 10]
+"""
+import argparse
+import base64
+import os
+import statistics
+import subprocess
+import time
+
+from pydub import AudioSegment
+
+from translation.translation_utils import get_encoded_string
+from utils import generate_temp_filename
+
+# (label, ffmpeg output arguments, duration in seconds)
+VOICE_NOTES = [
+    ("opus 5 s (WhatsApp note)", ["-c:a", "libopus", "-b:a", "24k", "-f", "ogg"], 5),
+    ("opus 30 s (WhatsApp note)", ["-c:a", "libopus", "-b:a", "24k", "-f", "ogg"], 30),
+    ("mp3 15 s", ["-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3"], 15),
+    ("mp3 60 s", ["-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3"], 60),
+]
+
+
+def legacy_get_encoded_string(audio):
+    """The previous implementation, kept here as the baseline."""
+    local_filename = generate_temp_filename("mp3")
+    decoded_audio_content = base64.b64decode(audio)
+    with open(local_filename, "wb") as output_mp3_file:
+        output_mp3_file.write(decoded_audio_content)
+
+    output_file = AudioSegment.from_file(local_filename)
+    mp3_output_file = output_file.export(local_filename, format="mp3")
+    given_audio = AudioSegment.from_file(mp3_output_file)
+    given_audio = given_audio.set_frame_rate(16000)
+    given_audio = given_audio.set_channels(1)
+    tmp_wav_filename = generate_temp_filename("wav")
+    given_audio.export(tmp_wav_filename, format="wav", codec="pcm_s16le")
+    with open(tmp_wav_filename, "rb") as wav_file:
+        wav_file_content = wav_file.read()
+    encoded_string = str(base64.b64encode(wav_file_content), 'ascii', 'ignore')
+    os.remove(local_filename)
+    os.remove(tmp_wav_filename)
+    return encoded_string, wav_file_content
+
+
+def make_voice_note(output_args, duration: int) -> bytes:
+    """Synthesizes a speech-like 48 kHz stereo signal and encodes it."""
+    command = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"anoisesrc=d={duration}:c=pink:r=48000:a=0.2",
+        "-f", "lavfi", "-i", f"sine=f=220:d={duration}:r=48000",
+        "-filter_complex", "amix=inputs=2,tremolo=f=4:d=0.8", "-ac", "2",
+        *output_args, "pipe:1"
+    ]
+    return subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+
+
+def measure(function, audio: str, runs: int) -> float:
+    function(audio)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function(audio)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main(runs: int):
+    for label, output_args, duration in VOICE_NOTES:
+        audio = base64.b64encode(make_voice_note(output_args, duration)).decode()
+        legacy = measure(legacy_get_encoded_string, audio, runs)
+        current = measure(get_encoded_string, audio, runs)
+        print(f"{label:26s} ({len(audio) * 3 // 4 // 1024:4d} KB): "
+              f"legacy {legacy:7.1f} ms, in-memory {current:7.1f} ms ({legacy / current:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    main(args.runs)
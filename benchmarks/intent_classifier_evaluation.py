@@ -0,0 +1,98 @@
+"""
+Offline accuracy and latency of the local persona intent classifier.
+
+Runs stratified k-fold cross-validation over the labelled training file, or trains on
+it and evaluates a separate labelled file. Reports accuracy, precision and recall of the
+"about the bot" class, how many queries are decided locally at the configured confidence
+threshold (the rest would fall back to the LLM), and the prediction latency.
+
+Usage (from the repository root, with the usual .env):
+    python -m benchmarks.intent_classifier_evaluation [--folds 5] [--eval_file <labelled file>]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from intent.local import LocalIntentClassifier, load_examples
+from utils import get_from_env_or_config
+
+
+def split_folds(examples, folds: int, seed: int = 0):
+    """Stratified folds: each fold keeps the share of positive examples."""
+    rng = random.Random(seed)
+    buckets = [[] for _ in range(folds)]
+    for label in (True, False):
+        group = [example for example in examples if example[1] == label]
+        rng.shuffle(group)
+        for i, example in enumerate(group):
+            buckets[i % folds].append(example)
+    return buckets
+
+
+def evaluate(classifier, examples, threshold: float):
+    results = []
+    latencies = []
+    for query, label in examples:
+        start = time.perf_counter()
+        prediction = classifier.predict(query)
+        latencies.append(time.perf_counter() - start)
+        results.append((label, prediction))
+    return results, latencies
+
+
+def report(results, latencies, threshold: float, training_times):
+    true_positive = sum(1 for label, prediction in results if label and prediction.is_bot_intent)
+    false_positive = sum(1 for label, prediction in results if not label and prediction.is_bot_intent)
+    false_negative = sum(1 for label, prediction in results if label and not prediction.is_bot_intent)
+    correct = sum(1 for label, prediction in results if label == prediction.is_bot_intent)
+    confident = [(label, prediction) for label, prediction in results if prediction.confidence >= threshold]
+    confident_correct = sum(1 for label, prediction in confident if label == prediction.is_bot_intent)
+    latencies = sorted(latencies)
+
+    print(f"examples               : {len(results)}")
+    print(f"accuracy               : {correct / len(results):.3f}")
+    print(f"precision (bot)        : {true_positive / max(1, true_positive + false_positive):.3f}")
+    print(f"recall (bot)           : {true_positive / max(1, true_positive + false_negative):.3f}")
+    print(f"decided locally        : {len(confident) / len(results):.3f} (confidence >= {threshold})")
+    print(f"accuracy when decided  : {confident_correct / max(1, len(confident)):.3f}")
+    print(f"training time          : {statistics.mean(training_times) * 1000:.1f} ms")
+    print(f"prediction latency p50 : {latencies[len(latencies) // 2] * 1e6:.1f} us")
+    print(f"prediction latency p99 : {latencies[int(len(latencies) * 0.99)] * 1e6:.1f} us")
+
+
+def train(examples, threshold: float):
+    start = time.perf_counter()
+    classifier = LocalIntentClassifier(examples=examples, confidence_threshold=threshold)
+    return classifier, time.perf_counter() - start
+
+
+def main(training_file: str, eval_file: str, folds: int, threshold: float):
+    examples = load_examples(training_file)
+    results, latencies, training_times = [], [], []
+    if eval_file:
+        classifier, training_time = train(examples, threshold)
+        results, latencies = evaluate(classifier, load_examples(eval_file), threshold)
+        training_times.append(training_time)
+    else:
+        buckets = split_folds(examples, folds)
+        for i, held_out in enumerate(buckets):
+            training = [example for j, bucket in enumerate(buckets) if j != i for example in bucket]
+            classifier, training_time = train(training, threshold)
+            fold_results, fold_latencies = evaluate(classifier, held_out, threshold)
+            results.extend(fold_results)
+            latencies.extend(fold_latencies)
+            training_times.append(training_time)
+    report(results, latencies, threshold, training_times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--training_file", type=str,
+                        default=get_from_env_or_config('intent', 'training_file', 'intent/data/bot_intent.tsv'))
+    parser.add_argument("--eval_file", type=str, default=None, help="Labelled file to evaluate instead of cross-validating")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--threshold", type=float,
+                        default=float(get_from_env_or_config('intent', 'confidence_threshold', 0.8)))
+    args = parser.parse_args()
+    main(args.training_file, args.eval_file, args.folds, args.threshold)
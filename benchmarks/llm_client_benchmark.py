@@ -0,0 +1,110 @@
+"""
+Cost of building a chat client per call versus reusing one from ChatClientRegistry.
+
+Measures `get_client` itself, then a full chat call (`ainvoke`) against a local stub of
+the OpenAI chat completions API, where a fresh client also has to open a new connection.
+
+Usage (from the repository root, with the usual .env):
+    python -m benchmarks.llm_client_benchmark [--calls 300]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain.schema.messages import HumanMessage
+
+COMPLETION = json.dumps({
+    "id": "chatcmpl-benchmark", "object": "chat.completion", "created": 0, "model": "gpt-4",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "No"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11}
+}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/v1"
+
+
+def measure(call, calls: int) -> float:
+    call()
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+async def ameasure(call, calls: int) -> float:
+    await call()
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main(calls: int):
+    logging.getLogger("sakhi_activity").setLevel(logging.WARNING)
+    os.environ["OPENAI_API_BASE"] = start_stub()
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+    from llm.openai import OpenAIChatClient
+    from llm.registry import ChatClientRegistry
+
+    llm_client = OpenAIChatClient()
+    registry = ChatClientRegistry(OpenAIChatClient(), provider="openai")
+    model = os.getenv("GPT_MODEL") or "gpt-4"
+    messages = [HumanMessage(content="Is this about the bot?")]
+
+    new_client = measure(lambda: llm_client.get_client(model=model, temperature=0.1), calls)
+    cached_client = measure(lambda: registry.get_client(model=model, temperature=0.1), calls)
+    print(f"get_client, median of {calls} calls")
+    print(f"  new ChatOpenAI per call : {new_client:8.3f} ms")
+    print(f"  registry                : {cached_client:8.3f} ms")
+
+    async def new_client_call():
+        await llm_client.get_client(model=model, temperature=0.1).ainvoke(messages)
+
+    async def cached_client_call():
+        await registry.get_client(model=model, temperature=0.1).ainvoke(messages)
+
+    async def run():
+        return await ameasure(new_client_call, calls), await ameasure(cached_client_call, calls)
+
+    new_call, cached_call = asyncio.run(run())
+    print(f"get_client + ainvoke against a local stub, median of {calls} calls")
+    print(f"  new ChatOpenAI per call : {new_call:8.3f} ms")
+    print(f"  registry                : {cached_call:8.3f} ms  (-{new_call - cached_call:.3f} ms)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=300)
+    args = parser.parse_args()
+    main(args.calls)
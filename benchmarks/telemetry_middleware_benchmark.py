@@ -0,0 +1,141 @@
+"""
+Per-request overhead of TelemetryMiddleware.
+
+Compares a bare application with the previous BaseHTTPMiddleware based implementation
+and the current pure ASGI middleware, for a text query and for a voice query carrying
+base64 audio. Requests are driven straight through the ASGI interface, so the numbers
+exclude any network or server cost.
+
+Usage (from the repository root, with the usual .env):
+    python -m benchmarks.telemetry_middleware_benchmark [--requests 2000]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import statistics
+import time
+
+from fastapi import Request
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.types import Message
+
+import telemetry_middleware
+from telemetry_middleware import TelemetryMiddleware
+
+
+class LegacyTelemetryMiddleware(BaseHTTPMiddleware):
+    """The previous implementation, kept here as the baseline."""
+
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.time()
+        raw_body = body = await request.body()
+        original_receive = request._receive
+        body_sent = False
+
+        async def receive() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": raw_body, "more_body": False}
+            return await original_receive()
+
+        request._receive = receive
+        if body.decode("utf-8"):
+            body = json.loads(body)
+        response = await call_next(request)
+        process_time = time.time() - start_time
+        response.headers["X-Process-Time"] = str(process_time)
+        if "v1" in str(request.url):
+            event: dict = {
+                "status_code": response.status_code,
+                "duration": round(process_time * 1000),
+                "body": body,
+                "method": request.method,
+                "url": request.url
+            }
+            event.update(request.headers)
+            telemetry_middleware.logger.info({"label": "api_call", "event": event})
+        return response
+
+
+async def endpoint(request):
+    await request.json()
+    return JSONResponse({"output": {"text": "ok"}})
+
+
+def build_app(middleware=None):
+    app = Starlette(routes=[Route("/v1/query", endpoint, methods=["POST"])])
+    return middleware(app) if middleware else app
+
+
+def build_body(audio_bytes: int) -> bytes:
+    return json.dumps({
+        "input": {
+            "language": "hi",
+            "text": "" if audio_bytes else "How to play with my 4 year old?",
+            "audio": base64.b64encode(os.urandom(audio_bytes)).decode() if audio_bytes else "",
+            "context": "parent"
+        },
+        "output": {"format": "text"}
+    }).encode()
+
+
+async def call(app, body: bytes):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/v1/query", "raw_path": b"/v1/query", "query_string": b"",
+        "root_path": "", "server": ("127.0.0.1", 8000), "client": ("127.0.0.1", 5000),
+        "headers": [(b"content-type", b"application/json"), (b"x-request-id", b"bench"),
+                    (b"content-length", str(len(body)).encode())],
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(app, body: bytes, requests: int) -> float:
+    for _ in range(50):
+        await call(app, body)
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await call(app, body)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+async def main(requests: int):
+    # Measure the middleware itself, not log formatting or telemetry shipping
+    logging.getLogger("sakhi_activity").setLevel(logging.WARNING)
+    telemetry_middleware.telemetry_log_enabled = False
+
+    for label, audio_bytes in (("text query", 0), ("voice query, 1 MB audio", 1024 * 1024)):
+        body = build_body(audio_bytes)
+        bare = await measure(build_app(), body, requests)
+        legacy = await measure(build_app(LegacyTelemetryMiddleware), body, requests)
+        current = await measure(build_app(TelemetryMiddleware), body, requests)
+        print(f"{label} ({len(body)} bytes body), median of {requests} requests")
+        print(f"  no middleware      : {bare:9.1f} us")
+        print(f"  BaseHTTPMiddleware : {legacy:9.1f} us  (+{legacy - bare:.1f} us)")
+        print(f"  pure ASGI          : {current:9.1f} us  (+{current - bare:.1f} us)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
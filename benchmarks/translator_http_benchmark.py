@@ -0,0 +1,124 @@
+"""
+Latency saved per Bhashini/Dhruva call by the pooled keep-alive client.
+
+Starts a local stub of the ULCA pipeline endpoint and sends the same translation
+payload with a new connection per call (the previous `requests.request` code) and
+with `PipelineHttpClient`, sync and async. With `--tls` the stub serves HTTPS with a
+throwaway self-signed certificate (needs the `openssl` CLI), which is closer to the
+real endpoint where every new connection also pays a TLS handshake.
+
+Usage (from the repository root, with the usual .env):
+    python -m benchmarks.translator_http_benchmark [--requests 500] [--tls]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from translation.http_client import PipelineHttpClient
+
+RESPONSE = json.dumps({"pipelineResponse": [{"output": [{"source": "hello", "target": "नमस्ते"}]}]}).encode()
+PAYLOAD = {
+    "pipelineTasks": [{"taskType": "translation", "config": {"language": {"sourceLanguage": "en", "targetLanguage": "hi"}}}],
+    "inputData": {"input": [{"source": "How to play with my 4 year old?"}]}
+}
+HEADERS = {"Authorization": "benchmark", "Content-Type": "application/json"}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    # Send each response in one segment, like a real server, to avoid delayed ACK stalls
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(tls: bool):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    scheme = "http"
+    if tls:
+        certificate_dir = tempfile.mkdtemp()
+        cert, key = os.path.join(certificate_dir, "cert.pem"), os.path.join(certificate_dir, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                        "-addext", "subjectAltName=DNS:localhost",
+                        "-keyout", key, "-out", cert], check=True, capture_output=True)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+        # Trust the throwaway certificate in both clients
+        os.environ["SSL_CERT_FILE"] = os.environ["REQUESTS_CA_BUNDLE"] = cert
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"{scheme}://localhost:{server.server_port}/services/inference/pipeline"
+
+
+def measure(call, requests_count: int) -> float:
+    for _ in range(20):
+        call()
+    timings = []
+    for _ in range(requests_count):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+async def ameasure(call, requests_count: int) -> float:
+    for _ in range(20):
+        await call()
+    timings = []
+    for _ in range(requests_count):
+        start = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main(requests_count: int, tls: bool):
+    # Measure the transport, not log formatting or telemetry shipping
+    logging.getLogger("sakhi_activity").setLevel(logging.WARNING)
+    url = start_stub(tls)
+
+    def per_call_connection():
+        response = requests.request("POST", url, headers=HEADERS, data=json.dumps(PAYLOAD))
+        response.raise_for_status()
+
+    pooled = PipelineHttpClient("benchmark")
+
+    legacy = measure(per_call_connection, requests_count)
+    current = measure(lambda: pooled.post(url, HEADERS, PAYLOAD, "translation"), requests_count)
+    current_async = asyncio.run(ameasure(lambda: pooled.apost(url, HEADERS, PAYLOAD, "translation"), requests_count))
+    pooled.close()
+
+    print(f"{'HTTPS' if tls else 'HTTP'} stub, median of {requests_count} translation calls")
+    print(f"  new connection per call (requests) : {legacy:7.3f} ms")
+    print(f"  pooled keep-alive (sync)           : {current:7.3f} ms  (-{legacy - current:.3f} ms)")
+    print(f"  pooled keep-alive (async)          : {current_async:7.3f} ms  (-{legacy - current_async:.3f} ms)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--tls", action="store_true")
+    args = parser.parse_args()
+    main(args.requests, args.tls)
@@ -0,0 +1,128 @@
+"""
+Latency of a retrieval call with the previous Marqo code and with the persistent searcher.
+
+The previous code built a LangChain `Marqo` wrapper per query, asked for 20 hits with
+highlights and all their attributes, parsed the metadata of every hit, and filtered by
+score and count afterwards. The searcher asks for `top_docs_to_fetch` hits (plus the
+adaptive margin) with only the text and metadata, and stops at the score threshold.
+
+Runs against the Marqo index given with `--index` on VECTOR_STORE_ENDPOINT, or, with
+`--stub`, against a local stub of the Marqo search API that returns hits shaped like the
+ones of `index_documents.py`.
+
+Usage (from the repository root, with the usual .env):
+    python -m benchmarks.vector_search_benchmark --index sakhi_parent_activities [--queries 200]
+    python -m benchmarks.vector_search_benchmark --stub
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import marqo
+from langchain.vectorstores.marqo import Marqo
+
+from utils import get_settings
+from vectorstores.marqo import MarqoSearcher
+
+QUERIES = [
+    "How can I teach my child to count?",
+    "Games to play with a 4 year old",
+    "What songs help children learn colours?",
+    "How do I make a toy from waste material?",
+    "Activities to improve hand eye coordination",
+]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers like Marqo: hits of about 1 KB of text, best score first."""
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_GET(self):
+        self.send_json({"message": "Welcome to Marqo", "version": "2.1.0"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        attributes = body.get("attributesToRetrieve")
+        hits = []
+        for i in range(body["limit"]):
+            hit = {
+                "_id": f"doc-{i}",
+                "_score": 0.95 - i * 0.02,
+                "text": f"Activity {i}. " + "Sit with your child and count the stones one by one. " * 20,
+                "metadata": json.dumps({"page_label": str(i), "file_name": "activities.pdf",
+                                        "file_path": "/data/activities.pdf", "file_type": "application/pdf"}),
+            }
+            if attributes is not None:
+                hit = {key: value for key, value in hit.items() if key.startswith("_") or key in attributes}
+            if body.get("showHighlights", True):
+                hit["_highlights"] = [{"text": hit.get("text", "")[:300]}]
+            hits.append(hit)
+        self.send_json({"hits": hits, "query": body.get("q"), "limit": body["limit"], "offset": 0, "processingTimeMs": 1})
+
+    def send_json(self, response):
+        data = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def measure(call, queries: int) -> float:
+    for query in QUERIES:
+        call(query)
+    timings = []
+    for i in range(queries):
+        start = time.perf_counter()
+        call(QUERIES[i % len(QUERIES)])
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main(url: str, index_name: str, queries: int):
+    logging.getLogger("marqo").setLevel(logging.WARNING)
+    settings = get_settings()
+    client = marqo.Client(url=url)
+
+    def legacy_search(query):
+        documents = Marqo(client, index_name=index_name, searchable_attributes=["text"]).similarity_search_with_score(query, 20)
+        documents = [(document, score) for document, score in documents if score > settings.docs_min_score]
+        return documents[:settings.top_docs_to_fetch]
+
+    searcher = MarqoSearcher(client, index_name, ["text"])
+
+    def searcher_search(query):
+        return searcher.search(query, settings.top_docs_to_fetch, settings.docs_min_score)
+
+    assert [document.page_content for document, _ in legacy_search(QUERIES[0])] == \
+           [document.page_content for document, _ in searcher_search(QUERIES[0])], "Both searches must return the same documents"
+    legacy = measure(legacy_search, queries)
+    current = measure(searcher_search, queries)
+    print(f"top_docs_to_fetch={settings.top_docs_to_fetch}, docs_min_score={settings.docs_min_score}, median of {queries} queries")
+    print(f"  LangChain wrapper per query, k=20 : {legacy:7.3f} ms")
+    print(f"  persistent searcher               : {current:7.3f} ms  (-{legacy - current:.3f} ms)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", type=str, default="benchmark")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--stub", action="store_true", help="Search a local stub instead of VECTOR_STORE_ENDPOINT")
+    args = parser.parse_args()
+    main(start_stub() if args.stub else os.environ["VECTOR_STORE_ENDPOINT"], args.index, args.queries)
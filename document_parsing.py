@@ -0,0 +1,59 @@
+from typing import (
+    List,
+    Optional
+)
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from llama_index import SimpleDirectoryReader
+
+# Parsing of the input files of index_documents.py. Its worker processes load this module, which
+# must not import env_manager or anything else that creates the clients of the service.
+
+def document_loader(input_dir: Optional[str] = None, input_files: Optional[List[str]] = None) -> List[Document]:
+    """Load data from the input directory, or from a list of files.
+
+    Args:
+        input_dir (str): Path to the directory.
+        input_files (List[str]): Paths of the files to load instead of a directory.
+
+    Returns:
+        List[Document]: A list of documents.
+    """
+    return SimpleDirectoryReader(
+        input_dir=input_dir, input_files=input_files, recursive=True).load_data() # show_progress=True
+
+
+def list_input_files(input_dir: str) -> List[str]:
+    """Returns the paths of the files of the input directory that the loader reads."""
+    return [str(input_file) for input_file in SimpleDirectoryReader(input_dir=input_dir, recursive=True).input_files]
+
+
+def split_documents(documents: List[Document], chunk_size: int = 4000, chunk_overlap = 200) -> List[Document]:
+    """Split documents.
+
+    Args:
+        documents: List of documents
+        chunk_size: Maximum size of chunks to return
+        chunk_overlap: Overlap in characters between chunks
+
+    Returns:
+        List[Document]: A list of documents.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    # splited_docs = text_splitter.split_documents(documents)
+    splited_docs = []
+    for document in documents:
+        for chunk in text_splitter.split_text(document.text):
+            splited_docs.append(Document(page_content=chunk, metadata={
+                "page_label": document.metadata.get("page_label"),
+                "file_name": document.metadata.get("file_name"),
+                "file_path": document.metadata.get("file_path"),
+                "file_type": document.metadata.get("file_type")
+            }))
+    return splited_docs
+
+
+def load_file_chunks(file_path: str, chunk_size: int, chunk_overlap: int) -> List[Document]:
+    """Parses and splits a single file, in a worker process of the ingestion pipeline."""
+    return split_documents(document_loader(input_files=[file_path]), chunk_size, chunk_overlap)
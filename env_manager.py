@@ -1,12 +1,15 @@
 import os
 from dotenv import load_dotenv
 from logger import logger
+from redis_util import async_redis_client
+from utils import get_from_env_or_config
 
 from translation import (
     BaseTranslationClass,
     BhashiniTranslationClass,
     DhruvaTranslationClass,
-    GoogleCloudTranslationClass
+    GoogleCloudTranslationClass,
+    CachedTranslationClass
 )
 from storage import (
     BaseStorageClass,
@@ -18,12 +21,21 @@ from llm import (
     BaseChatClient,
     AzureChatClient,
     OpenAIChatClient,
-    OllamaChatClient
+    OllamaChatClient,
+    ChatClientRegistry
 )
 
 from vectorstores import (
    BaseVectorStore,
-   MarqoVectorStore
+   MarqoVectorStore,
+   LocalVectorStore,
+   HybridVectorStore
+)
+
+from intent import (
+    BaseIntentClassifier,
+    LLMIntentClassifier,
+    LocalIntentClassifier
 )
 
 class EnvironmentManager():
@@ -59,15 +71,24 @@ class EnvironmentManager():
             },
             "vectorstore": {
                 "class": {
-                    "marqo": MarqoVectorStore
+                    "marqo": MarqoVectorStore,
+                    "local": LocalVectorStore
                 },
                 "env_key": "VECTOR_STORE_TYPE"
+            },
+            "intent": {
+                "class": {
+                    "llm": LLMIntentClassifier,
+                    "local": LocalIntentClassifier
+                },
+                "env_key": "INTENT_CLASSIFIER_TYPE",
+                "default": "llm"
             }
         }
 
-    def create_instance(self, env_key):
+    def create_instance(self, env_key, **kwargs):
         env_var = self.indexes[env_key]["env_key"]
-        type_value = os.getenv(env_var)
+        type_value = os.getenv(env_var, self.indexes[env_key].get("default"))
 
         if type_value is None:
             raise ValueError(
@@ -75,13 +96,23 @@ class EnvironmentManager():
             )
 
         logger.info(f"Init {env_key} class for: {type_value}")
-        return self.indexes[env_key]["class"].get(type_value)()
+        return self.indexes[env_key]["class"].get(type_value)(**kwargs)
             
 env_class = EnvironmentManager()
 
 # create instances of functions
 logger.info(f"Initializing required classes for components")
-llm_class: BaseChatClient = env_class.create_instance("llm")
-translate_class: BaseTranslationClass = env_class.create_instance("translate")
+llm_class: BaseChatClient = ChatClientRegistry(env_class.create_instance("llm"), provider=os.getenv("LLM_TYPE"))
+translate_class: BaseTranslationClass = CachedTranslationClass(
+    env_class.create_instance("translate"),
+    provider=os.getenv("TRANSLATION_TYPE"),
+    redis_client=async_redis_client,
+    ttl=int(get_from_env_or_config("cache", "translation_cache_ttl", 604800)),
+    max_size=int(get_from_env_or_config("cache", "translation_cache_max_size", 4096)),
+    enabled=get_from_env_or_config("cache", "translation_cache_enabled", "true").lower() == "true"
+)
 storage_class: BaseStorageClass = env_class.create_instance("storage")
 vectorstore_class: BaseVectorStore = env_class.create_instance("vectorstore")
+if get_from_env_or_config("database", "hybrid_search", "false").lower() == "true":
+    vectorstore_class = HybridVectorStore(vectorstore_class)
+intent_classifier: BaseIntentClassifier = env_class.create_instance("intent", llm_client=llm_class)
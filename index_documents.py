@@ -1,48 +1,57 @@
 import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
 from typing import (
-    List
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple
 )
 from langchain.docstore.document import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from llama_index import SimpleDirectoryReader
-from env_manager import vectorstore_class
- 
-def document_loader(input_dir: str) -> List[Document]:
-    """Load data from the input directory.
-
-    Args:
-        input_dir (str): Path to the directory.
-
-    Returns:
-        List[Document]: A list of documents.
-    """
-    return SimpleDirectoryReader(
-        input_dir=input_dir, recursive=True).load_data() # show_progress=True 
- 
-def split_documents(documents: List[Document], chunk_size: int = 4000, chunk_overlap = 200) -> List[Document]:
-    """Split documents.
-
-    Args:
-        documents: List of documents
-        chunk_size: Maximum size of chunks to return
-        chunk_overlap: Overlap in characters between chunks
-
-    Returns:
-        List[Document]: A list of documents.
-    """
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    # splited_docs = text_splitter.split_documents(documents)
-    splited_docs = []
-    for document in documents:
-        for chunk in text_splitter.split_text(document.text):
-            splited_docs.append(Document(page_content=chunk, metadata={
-                "page_label": document.metadata.get("page_label"),
-                "file_name": document.metadata.get("file_name"),
-                "file_path": document.metadata.get("file_path"),
-                "file_type": document.metadata.get("file_type")
-            }))
-    return splited_docs
+from document_parsing import document_loader, list_input_files, load_file_chunks, split_documents
+
+MANIFEST_VERSION = 1
+# Bytes read at once when hashing a file
+HASH_BLOCK_SIZE = 1 << 20
+# Batches of chunks waiting for the upload, bounds the memory used when parsing outpaces it
+UPLOAD_QUEUE_BATCHES = 4
+PROGRESS_INTERVAL_SECONDS = 10
+
+
+@dataclass
+class IndexChanges:
+    """Difference between the files of the input folder and the manifest of the index."""
+    new_files: List[str] = field(default_factory=list)
+    changed_files: List[str] = field(default_factory=list)
+    deleted_files: List[str] = field(default_factory=list)
+    # Files of the manifest missing from the input folder, kept in the index without --prune
+    missing_files: List[str] = field(default_factory=list)
+    unchanged_files: List[str] = field(default_factory=list)
+    chunks_to_add: int = 0
+    ids_to_delete: List[str] = field(default_factory=list)
+    unchanged_chunks: int = 0
+
+    def files_summary(self) -> str:
+        summary = (f"Files: {len(self.new_files)} new, {len(self.changed_files)} changed, "
+                   f"{len(self.deleted_files)} deleted, {len(self.unchanged_files)} unchanged")
+        if self.missing_files:
+            summary += f", {len(self.missing_files)} not in the folder and kept (use --prune to delete them)"
+        return summary
+
+    def chunks_summary(self) -> str:
+        return (f"Chunks: {self.chunks_to_add} to add, {len(self.ids_to_delete)} to delete, "
+                f"{self.unchanged_chunks} unchanged")
+
 
 def transform_documents():
     pass
@@ -52,6 +61,257 @@ def load_documents(folder_path: str, chunk_size: int, chunk_overlap: int) -> Lis
     splitted_documents = split_documents(documents, chunk_size, chunk_overlap)
     return splitted_documents
 
+
+def get_file_hash(file_path: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_chunk_ids(chunks: List[Document], folder_path: str) -> List[str]:
+    """
+    Returns a deterministic ID per chunk, hashed from its file (relative to the input
+    folder), page and text, so that an unchanged chunk keeps its ID across runs.
+    """
+    ids = []
+    occurrences = Counter()
+    for chunk in chunks:
+        key = json.dumps([os.path.relpath(chunk.metadata["file_path"], folder_path),
+                          chunk.metadata.get("page_label"), chunk.page_content], ensure_ascii=False)
+        # The same text repeated on a page gets one ID per occurrence
+        occurrence = occurrences[key]
+        occurrences[key] += 1
+        if occurrence:
+            key = f"{key}#{occurrence}"
+        ids.append(hashlib.sha256(key.encode("utf-8")).hexdigest()[:32])
+    return ids
+
+
+def get_manifest_path(collection_name: str) -> str:
+    return os.path.join(os.getenv("INDEX_MANIFEST_PATH", "index_manifests"), f"{collection_name}.json")
+
+
+def load_manifest(manifest_path: str) -> Optional[dict]:
+    try:
+        with open(manifest_path, encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+
+
+def save_manifest(manifest_path: str, manifest: dict):
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def check_manifest(manifest: dict, chunk_size: int, chunk_overlap: int):
+    """Raises an error when the index was built with settings that would make its chunks inconsistent."""
+    settings = {"embedding_model": os.getenv("EMBEDDING_MODEL"), "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    for name, value in settings.items():
+        if manifest.get(name) != value:
+            raise ValueError(f"The index was built with {name}={manifest.get(name)}, not {value}. "
+                             f"Run with --fresh_index to rebuild it.")
+
+
+def iter_in_background(items: Iterator, max_buffered: int) -> Iterator:
+    """
+    Iterates over `items` in a background thread through a bounded queue, so that producing
+    the next items overlaps with consuming the current one while at most `max_buffered`
+    items wait. Errors of the producer are raised to the consumer.
+    """
+    buffer = queue.Queue(maxsize=max_buffered)
+    stopped = threading.Event()
+
+    def put(entry) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((True, item)):
+                    return
+            put((False, None))
+        except BaseException as e:
+            put((False, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            has_item, item = buffer.get()
+            if not has_item:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+class IndexingPipeline:
+    """
+    Streams the changes of the input folder since the manifest of the index:
+    file discovery -> parsing and splitting in a process pool -> chunk IDs -> batches
+    of new chunks.
+
+    At most `2 * workers` files are parsed or waiting at a time, so the memory used does
+    not grow with the size of the corpus. The manifest of the index is built along the way.
+
+    Files of the manifest that are not in the input folder, e.g. indexed from another
+    folder into the same collection, are only deleted from the index when `prune` is set.
+    """
+
+    def __init__(self, folder_path: str, collection_name: str, manifest: Optional[dict], chunk_size: int,
+                 chunk_overlap: int, workers: int, prune: bool = False):
+        self.folder_path = folder_path
+        self.collection_name = collection_name
+        self.prune = prune
+        self.previous_files: Dict[str, dict] = manifest["files"] if manifest else {}
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.workers = workers
+        self.changes = IndexChanges()
+        self.files: Dict[str, dict] = {}
+        self.input_files: Dict[str, str] = {}
+        self.file_hashes: Dict[str, str] = {}
+        # Chunk IDs of the changed and deleted files, and those of them that are still there
+        self.previous_ids: Set[str] = set()
+        self.kept_ids: Set[str] = set()
+        self.parsed_files = 0
+
+    def plan_files(self) -> IndexChanges:
+        """Compares the hashes of the input files with the manifest, without parsing them."""
+        self.input_files = {os.path.relpath(file_path, self.folder_path): file_path
+                            for file_path in list_input_files(self.folder_path)}
+        for name in sorted(self.input_files):
+            self.file_hashes[name] = get_file_hash(self.input_files[name])
+            previous = self.previous_files.get(name)
+            if previous is None:
+                self.changes.new_files.append(name)
+            elif previous["hash"] != self.file_hashes[name]:
+                self.changes.changed_files.append(name)
+                self.previous_ids.update(previous["chunks"])
+            else:
+                self.changes.unchanged_files.append(name)
+                self.changes.unchanged_chunks += len(previous["chunks"])
+                self.files[name] = previous
+        for name in sorted(set(self.previous_files) - set(self.input_files)):
+            if self.prune:
+                self.changes.deleted_files.append(name)
+                self.previous_ids.update(self.previous_files[name]["chunks"])
+            else:
+                self.changes.missing_files.append(name)
+                self.files[name] = self.previous_files[name]
+        return self.changes
+
+    @property
+    def files_to_parse(self) -> List[str]:
+        return self.changes.new_files + self.changes.changed_files
+
+    def iter_file_chunks(self) -> Iterator[Tuple[str, List[Document]]]:
+        """Yields the (file name, chunks) of the new and changed files as the worker processes parse them."""
+        names = iter(self.files_to_parse)
+        # Forking would copy the locks of the upload threads and clients running in this process
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            pending = {}
+
+            def submit_next():
+                for name in names:
+                    pending[executor.submit(load_file_chunks, self.input_files[name],
+                                            self.chunk_size, self.chunk_overlap)] = name
+                    return
+
+            for _ in range(2 * self.workers):
+                submit_next()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    submit_next()
+                    yield name, future.result()
+
+    def iter_new_chunks(self) -> Iterator[Tuple[Document, str]]:
+        """Yields the (chunk, ID) of the chunks that are not in the index yet."""
+        for name, chunks in self.iter_file_chunks():
+            chunk_ids = get_chunk_ids(chunks, self.folder_path)
+            self.files[name] = {"hash": self.file_hashes[name], "chunks": chunk_ids}
+            self.parsed_files += 1
+            for chunk, chunk_id in zip(chunks, chunk_ids):
+                if chunk_id in self.previous_ids:
+                    self.kept_ids.add(chunk_id)
+                    self.changes.unchanged_chunks += 1
+                else:
+                    self.changes.chunks_to_add += 1
+                    yield chunk, chunk_id
+
+    def iter_batches(self, batch_size: int) -> Iterator[Tuple[List[Document], List[str]]]:
+        documents, ids = [], []
+        for chunk, chunk_id in self.iter_new_chunks():
+            documents.append(chunk)
+            ids.append(chunk_id)
+            if len(documents) == batch_size:
+                yield documents, ids
+                documents, ids = [], []
+        if documents:
+            yield documents, ids
+
+    def get_run_id(self) -> str:
+        """
+        Hash of the planned additions: the files to parse, their content and the chunking,
+        which the IDs of the chunks to add follow from.
+        """
+        plan = [self.chunk_size, self.chunk_overlap, [[name, self.file_hashes[name]] for name in self.files_to_parse]]
+        return hashlib.sha256(json.dumps(plan, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get_ids_to_delete(self) -> List[str]:
+        """Chunk IDs of the index that are not in the folder anymore, known once every file went through."""
+        self.changes.ids_to_delete = sorted(self.previous_ids - self.kept_ids)
+        return self.changes.ids_to_delete
+
+    def finish(self) -> dict:
+        """Computes the chunks to delete once every file went through, and returns the new manifest."""
+        self.get_ids_to_delete()
+        return {
+            "version": MANIFEST_VERSION,
+            "collection_name": self.collection_name,
+            "embedding_model": os.getenv("EMBEDDING_MODEL"),
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "files": {name: self.files[name] for name in sorted(self.files)}
+        }
+
+
+def iter_with_progress(batches: Iterator[Tuple[List[Document], List[str]]],
+                       pipeline: IndexingPipeline) -> Iterator[Tuple[List[Document], List[str]]]:
+    """
+    Passes the batches through, printing the parsing progress and the chunks handed to the
+    vector store every PROGRESS_INTERVAL_SECONDS.
+
+    A store may still be uploading the chunks it was handed (MarqoVectorStore keeps several
+    batches in flight and reports its own upload progress), so these are queued, not uploaded.
+    """
+    start = last_report = time.monotonic()
+    queued = 0
+    for documents, ids in batches:
+        yield documents, ids
+        # The vector store asks for the next batch once it took this one
+        queued += len(documents)
+        now = time.monotonic()
+        if now - last_report >= PROGRESS_INTERVAL_SECONDS:
+            last_report = now
+            print(f"Parsed {pipeline.parsed_files}/{len(pipeline.files_to_parse)} files, queued {queued} chunks "
+                  f"for the vector store ({queued / (now - start):.1f} chunks/s)")
+
+
 def indexer_main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--folder_path',
@@ -76,29 +336,96 @@ def indexer_main():
                         action='store_true',
                         help='Is the indexing fresh'
                         )
+    parser.add_argument('--prune',
+                        action='store_true',
+                        help='Delete from the index the files of previous runs that are not in the folder anymore'
+                        )
+    parser.add_argument('--dry_run',
+                        action='store_true',
+                        help='Only print the changes that would be made to the index'
+                        )
+    parser.add_argument('--workers',
+                        type=int,
+                        required=False,
+                        help='Number of processes parsing the files',
+                        default=os.cpu_count() or 1
+                        )
+    parser.add_argument('--batch_size',
+                        type=int,
+                        required=False,
+                        help='Number of chunks handed to the vector store at once',
+                        default=500
+                        )
 
     args = parser.parse_args()
+    # Imported here, as the worker processes import this module and must not create the service clients
+    from env_manager import vectorstore_class
+    from answer_cache import bump_index_version
 
     FOLDER_PATH = args.folder_path
     FRESH_INDEX = args.fresh_index
     CHUNK_SIZE = args.chunk_size
     CHUNK_OVERLAP = args.chunk_overlap
 
-    documents = load_documents(FOLDER_PATH, CHUNK_SIZE, CHUNK_OVERLAP)
-    print("Total documents :: =>", len(documents))
-    
-    print("Adding documents...")
-    results = vectorstore_class.add_documents(documents, FRESH_INDEX)
-    print("results =======>", results)
-    
+    manifest_path = get_manifest_path(vectorstore_class.collection_name)
+    manifest = None if FRESH_INDEX else load_manifest(manifest_path)
+    if manifest is not None:
+        check_manifest(manifest, CHUNK_SIZE, CHUNK_OVERLAP)
+    elif not FRESH_INDEX:
+        print(f"No manifest found at {manifest_path}, every file is indexed as new. If the index already "
+              f"holds documents indexed without a manifest, run once with --fresh_index to avoid duplicates.")
+
+    pipeline = IndexingPipeline(FOLDER_PATH, vectorstore_class.collection_name, manifest, CHUNK_SIZE, CHUNK_OVERLAP,
+                                args.workers, args.prune)
+    changes = pipeline.plan_files()
+    print(changes.files_summary())
+
+    start = time.monotonic()
+    batches = iter_in_background(pipeline.iter_batches(args.batch_size), UPLOAD_QUEUE_BATCHES)
+    if args.dry_run:
+        for _ in batches:
+            pass
+        pipeline.finish()
+        print(changes.chunks_summary())
+        print("============ DRY RUN, INDEX NOT CHANGED =============")
+        return
+
+    if pipeline.files_to_parse:
+        print("Adding documents...")
+        # The chunks of changed and deleted files are deleted after the additions, in the same
+        # new version for the stores that write versions, so a changed file is never missing
+        added = vectorstore_class.add_document_batches(iter_with_progress(batches, pipeline), FRESH_INDEX,
+                                                       pipeline.get_ids_to_delete, run_id=pipeline.get_run_id())
+        elapsed = time.monotonic() - start
+        print(f"Added {added} chunks from {pipeline.parsed_files} files in {elapsed:.1f}s "
+              f"({added / max(elapsed, 1e-9):.1f} chunks/s)")
+        new_manifest = pipeline.finish()
+        print(changes.chunks_summary())
+    else:
+        new_manifest = pipeline.finish()
+        print(changes.chunks_summary())
+        if changes.ids_to_delete:
+            print("Deleting documents...")
+            vectorstore_class.delete_documents(changes.ids_to_delete)
+    save_manifest(manifest_path, new_manifest)
+    if changes.chunks_to_add or changes.ids_to_delete:
+        # Invalidates answers cached against the previous contents of the index
+        bump_index_version(vectorstore_class.collection_name)
+
     print("============ INDEX DONE =============")
 
 
 if __name__ == "__main__":
     indexer_main()
-    
+
 # For Fresh collection
 # python3 index_documents.py --folder_path=Documents --fresh_index
 
-# For appending documents to existing collection
-# python3 index_documents.py --folder_path=Documents
\ No newline at end of file
+# For adding and updating the documents that changed since the last run
+# python3 index_documents.py --folder_path=Documents
+
+# Same, also removing the documents of the files that are not in the folder anymore
+# python3 index_documents.py --folder_path=Documents --prune
+
+# To only print what would change
+# python3 index_documents.py --folder_path=Documents --dry_run
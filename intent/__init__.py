@@ -0,0 +1,30 @@
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from intent.base import (
+        BaseIntentClassifier,
+        IntentPrediction
+    )
+    from intent.llm import (
+        LLMIntentClassifier
+    )
+    from intent.local import (
+        LocalIntentClassifier
+    )
+
+_module_lookup = {
+    "BaseIntentClassifier": "intent.base",
+    "IntentPrediction": "intent.base",
+    "LLMIntentClassifier": "intent.llm",
+    "LocalIntentClassifier": "intent.local"
+}
+
+def __getattr__(name: str) -> Any:
+    if name in _module_lookup:
+        module = importlib.import_module(_module_lookup[name])
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__} has no attribute {name}")
+
+
+__all__ = list(_module_lookup.keys())
@@ -0,0 +1,38 @@
+from abc import ABC, abstractmethod
+from typing import NamedTuple
+
+
+class IntentPrediction(NamedTuple):
+    is_bot_intent: bool
+    confidence: float
+    source: str
+
+
+class BaseIntentClassifier(ABC):
+    """
+    This abstract class defines the interface for a persona intent classifier.
+
+    A classifier decides whether a query is about the bot itself ('Teacher Tara',
+    'Parent Tara', what it is, who built it...) rather than about the documents.
+    """
+
+    @abstractmethod
+    def predict(self, query: str) -> IntentPrediction:
+        """
+        Classifies an English query.
+
+        Args:
+            query: The user's query, translated to English (str).
+
+        Returns:
+            An IntentPrediction with the decision and its confidence between 0.5 and 1.
+        """
+
+    async def apredict(self, query: str) -> IntentPrediction:
+        """
+        Asynchronously classifies an English query.
+
+        The default implementation calls `predict` inline, which suits local models
+        that answer in well under a millisecond. Classifiers doing I/O should override it.
+        """
+        return self.predict(query)
@@ -0,0 +1,37 @@
+from typing import Any
+
+from intent.base import BaseIntentClassifier, IntentPrediction
+from llm.base import BaseChatClient
+from logger import logger
+from utils import convert_chat_messages, get_settings, increment
+
+
+class LLMIntentClassifier(BaseIntentClassifier):
+    """
+    Asks the chat model, with the `intent_prompt` of config.ini, whether a query is about the bot.
+    """
+
+    def __init__(self, llm_client: BaseChatClient, **kwargs: Any) -> None:
+        self.llm_client = llm_client
+
+    def get_chat_client(self):
+        # Same client as the answer calls, so a reloaded temperature applies to the intent check too
+        return self.llm_client.get_client(temperature=get_settings().temperature)
+
+    def _get_messages(self, query: str):
+        return convert_chat_messages([
+            {"role": "system", "content": get_settings().intent_prompt},
+            {"role": "user", "content": query}
+        ])
+
+    def _to_prediction(self, intent_response: str) -> IntentPrediction:
+        logger.info({"label": "intent_response", "intent_response": intent_response})
+        increment("intent.llm")
+        return IntentPrediction(intent_response.strip().lower() == "yes", 1.0, "llm")
+
+    def predict(self, query: str) -> IntentPrediction:
+        return self._to_prediction(self.get_chat_client().invoke(input=self._get_messages(query)).content)
+
+    async def apredict(self, query: str) -> IntentPrediction:
+        response = await self.get_chat_client().ainvoke(input=self._get_messages(query))
+        return self._to_prediction(response.content)
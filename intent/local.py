@@ -0,0 +1,135 @@
+import math
+import random
+import re
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from intent.base import BaseIntentClassifier, IntentPrediction
+from intent.llm import LLMIntentClassifier
+from llm.base import BaseChatClient
+from logger import logger
+from utils import get_from_env_or_config, increment
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def extract_features(query: str, dimensions: int, ngram_range: Tuple[int, int] = (3, 5)) -> Dict[int, float]:
+    """
+    Maps a query to L2 normalized hashed features: words, word bigrams and character n-grams.
+
+    Character n-grams make the model robust to the spelling and inflection noise that
+    comes out of speech recognition and machine translation.
+    """
+    words = TOKEN_PATTERN.findall(query.lower())
+    features = [f"w:{word}" for word in words]
+    features.extend(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+    text = f" {' '.join(words)} "
+    for size in range(ngram_range[0], ngram_range[1] + 1):
+        features.extend(f"c:{text[i:i + size]}" for i in range(len(text) - size + 1))
+
+    vector: Dict[int, float] = {}
+    for feature in features:
+        index = zlib.crc32(feature.encode("utf-8")) & (dimensions - 1)
+        vector[index] = vector.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+    return {index: value / norm for index, value in vector.items()}
+
+
+def _sigmoid(z: float) -> float:
+    if z < -30:
+        return 0.0
+    if z > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+class NgramLogisticModel:
+    """
+    Logistic regression over hashed n-gram features, in pure Python.
+    """
+
+    def __init__(self, dimensions: int = 2 ** 18) -> None:
+        if dimensions & (dimensions - 1):
+            raise ValueError("dimensions must be a power of two")
+        self.dimensions = dimensions
+        self.weights: Dict[int, float] = {}
+        self.bias = 0.0
+
+    def fit(self, examples: List[Tuple[str, bool]], epochs: int = 30, learning_rate: float = 0.5,
+            l2: float = 1e-4, seed: int = 0) -> "NgramLogisticModel":
+        """
+        Trains the model with stochastic gradient descent on (query, is_bot_intent) pairs.
+        """
+        vectors = [(extract_features(query, self.dimensions), float(label)) for query, label in examples]
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(vectors)
+            rate = learning_rate / (1 + epoch * 0.1)
+            for vector, label in vectors:
+                gradient = self._probability(vector) - label
+                for index, value in vector.items():
+                    weight = self.weights.get(index, 0.0)
+                    self.weights[index] = weight - rate * (gradient * value + l2 * weight)
+                self.bias -= rate * gradient
+        return self
+
+    def _probability(self, vector: Dict[int, float]) -> float:
+        weights = self.weights
+        return _sigmoid(self.bias + sum(weights.get(index, 0.0) * value for index, value in vector.items()))
+
+    def predict_probability(self, query: str) -> float:
+        """Returns the probability that the query is about the bot."""
+        return self._probability(extract_features(query, self.dimensions))
+
+
+def load_examples(file_path: str) -> List[Tuple[str, bool]]:
+    """
+    Reads a labelled file with one `<label>\\t<query>` per line, where the label is 1 (about the bot) or 0.
+    Empty lines and lines starting with # are ignored.
+    """
+    examples = []
+    with open(file_path, encoding="utf-8") as labelled_file:
+        for line in labelled_file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            label, query = line.split("\t", 1)
+            examples.append((query.strip(), label.strip() == "1"))
+    return examples
+
+
+class LocalIntentClassifier(BaseIntentClassifier):
+    """
+    CPU intent classifier: a hashed character n-gram logistic model trained at startup from a labelled file.
+
+    Predictions below `confidence_threshold` are delegated to the LLM classifier, when a chat client is given.
+    """
+
+    def __init__(self, llm_client: Optional[BaseChatClient] = None, examples: Optional[Iterable[Tuple[str, bool]]] = None,
+                 confidence_threshold: Optional[float] = None, **kwargs: Any) -> None:
+        if examples is None:
+            training_file = get_from_env_or_config('intent', 'training_file', 'intent/data/bot_intent.tsv')
+            examples = load_examples(training_file)
+        examples = list(examples)
+        if confidence_threshold is None:
+            confidence_threshold = float(get_from_env_or_config('intent', 'confidence_threshold', 0.8))
+        self.confidence_threshold = confidence_threshold
+        self.model = NgramLogisticModel().fit(examples)
+        self.fallback = LLMIntentClassifier(llm_client) if llm_client is not None and confidence_threshold > 0.5 else None
+        logger.info(f"Local intent classifier trained on {len(examples)} examples")
+
+    def predict(self, query: str) -> IntentPrediction:
+        """
+        Classifies a query with the local model only.
+        """
+        probability = self.model.predict_probability(query)
+        is_bot_intent = probability >= 0.5
+        return IntentPrediction(is_bot_intent, probability if is_bot_intent else 1.0 - probability, "local")
+
+    async def apredict(self, query: str) -> IntentPrediction:
+        prediction = self.predict(query)
+        if prediction.confidence >= self.confidence_threshold or self.fallback is None:
+            increment("intent.local")
+            return prediction
+        logger.info({"label": "intent_fallback", "query": query, "confidence": prediction.confidence})
+        return await self.fallback.apredict(query)
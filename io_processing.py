@@ -1,20 +1,39 @@
-import time
+import asyncio
+import functools
+import os
+import re
+import unicodedata
 from logger import logger
 
-from env_manager import translate_class as translator
-from utils import get_from_env_or_config
+from env_manager import translate_class as translator, storage_class as storage
+from redis_util import async_redis_client
+from utils import get_from_env_or_config, make_cache_key, TwoTierCache
 
 DEFAULT_LANGAUGE = get_from_env_or_config('default', 'language', None)
+TTS_VOICE = "female"  # default voice of every translation provider
+# Must not outlive the bucket lifecycle rule that expires the uploaded audio objects
+tts_cache = TwoTierCache(
+    "tts",
+    async_redis_client,
+    ttl=int(get_from_env_or_config('cache', 'tts_cache_ttl', 604800)),
+    max_size=int(get_from_env_or_config('cache', 'tts_cache_max_size', 1024)),
+    enabled=get_from_env_or_config('cache', 'tts_cache_enabled', 'true').lower() == "true"
+)
+# Return the audio URL before the upload completes when the storage URL does not depend on it
+BACKGROUND_AUDIO_UPLOAD = get_from_env_or_config('storage', 'background_upload', 'true').lower() == "true"
+# End of a sentence: terminal punctuation (including the Devanagari danda) followed by whitespace, or a line break
+SENTENCE_BOUNDARY = re.compile(r"[.!?\u0964]+\s+|\n+")
+MIN_SENTENCE_LENGTH = 20
 
-def process_incoming_voice(file_url, input_language):
+async def process_incoming_voice(file_url, input_language):
     """
     Main Function for processing audio based queries
     """
     error_message = None
     try:
-        regional_text = translator.speech_to_text(file_url, input_language)
+        regional_text = await translator.aspeech_to_text(file_url, input_language)
         try:
-            english_text = translator.translate_text(text=regional_text, source=input_language, destination=DEFAULT_LANGAUGE)
+            english_text = await translator.atranslate_text(text=regional_text, source=input_language, destination=DEFAULT_LANGAUGE)
         except Exception as e:
             error_message = "Indic translation to English failed"
             logger.error(f"Exception occurred: {e}", exc_info=True)
@@ -27,13 +46,13 @@ def process_incoming_voice(file_url, input_language):
     return regional_text, english_text, error_message
 
 
-def process_incoming_text(regional_text, input_language):
+async def process_incoming_text(regional_text, input_language):
     """
     Main function for processing text queries
     """
     error_message = None
     try:
-        english_text = translator.translate_text(text=regional_text, source=input_language, destination=DEFAULT_LANGAUGE)
+        english_text = await translator.atranslate_text(text=regional_text, source=input_language, destination=DEFAULT_LANGAUGE)
     except Exception as e:
         error_message = "Indic translation to English failed"
         english_text = None
@@ -41,13 +60,13 @@ def process_incoming_text(regional_text, input_language):
     return english_text, error_message
 
 
-def process_outgoing_text(english_text, input_language):
+async def process_outgoing_text(english_text, input_language):
     """
     Main func for generating text response
     """
     error_message = None
     try:
-        regional_text = translator.translate_text(text=english_text, source=DEFAULT_LANGAUGE, destination=input_language)
+        regional_text = await translator.atranslate_text(text=english_text, source=DEFAULT_LANGAUGE, destination=input_language)
     except Exception as e:
         error_message = "English translation to indic language failed"
         logger.error(f"Exception occurred: {e}", exc_info=True)
@@ -55,20 +74,106 @@ def process_outgoing_text(english_text, input_language):
     return regional_text, error_message
 
 
-def process_outgoing_voice(message, input_language):
+async def split_sentences(chunks, min_length=MIN_SENTENCE_LENGTH):
+    """
+    Regroups a stream of text chunks into complete sentences.
+
+    Sentences shorter than `min_length` are merged with the next one so that
+    very short fragments do not each cost a translation call.
+    """
+    buffer = ""
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            match = SENTENCE_BOUNDARY.search(buffer, min_length)
+            if match is None:
+                break
+            sentence = buffer[:match.end()].strip()
+            buffer = buffer[match.end():]
+            if sentence:
+                yield sentence
+    sentence = buffer.strip().strip(";")
+    if sentence:
+        yield sentence
+
+
+async def stream_outgoing_text(sentences, input_language):
+    """
+    Translates a stream of English sentences, yielding (regional_text, error_message) in order.
+
+    Each sentence is sent for translation as soon as it is complete, while later
+    sentences are still being generated.
+    """
+    pending = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for sentence in sentences:
+                await pending.put(asyncio.ensure_future(process_outgoing_text(sentence, input_language)))
+        finally:
+            await pending.put(None)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            translation = await pending.get()
+            if translation is None:
+                break
+            yield await translation
+        # Surfaces errors raised while generating the sentences
+        await producer
+    finally:
+        producer.cancel()
+        while not pending.empty():
+            translation = pending.get_nowait()
+            if translation is not None:
+                translation.cancel()
+
+
+def get_tts_object_name(message, input_language):
+    """
+    Returns the content addressed storage object name of the audio for a message.
+    """
+    normalized_message = unicodedata.normalize("NFC", message).strip()
+    content_hash = make_cache_key("tts", os.getenv("TRANSLATION_TYPE"), input_language, TTS_VOICE, normalized_message).split(":")[1]
+    return f"tts/{content_hash}.mp3"
+
+
+async def process_outgoing_voice(message, input_language):
     """
     Main function for generating audio response
+
+    Audio is stored under a hash of its content, so a message that was already
+    synthesized is served from the existing object without calling TTS or uploading again.
+    When the storage URL is deterministic, the URL is returned right away and the audio
+    is uploaded in the background; it is only cached once the upload succeeded.
     """
     error_message = None
-    decoded_audio_content = translator.text_to_speech(language=input_language, text=message)
-    if decoded_audio_content is not None:
-        logger.info("Creating output MP3 file")
-        time_stamp = time.strftime("%Y%m%d-%H%M%S")
-        filename = "audio-output-" + time_stamp + ".mp3"
-        output_mp3_file = open(filename, "wb")
-        output_mp3_file.write(decoded_audio_content)
-        logger.info("Audio Response is saved as a MP3 file.")
-        return output_mp3_file, error_message
-    error_message = "Text to Audio conversion failed"
-    logger.error(error_message)
-    return None, error_message
+    object_name = get_tts_object_name(message, input_language)
+    audio_url = await tts_cache.get(object_name)
+    if audio_url is not None:
+        logger.info(f"Reusing synthesized audio: {object_name}")
+        return audio_url, error_message
+
+    decoded_audio_content = await translator.atext_to_speech(language=input_language, text=message)
+    if decoded_audio_content is None:
+        error_message = "Text to Audio conversion failed"
+        logger.error(error_message)
+        return None, error_message
+
+    if BACKGROUND_AUDIO_UPLOAD and storage.deterministic_public_url:
+        audio_url, error_message = await storage.agenerate_public_url(object_name)
+        if audio_url is not None:
+            storage.upload_in_background(decoded_audio_content, object_name,
+                                         on_success=functools.partial(tts_cache.set, object_name, audio_url))
+        return audio_url, error_message
+
+    if not await storage.aupload_to_storage(decoded_audio_content, object_name):
+        error_message = "Uploading audio to storage failed"
+        logger.error(error_message)
+        return None, error_message
+
+    audio_url, error_message = await storage.agenerate_public_url(object_name)
+    if audio_url is not None:
+        await tts_cache.set(object_name, audio_url)
+    return audio_url, error_message
@@ -14,6 +14,9 @@ if TYPE_CHECKING:
     from llm.ollama import (
         OllamaChatClient
     )
+    from llm.registry import (
+        ChatClientRegistry
+    )
 
 # __all__ = [
 #     "BaseChatClient",
@@ -26,7 +29,8 @@ _module_lookup = {
     "BaseChatClient" : "llm.base",
     "OpenAIChatClient": "llm.openai",
     "AzureChatClient": "llm.azure_openai",
-    "OllamaChatClient": "llm.ollama"
+    "OllamaChatClient": "llm.ollama",
+    "ChatClientRegistry": "llm.registry"
 }
 
 def __getattr__(name: str) -> Any:
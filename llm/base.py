@@ -24,4 +24,9 @@ class BaseChatClient(ABC):
           An instance of a subclass of BaseChatModel representing the specific Chat client.
         """
 
-        pass
\ No newline at end of file
+        pass
+
+    async def aclose(self) -> None:
+        """
+        Releases any network resources held by the chat clients.
+        """
@@ -0,0 +1,77 @@
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from langchain.chat_models import ChatOpenAI
+from langchain.chat_models.base import BaseChatModel
+
+from llm.base import BaseChatClient
+from logger import logger
+from utils import get_from_env_or_config, increment
+
+
+class ChatClientRegistry(BaseChatClient):
+    """
+    Caching wrapper around another chat client.
+
+    `get_client` returns the same chat model instance for the same (model, kwargs), instead
+    of building a new one per call. OpenAI and Azure OpenAI models share one keep-alive
+    connection pool per provider, with the timeouts and limits of the `[llm]` section of config.ini.
+    """
+
+    def __init__(self, llm_client: BaseChatClient, provider: str) -> None:
+        self.llm_client = llm_client
+        self.provider = provider
+        self.request_timeout = float(get_from_env_or_config('llm', 'llm_request_timeout_seconds', 60))
+        self.max_retries = int(get_from_env_or_config('llm', 'llm_max_retries', 2))
+        self.limits = httpx.Limits(
+            max_connections=int(get_from_env_or_config('llm', 'llm_max_connections', 50)),
+            max_keepalive_connections=int(get_from_env_or_config('llm', 'llm_max_keepalive_connections', 20))
+        )
+        self.clients: Dict[Tuple, BaseChatModel] = {}
+        self.lock = threading.Lock()
+        self.http_client: Optional[httpx.Client] = None
+        self.async_http_client: Optional[httpx.AsyncClient] = None
+
+    @staticmethod
+    def _get_key(model: Optional[str], kwargs: Dict[str, Any]) -> Tuple:
+        return model, tuple(sorted((name, repr(value)) for name, value in kwargs.items()))
+
+    def get_client(self, model: Optional[str] = None, **kwargs: Any) -> BaseChatModel:
+        key = self._get_key(model, kwargs)
+        chat_model = self.clients.get(key)
+        if chat_model is not None:
+            increment("llm.client.reuse")
+            return chat_model
+        with self.lock:
+            chat_model = self.clients.get(key)
+            if chat_model is None:
+                chat_model = self.llm_client.get_client(model=model, **kwargs) if model else self.llm_client.get_client(**kwargs)
+                self._share_connection_pool(chat_model)
+                self.clients[key] = chat_model
+                increment("llm.client.create")
+                logger.info(f"Created {self.provider} chat client for {key}")
+        return chat_model
+
+    def _share_connection_pool(self, chat_model: BaseChatModel) -> None:
+        """
+        Points the OpenAI clients of a chat model at the provider wide connection pools.
+        """
+        # Only the openai>=1 clients (chat.completions resources) expose the underlying client
+        if not isinstance(chat_model, ChatOpenAI) or not hasattr(chat_model.client, "_client"):
+            return
+        if self.http_client is None:
+            self.http_client = httpx.Client(limits=self.limits, timeout=self.request_timeout)
+            self.async_http_client = httpx.AsyncClient(limits=self.limits, timeout=self.request_timeout)
+        options = {"timeout": self.request_timeout, "max_retries": self.max_retries}
+        chat_model.client = chat_model.client._client.with_options(http_client=self.http_client, **options).chat.completions
+        chat_model.async_client = chat_model.async_client._client.with_options(
+            http_client=self.async_http_client, **options).chat.completions
+        chat_model.request_timeout = self.request_timeout
+        chat_model.max_retries = self.max_retries
+
+    async def aclose(self) -> None:
+        if self.http_client is not None:
+            self.http_client.close()
+            await self.async_http_client.aclose()
+        await self.llm_client.aclose()
@@ -1,16 +1,20 @@
-import os
+import asyncio
 import json
+import signal
 from enum import Enum
-from dotenv import load_dotenv
 from pydantic import BaseModel
 from fastapi import FastAPI, HTTPException, status, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
-from utils import is_url, is_base64, prepare_redis_key, get_from_env_or_config
-from env_manager import storage_class as storage
+from utils import is_url, is_base64, prepare_redis_key, get_from_env_or_config, get_encoding, get_metrics, get_settings, reload_settings
+from env_manager import translate_class, storage_class, llm_class
+from redis_util import async_redis_client, check_redis_connection
 from io_processing import *
 from query_with_langchain import *
 from telemetry_middleware import TelemetryMiddleware
+from telemetry_logger import shutdown_telemetry
+from starlette.concurrency import run_in_threadpool
 
 
 app = FastAPI(
@@ -33,13 +37,24 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     logger.info('Invoking startup_event')
-    load_dotenv()
+    settings = reload_settings()
+    await check_redis_connection()
+    # Loads the tokenizer before the first request needs it
+    await run_in_threadpool(get_encoding, settings.model)
+    # `kill -HUP <pid>` reloads the configuration without a restart
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_settings)
     logger.info('startup_event : Engine created')
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info('Invoking shutdown_event')
+    await storage_class.wait_for_uploads(timeout=30)
+    await translate_class.aclose()
+    await llm_class.aclose()
+    await async_redis_client.aclose()
+    await run_in_threadpool(shutdown_telemetry, 30)
     logger.info('shutdown_event : Engine closed')
 
 Context = Enum("Context", {type: type for type in get_from_env_or_config('request', 'supported_context', None).split(',')})
@@ -106,60 +121,71 @@ def get_health() -> HealthCheck:
     return HealthCheck(status="OK")
 
 
-@app.post("/v1/query", tags=["Q&A over Document Store"], include_in_schema=True)
-async def query(request: QueryModel, x_request_id: str = Header(None, alias="X-Request-ID")) -> ResponseForQuery:
-    load_dotenv()
-    indices = json.loads(get_from_env_or_config('database', 'indices', None))
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Returns the in-process counters (cache hits and misses, etc.) of this worker.
+    """
+    return get_metrics()
+
+
+async def process_query_input(request: QueryModel):
+    """
+    Validates the query input and converts it to English text.
+
+    Returns:
+        A (language, context, output_format, index_id, query_text, text, is_audio) tuple.
+    """
     language = request.input.language.name
     context = request.input.context.name
     output_format = request.output.format.name
-    index_id = indices.get(context.lower())
+    index_id = get_settings().get_index_id(context)
     audio_url = request.input.audio
     query_text = request.input.text
     is_audio = False
-    text = None
-    regional_answer = None
-    audio_output_url = None
     logger.info({"label": "query", "query_text": query_text, "index_id": index_id, "context": context, "input_language": language, "output_format": output_format, "audio_url": audio_url})
     if not query_text and not audio_url:
         raise HTTPException(status_code=422, detail="Either 'text' or 'audio' should be present!")
 
     if query_text:
-        text, error_message = process_incoming_text(query_text, language)
+        text, error_message = await process_incoming_text(query_text, language)
         if output_format == "audio":
             is_audio = True
     else:
         if not is_url(audio_url) and not is_base64(audio_url):
             logger.error({"index_id": index_id, "query": query_text, "input_language": language, "output_format": output_format, "audio_url": audio_url, "status_code": status.HTTP_422_UNPROCESSABLE_ENTITY, "error_message": "Invalid audio input!"})
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid audio input!")
-        query_text, text, error_message = process_incoming_voice(audio_url, language)
+        query_text, text, error_message = await process_incoming_voice(audio_url, language)
         is_audio = True
-    
-    if text is not None:
-        answer, error_message, status_code = querying_with_langchain_gpt3(index_id, text, context)
-        if len(answer) != 0:
-            regional_answer, error_message = process_outgoing_text(answer, language)
-            logger.info({"regional_answer": regional_answer})
-            if regional_answer is not None:
-                if is_audio:
-                    output_file, error_message = process_outgoing_voice(regional_answer, language)
-                    if output_file is not None:
-                        storage.upload_to_storage(output_file.name)
-                        audio_output_url, error_message = storage.generate_public_url(output_file.name)
-                        logger.debug(f"Audio Ouput URL ===> {audio_output_url}")
-                        output_file.close()
-                        os.remove(output_file.name)
-                    else:
-                        status_code = 503
-                else:
-                    audio_output_url = ""
+
+    if text is None:
+        logger.error({"index_id": index_id, "query": query_text, "input_language": language, "output_format": output_format, "audio_url": audio_url, "status_code": 503, "error_message": error_message})
+        raise HTTPException(status_code=503, detail=error_message)
+    return language, context, output_format, index_id, query_text, text, is_audio
+
+
+@app.post("/v1/query", tags=["Q&A over Document Store"], include_in_schema=True)
+async def query(request: QueryModel, x_request_id: str = Header(None, alias="X-Request-ID")) -> ResponseForQuery:
+    language, context, output_format, index_id, query_text, text, is_audio = await process_query_input(request)
+    regional_answer = None
+    audio_output_url = None
+    answer, error_message, status_code = await querying_with_langchain_gpt3(index_id, text, context)
+    if len(answer) != 0:
+        regional_answer, error_message = await process_outgoing_text(answer, language)
+        logger.info({"regional_answer": regional_answer})
+        if regional_answer is not None:
+            if is_audio:
+                audio_output_url, error_message = await process_outgoing_voice(regional_answer, language)
+                logger.debug(f"Audio Ouput URL ===> {audio_output_url}")
+                if audio_output_url is None:
+                    status_code = 503
             else:
-                status_code = 503
-    else:
-        status_code = 503
+                audio_output_url = ""
+        else:
+            status_code = 503
 
     if status_code != 200:
-        logger.error({"index_id": index_id, "query": query_text, "input_language": language, "output_format": output_format, "audio_url": audio_url, "status_code": status_code, "error_message": error_message})
+        logger.error({"index_id": index_id, "query": query_text, "input_language": language, "output_format": output_format, "audio_url": request.input.audio, "status_code": status_code, "error_message": error_message})
         raise HTTPException(status_code=status_code, detail=error_message)
 
     response = ResponseForQuery(output=OutputResponse(text=regional_answer, audio=audio_output_url, language=language, format=output_format))
@@ -170,62 +196,92 @@ async def query(request: QueryModel, x_request_id: str = Header(None, alias="X-R
 async def chat(request: QueryModel, x_request_id: str = Header(None, alias="X-Request-ID"),
                 x_source: str = Header(None, alias="x-source"),
                 x_consumer_id: str = Header(None, alias="x-consumer-id")) -> ResponseForQuery:
-    load_dotenv()
-    indices = json.loads(get_from_env_or_config('database', 'indices', None))
-    language = request.input.language.name
-    context = request.input.context.name
-    output_format = request.output.format.name
-    index_id = indices.get(context.lower())
-    audio_url = request.input.audio
-    query_text = request.input.text
-    is_audio = False
-    text = None
+    language, context, output_format, index_id, query_text, text, is_audio = await process_query_input(request)
     regional_answer = None
     audio_output_url = None
-    logger.info({"label": "query", "query_text": query_text, "index_id": index_id, "context": context, "input_language": language, "output_format": output_format, "audio_url": audio_url})
     redis_session_id  = prepare_redis_key(x_source, x_consumer_id, context)
     logger.info(f"Redis session ID :: {redis_session_id} ")
-    if not query_text and not audio_url:
-        raise HTTPException(status_code=422, detail="Either 'text' or 'audio' should be present!")
-
-    if query_text:
-        text, error_message = process_incoming_text(query_text, language)
-        if output_format == "audio":
-            is_audio = True
-    else:
-        if not is_url(audio_url) and not is_base64(audio_url):
-            logger.error({"index_id": index_id, "query": query_text, "input_language": language, "output_format": output_format, "audio_url": audio_url, "status_code": status.HTTP_422_UNPROCESSABLE_ENTITY, "error_message": "Invalid audio input!"})
-            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid audio input!")
-        query_text, text, error_message = process_incoming_voice(audio_url, language)
-        is_audio = True
-    
-    if text is not None:
-        answer, error_message, status_code = conversation_retrieval_chain(index_id, text, redis_session_id, context)
-        if len(answer) != 0:
-            regional_answer, error_message = process_outgoing_text(answer, language)
-            logger.info({"regional_answer": regional_answer})
-            if regional_answer is not None:
-                if is_audio:
-                    output_file, error_message = process_outgoing_voice(regional_answer, language)
-                    if output_file is not None:
-                        storage.upload_to_storage(output_file.name)
-                        audio_output_url, error_message = storage.generate_public_url(output_file.name)
-                        logger.debug(f"Audio Ouput URL ===> {audio_output_url}")
-                        output_file.close()
-                        os.remove(output_file.name)
-                    else:
-                        status_code = 503
-                else:
-                    audio_output_url = ""
+    answer, error_message, status_code = await conversation_retrieval_chain(index_id, text, redis_session_id, context)
+    if len(answer) != 0:
+        regional_answer, error_message = await process_outgoing_text(answer, language)
+        logger.info({"regional_answer": regional_answer})
+        if regional_answer is not None:
+            if is_audio:
+                audio_output_url, error_message = await process_outgoing_voice(regional_answer, language)
+                logger.debug(f"Audio Ouput URL ===> {audio_output_url}")
+                if audio_output_url is None:
+                    status_code = 503
             else:
-                status_code = 503
-    else:
-        status_code = 503
+                audio_output_url = ""
+        else:
+            status_code = 503
 
     if status_code != 200:
-        logger.error({"index_id": index_id, "query": query_text, "input_language": language, "output_format": output_format, "audio_url": audio_url, "status_code": status_code, "error_message": error_message})
+        logger.error({"index_id": index_id, "query": query_text, "input_language": language, "output_format": output_format, "audio_url": request.input.audio, "status_code": status_code, "error_message": error_message})
         raise HTTPException(status_code=status_code, detail=error_message)
 
     response = ResponseForQuery(output=OutputResponse(text=regional_answer, audio=audio_output_url, language=language, format=output_format))
     logger.info({"x_request_id": x_request_id, "query": query_text, "text": text, "response": response})
     return response
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def format_sse_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+async def stream_regional_answer(answer_chunks, language, output_format, is_audio, x_request_id):
+    """
+    Translates a streamed English answer sentence by sentence and emits it as Server-Sent Events.
+
+    Events:
+        segment: {"text": "<translated sentence>"}, one per sentence, in order.
+        done: the same payload as the non streaming endpoint, including the audio URL.
+        error: {"status_code": ..., "detail": ...}, ends the stream.
+    """
+    segments = []
+    try:
+        async for regional_text, error_message in stream_outgoing_text(split_sentences(answer_chunks), language):
+            if regional_text is None:
+                yield format_sse_event("error", json.dumps({"status_code": 503, "detail": error_message}))
+                return
+            segments.append(regional_text)
+            yield format_sse_event("segment", json.dumps({"text": regional_text}, ensure_ascii=False))
+
+        regional_answer = " ".join(segments)
+        audio_output_url = ""
+        if is_audio:
+            audio_output_url, error_message = await process_outgoing_voice(regional_answer, language)
+            if audio_output_url is None:
+                yield format_sse_event("error", json.dumps({"status_code": 503, "detail": error_message}))
+                return
+    except Exception as e:
+        logger.error(f"Exception occurred while streaming the answer: {e}", exc_info=True)
+        yield format_sse_event("error", json.dumps({"status_code": 500, "detail": str(e)}))
+        return
+
+    response = ResponseForQuery(output=OutputResponse(text=regional_answer, audio=audio_output_url, language=language, format=output_format))
+    logger.info({"x_request_id": x_request_id, "response": response})
+    yield format_sse_event("done", response.json(ensure_ascii=False))
+
+
+@app.post("/v1/query/stream", tags=["Q&A over Document Store"], include_in_schema=True)
+async def query_stream(request: QueryModel, x_request_id: str = Header(None, alias="X-Request-ID")) -> StreamingResponse:
+    language, context, output_format, index_id, query_text, text, is_audio = await process_query_input(request)
+    answer_chunks = stream_answer(index_id, text, context)
+    return StreamingResponse(stream_regional_answer(answer_chunks, language, output_format, is_audio, x_request_id),
+                             media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/v1/chat/stream", tags=["Conversation chat over Document Store"], include_in_schema=True)
+async def chat_stream(request: QueryModel, x_request_id: str = Header(None, alias="X-Request-ID"),
+                      x_source: str = Header(None, alias="x-source"),
+                      x_consumer_id: str = Header(None, alias="x-consumer-id")) -> StreamingResponse:
+    language, context, output_format, index_id, query_text, text, is_audio = await process_query_input(request)
+    redis_session_id = prepare_redis_key(x_source, x_consumer_id, context)
+    logger.info(f"Redis session ID :: {redis_session_id} ")
+    answer_chunks = stream_conversation(index_id, text, redis_session_id, context)
+    return StreamingResponse(stream_regional_answer(answer_chunks, language, output_format, is_audio, x_request_id),
+                             media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,79 @@
+"""
+Moves the pickled chat histories written by previous versions (`msg_*` keys) to the
+Redis list format used by the chat API, keeping the last `--max_messages` messages.
+
+Sessions are also migrated lazily on their next chat turn, so running this is optional.
+It frees the memory held by inactive sessions without waiting for their TTL.
+"""
+import argparse
+
+from redis_util import (
+    decode_legacy_messages,
+    encode_message,
+    get_history_key,
+    get_legacy_history_key,
+    get_redis_client,
+    USE_TRANSACTIONS
+)
+from utils import get_from_env_or_config
+
+LEGACY_PREFIX = get_legacy_history_key("")
+
+
+def migrate_chat_history(max_length: int, batch_size: int, dry_run: bool):
+    redis_client = get_redis_client()
+    migrated = skipped = 0
+    for legacy_key in redis_client.scan_iter(match=f"{LEGACY_PREFIX}*", count=batch_size):
+        # Legacy keys were written without the hash tag of the session key
+        session_id = "{" + legacy_key.decode()[len(LEGACY_PREFIX):] + "}"
+        compressed_data = redis_client.get(legacy_key)
+        ttl = redis_client.ttl(legacy_key)
+        if compressed_data is None or ttl == -2:
+            continue  # Expired or migrated by the API meanwhile
+        history_key = get_history_key(session_id)
+        if redis_client.exists(history_key):
+            # The session already has a new history, the blob is stale
+            skipped += 1
+            if not dry_run:
+                redis_client.delete(legacy_key)
+            continue
+
+        messages = decode_legacy_messages(compressed_data)[-max_length:]
+        migrated += 1
+        if dry_run:
+            continue
+        with redis_client.pipeline(transaction=USE_TRANSACTIONS) as pipe:
+            if messages:
+                pipe.rpush(history_key, *[encode_message(message) for message in messages])
+                if ttl > 0:
+                    pipe.expire(history_key, ttl)
+            pipe.delete(legacy_key)
+            pipe.execute()
+    print(f"{'Would migrate' if dry_run else 'Migrated'} {migrated} sessions, {skipped} stale legacy keys")
+
+
+def main():
+    max_messages = int(get_from_env_or_config('llm', 'max_messages', 4))
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_messages',
+                        type=int,
+                        default=max_messages * 2,
+                        help='Number of most recent messages to keep per session'
+                        )
+    parser.add_argument('--batch_size',
+                        type=int,
+                        default=500,
+                        help='Keys fetched per SCAN call'
+                        )
+    parser.add_argument('--dry_run',
+                        action='store_true',
+                        help='Only count the sessions to migrate'
+                        )
+    args = parser.parse_args()
+    migrate_chat_history(args.max_messages, args.batch_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
+
+# python3 migrate_chat_history.py --dry_run
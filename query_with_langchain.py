@@ -1,116 +1,221 @@
-import ast
+import asyncio
+import re
 from typing import (
     Any,
     List,
     Tuple
 )
-import tiktoken
-from dotenv import load_dotenv
 from langchain.docstore.document import Document
-from env_manager import llm_class, vectorstore_class
-from utils import convert_chat_messages, get_from_env_or_config
+from env_manager import llm_class, vectorstore_class, intent_classifier
+from utils import (
+    convert_chat_messages,
+    count_message_tokens,
+    count_text_tokens,
+    get_from_env_or_config,
+    get_settings,
+    increment,
+    make_cache_key,
+    TwoTierCache
+)
+from utils.tokens import TOKENS_PER_REPLY
 from logger import logger
-from redis_util import read_messages_from_redis, store_messages_in_redis
-
-load_dotenv()
-temperature = float(get_from_env_or_config("llm", "temperature"))
-chatClient  = llm_class.get_client(temperature=temperature)
-max_messages = int(get_from_env_or_config("llm", "max_messages")) # Maximum number of messages to include in conversation history
-
-def querying_with_langchain_gpt3(index_id, query, context):
-    intent_response = check_bot_intent(query, context)
-    if intent_response:
-        return intent_response, None, 200
-    
+from redis_util import append_chat_turn, async_redis_client, read_chat_history
+from answer_cache import answer_cache, get_answer_cache_key
+
+def get_chat_client():
+    """Returns the chat client for the configured temperature, reused across requests by the registry."""
+    return llm_class.get_client(temperature=get_settings().temperature)
+
+rewrite_cache = TwoTierCache(
+    "rewrite",
+    async_redis_client,
+    ttl=int(get_from_env_or_config('cache', 'rewrite_cache_ttl', 43200)),
+    max_size=int(get_from_env_or_config('cache', 'rewrite_cache_max_size', 1024)),
+    enabled=get_from_env_or_config('cache', 'rewrite_cache_enabled', 'true').lower() == "true"
+)
+SKIP_SELF_CONTAINED_REWRITE = get_from_env_or_config('llm', 'skip_self_contained_rewrite', 'true').lower() == "true"
+REWRITE_TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+MIN_SELF_CONTAINED_WORDS = 4
+# Words that usually point back to something said earlier in the conversation
+CONTEXT_DEPENDENT_WORDS = frozenset([
+    "it", "its", "it's", "this", "that", "these", "those", "they", "them", "their", "theirs",
+    "he", "him", "his", "she", "her", "hers", "one", "ones", "same", "such", "above", "previous",
+    "earlier", "mentioned", "another", "else", "again", "more", "other", "others", "instead", "former", "latter"
+])
+CONTEXT_DEPENDENT_PREFIXES = ("and ", "also ", "then ", "so ", "but ", "what about ", "how about ", "what if ")
+
+# Shortest shared text considered an overlap between two chunks of a page
+MIN_CHUNK_OVERLAP = 20
+PAGE_SEGMENT_SEPARATOR = "\n...\n"
+
+NO_DOCUMENTS_ANSWER = "I'm sorry, but I am not currently trained with relevant documents to provide a specific answer for your question."
+
+async def querying_with_langchain_gpt3(index_id, query, context):
+    cache_key = await get_answer_cache_key(context, index_id, query)
+    cached_answer = await answer_cache.get(cache_key)
+    if cached_answer is not None:
+        logger.info({"label": "answer_cache_hit", "query": query, "context": context})
+        return cached_answer, None, 200
+
+    answer, error_message, status_code = await generate_answer(index_id, query, context)
+    if status_code == 200 and answer:
+        await answer_cache.set(cache_key, answer)
+    return answer, error_message, status_code
+
+async def generate_answer(index_id, query, context):
     try:
-        system_rules = ""
-        activity_prompt_config = get_from_env_or_config("llm", "activity_prompt", None)
-        logger.debug(f"activity_prompt_config: {activity_prompt_config}")
-        if activity_prompt_config:
-            activity_prompt_dict = ast.literal_eval(activity_prompt_config)
-            system_rules = activity_prompt_dict.get(context)
-
-        top_docs_to_fetch = get_from_env_or_config("database", "top_docs_to_fetch", None)
-        documents = vectorstore_class.similarity_search_with_score(query, index_id, k=20)
-        logger.debug(f"Marqo documents : {str(documents)}")
-        min_score = get_from_env_or_config("database", "docs_min_score", None)
-        filtered_document = get_score_filtered_documents(documents, float(min_score))
-        filtered_document = filtered_document[:int(top_docs_to_fetch)]
-        logger.info(f"Score filtered documents : {str(filtered_document)}")
-        contexts = get_formatted_documents(filtered_document)
-        if not documents or not contexts:
-            return "I'm sorry, but I am not currently trained with relevant documents to provide a specific answer for your question.", None, 200
-
-        system_rules = system_rules.format(contexts=contexts)
-        logger.debug("==== System Rules ====")
-        logger.debug(f"System Rules : {system_rules}")
-        response = call_chat_model(
-            messages=[
-                {"role": "system", "content": system_rules},
-                {"role": "user", "content": query}
-            ]
-        )
-        logger.info({"label": "llm_response", "response": response})
-        return response.strip(";"), None, 200
+        message_payload, answer = await get_query_message_payload(index_id, query, context)
+        if answer is None:
+            response = await call_chat_model(message_payload)
+            logger.info({"label": "llm_response", "response": response})
+            answer = response.strip(";")
+        return answer, None, 200
     except Exception as e:
         error_message = str(e.__context__) + " and " + e.__str__()
         status_code = 500
 
     return "", error_message, status_code
 
-def conversation_retrieval_chain(index_id, query, session_id, context):
-    intent_response = check_bot_intent(query, context)
-    if intent_response:
-        return intent_response, None, 200
-    
+async def stream_answer(index_id, query, context):
+    """
+    Streams the answer to a query as text chunks, as soon as the chat model produces them.
+    """
+    cache_key = await get_answer_cache_key(context, index_id, query)
+    cached_answer = await answer_cache.get(cache_key)
+    if cached_answer is not None:
+        logger.info({"label": "answer_cache_hit", "query": query, "context": context})
+        yield cached_answer
+        return
+
+    message_payload, answer = await get_query_message_payload(index_id, query, context)
+    if answer is None:
+        chunks = []
+        async for chunk in stream_chat_model(message_payload):
+            chunks.append(chunk)
+            yield chunk
+        answer = "".join(chunks)
+        logger.info({"label": "llm_response", "response": answer})
+    else:
+        yield answer
+    answer = answer.strip(";")
+    if answer:
+        await answer_cache.set(cache_key, answer)
+
+async def get_query_message_payload(index_id, query, context):
+    """
+    Builds the chat model messages for a single question.
+
+    Returns:
+        A (message_payload, answer) tuple. `answer` is set instead of the payload when
+        no answer call is needed (bot persona question or no relevant documents).
+    """
+    return await run_with_bot_intent_check(query, context, build_query_message_payload(index_id, query, context))
+
+async def build_query_message_payload(index_id, query, context):
+    settings = get_settings()
+    system_rules = settings.activity_prompts.get(context, "")
+    # The score threshold and the number of documents are applied by the vector store
+    filtered_document = await vectorstore_class.asimilarity_search_with_score(query, index_id, k=settings.top_docs_to_fetch,
+                                                                              min_score=settings.docs_min_score)
+    logger.info(f"Score filtered documents : {str(filtered_document)}")
+    user_message = {"role": "user", "content": query}
+    contexts = pack_documents(filtered_document, get_context_token_budget(system_rules, user_message))
+    if not filtered_document or not contexts:
+        return None, NO_DOCUMENTS_ANSWER
+
+    system_rules = system_rules.format(contexts=contexts)
+    logger.debug("==== System Rules ====")
+    logger.debug(f"System Rules : {system_rules}")
+    return [
+        {"role": "system", "content": system_rules},
+        user_message
+    ], None
+
+async def conversation_retrieval_chain(index_id, query, session_id, context):
     try:
-        system_rules = ""
-        activity_prompt_config = get_from_env_or_config("llm", "activity_prompt", None)
-        logger.debug(f"activity_prompt_config: {activity_prompt_config}")
-        activity_prompt_dict = ast.literal_eval(activity_prompt_config)
-        system_rules = activity_prompt_dict.get(context)
-        previous_messages  = read_messages_from_redis(session_id)
-        formatted_messages = format_previous_messages(previous_messages)
-        user_message = {"role":"user","content": query}
-        intent_system_prompt = get_chat_intent_prompt()
-        intent_payload = create_payload_by_message_count(user_message, intent_system_prompt, messages=formatted_messages, max_messages=max_messages)
-        logger.debug(f"intent_payload :: {intent_payload}")
-        search_intent = get_intent_query(intent_payload)
-        logger.info(f"search_intent :: {search_intent}")
-        documents = vectorstore_class.similarity_search_with_score(search_intent, index_id, k=20)
-        logger.debug(f"Marqo documents : {str(documents)}")
-        min_score = get_from_env_or_config("database", "docs_min_score", None)
-        filtered_document = get_score_filtered_documents(documents, float(min_score))
-        top_docs_to_fetch = get_from_env_or_config("database", "top_docs_to_fetch", None)
-        filtered_document = filtered_document[:int(top_docs_to_fetch)]
-        logger.info(f"Score filtered documents : {str(filtered_document)}")
-        contexts = get_formatted_documents(filtered_document)
-        if not documents or not contexts:
-            return "I'm sorry, but I am not currently trained with relevant documents to provide a specific answer for your question.", None, 200
-
-        system_rules = system_rules.format(contexts=contexts)
-        system_rules = {"role": "system", "content": system_rules}
-        logger.debug(f"System Rules : {system_rules}")
-        message_payload  = create_payload_by_message_count(user_message,system_rules,formatted_messages,max_messages=max_messages)
-        logger.debug(f"message_payload :: {message_payload}")
-        response = call_chat_model(message_payload)
-        logger.info({"label": "llm_response", "response": response})
-        assistant_message = format_assistant_message(response.strip(";"))
-        messages = read_messages_from_redis(session_id)
-        messages.extend([user_message,assistant_message])
-        store_messages_in_redis(session_id, messages)
-        return response.strip(";"), None, 200
+        message_payload, answer = await get_chat_message_payload(index_id, query, session_id, context)
+        if answer is None:
+            response = await call_chat_model(message_payload)
+            logger.info({"label": "llm_response", "response": response})
+            answer = response.strip(";")
+            await save_chat_turn(session_id, message_payload[-1], answer)
+        return answer, None, 200
     except Exception as e:
         error_message = str(e.__context__) + " and " + e.__str__()
         status_code = 500
 
     return "", error_message, status_code
 
-def call_chat_model(messages: List[dict]) -> str:
+async def stream_conversation(index_id, query, session_id, context):
+    """
+    Streams the answer to a chat turn as text chunks and stores the turn once it is complete.
+    """
+    message_payload, answer = await get_chat_message_payload(index_id, query, session_id, context)
+    if answer is not None:
+        yield answer
+        return
+
+    chunks = []
+    async for chunk in stream_chat_model(message_payload):
+        chunks.append(chunk)
+        yield chunk
+    answer = "".join(chunks)
+    logger.info({"label": "llm_response", "response": answer})
+    await save_chat_turn(session_id, message_payload[-1], answer.strip(";"))
+
+async def get_chat_message_payload(index_id, query, session_id, context):
+    """
+    Builds the chat model messages for a conversation turn, including the previous messages of the session.
+
+    Returns:
+        A (message_payload, answer) tuple, see `get_query_message_payload`.
+        The last message of the payload is the user message.
+    """
+    return await run_with_bot_intent_check(query, context, build_chat_message_payload(index_id, query, session_id, context))
+
+async def build_chat_message_payload(index_id, query, session_id, context):
+    settings = get_settings()
+    system_rules = settings.activity_prompts.get(context, "")
+    previous_messages  = await read_chat_history(session_id, settings.max_messages * 2)
+    formatted_messages = format_previous_messages(previous_messages)
+    user_message = {"role":"user","content": query}
+    search_intent = await get_search_query(session_id, query, formatted_messages, settings.max_messages)
+    logger.info(f"search_intent :: {search_intent}")
+    # The score threshold and the number of documents are applied by the vector store
+    filtered_document = await vectorstore_class.asimilarity_search_with_score(search_intent, index_id, k=settings.top_docs_to_fetch,
+                                                                              min_score=settings.docs_min_score)
+    logger.info(f"Score filtered documents : {str(filtered_document)}")
+    contexts = pack_documents(filtered_document, get_context_token_budget(system_rules, user_message))
+    if not filtered_document or not contexts:
+        return None, NO_DOCUMENTS_ANSWER
+
+    system_rules = system_rules.format(contexts=contexts)
+    system_rules = {"role": "system", "content": system_rules}
+    logger.debug(f"System Rules : {system_rules}")
+    # The history fills what is left of the prompt token budget after the documents
+    message_payload  = create_message_payload(user_message, system_rules, formatted_messages,
+                                              max_tokens=settings.prompt_token_budget, max_messages=settings.max_messages)
+    logger.debug(f"message_payload :: {message_payload}")
+    return message_payload, None
+
+async def save_chat_turn(session_id, user_message, answer):
+    settings = get_settings()
+    messages = [user_message, format_assistant_message(answer)]
+    # Stored with the token count of the message as it appears in later prompts, so it is never counted again
+    messages = [{**message, "tokens": count_message_tokens(format_previous_message(message), settings.model)} for message in messages]
+    await append_chat_turn(session_id, messages, settings.max_messages * 2)
+
+async def call_chat_model(messages: List[dict]) -> str:
     converted_messsages = convert_chat_messages(messages)
-    response = chatClient.invoke(input=converted_messsages)
+    response = await get_chat_client().ainvoke(input=converted_messsages)
     return response.content
 
+async def stream_chat_model(messages: List[dict]):
+    converted_messsages = convert_chat_messages(messages)
+    async for chunk in get_chat_client().astream(input=converted_messsages):
+        if chunk.content:
+            yield chunk.content
+
 def format_assistant_message(a):
     """Formats the assistant message
     Args:
@@ -120,11 +225,51 @@ def format_assistant_message(a):
     """
     return {'role': 'assistant', 'content': a.strip()}
 
+def is_self_contained_query(query: str) -> bool:
+    """
+    Cheap check that a follow-up question can be searched as is, without the conversation.
+
+    A query is considered self-contained when it has enough words and no pronoun, demonstrative
+    or continuation phrase that would refer back to the previous messages.
+    """
+    words = REWRITE_TOKEN_PATTERN.findall(query.lower())
+    if len(words) < MIN_SELF_CONTAINED_WORDS:
+        return False
+    if any(word in CONTEXT_DEPENDENT_WORDS for word in words):
+        return False
+    return not any(" ".join(words).startswith(prefix) for prefix in CONTEXT_DEPENDENT_PREFIXES)
+
+async def get_search_query(session_id, query, formatted_messages, max_messages):
+    """
+    Returns the standalone search query for a chat turn.
+
+    The LLM rewrite is skipped on the first turn and for self-contained questions,
+    and rewrites are memoized per (session, recent history, query).
+    """
+    if not formatted_messages:
+        increment("rewrite.skip.no_history")
+        return query
+    if SKIP_SELF_CONTAINED_REWRITE and is_self_contained_query(query):
+        increment("rewrite.skip.self_contained")
+        return query
+
+    user_message = {"role": "user", "content": query}
+    intent_payload = create_message_payload(user_message, get_chat_intent_prompt(), formatted_messages,
+                                            max_tokens=get_settings().prompt_token_budget, max_messages=max_messages)
+    logger.debug(f"intent_payload :: {intent_payload}")
+    # The payload holds the prompt, the history window actually used and the query
+    cache_key = make_cache_key("rewrite", session_id, intent_payload)
+    search_query = await rewrite_cache.get(cache_key)
+    if search_query is None:
+        increment("rewrite.llm")
+        search_query = await get_intent_query(intent_payload)
+        await rewrite_cache.set(cache_key, search_query)
+    return search_query
+
 def get_chat_intent_prompt():
-    intent_prompt = get_from_env_or_config("llm", "chat_intent_prompt")
-    return {'role': "system", 'content': intent_prompt }
+    return {'role': "system", 'content': get_settings().chat_intent_prompt }
 
-def get_intent_query(messages=[]):
+async def get_intent_query(messages=[]):
     """    
     Force function calling with openai.ChatCompletion.create()
 
@@ -158,7 +303,7 @@ def get_intent_query(messages=[]):
     # )
     clientIntent = llm_class.get_client(temperature=0.1)
     converted_messsages = convert_chat_messages(messages)
-    response = clientIntent.invoke(input=converted_messsages)
+    response = await clientIntent.ainvoke(input=converted_messsages)
 
     # message = response.choices[0].message
     # function_call = message.function_call
@@ -169,17 +314,17 @@ def get_intent_query(messages=[]):
 
 
 
-def count_tokens_str(doc, model="gpt-4"):
+def count_tokens_str(doc, model=None):
     """Count tokens in a string.
 
     Args:
         doc (str): String to count tokens for.
+        model (str, optional): Model whose tokenizer to use. Defaults to the configured chat model.
     Returns:
         int: number of tokens in the string
 
     """
-    encoder = tiktoken.encoding_for_model(model)  # BPE encoder # type: ignore
-    return len(encoder.encode(doc, disallowed_special=()))
+    return count_text_tokens(doc, model or get_settings().model)
 
 def count_tokens(messages):
     """
@@ -187,20 +332,13 @@ def count_tokens(messages):
     Source: https://platform.openai.com/docs/guides/chat/introduction
 
     Args:
-        messages (list): list of messages to count tokens for
+        messages (list): list of messages to count tokens for. Token counts stored with
+            history messages are used as is.
     Returns:
         int: number of tokens in the list of messages
     """
-    num_tokens = 0
-    for message in messages:
-        # every message follows <im_start>{role/name}\n{content}<im_end>\n
-        num_tokens += 4
-        for key, value in message.items():
-            num_tokens += count_tokens_str(value)
-            if key == "name":  # if there's a name, the role is omitted
-                num_tokens += -1  # role is always required and always 1 token
-    num_tokens += 2  # every reply is primed with <im_start>assistant
-    return num_tokens
+    model = get_settings().model
+    return sum(count_message_tokens(message, model) for message in messages) + TOKENS_PER_REPLY
 
 def create_payload_by_message_count(user_message, system_message, messages=[], max_messages=4):  # IMPORTANT
     """Get the message history for the conversation, limited by message count.
@@ -216,101 +354,213 @@ def create_payload_by_message_count(user_message, system_message, messages=[], m
     """
     message_history = [system_message]
     total_count =  max_messages * 2
-    message_history.extend(messages[-total_count:])
+    message_history.extend(without_token_count(message) for message in messages[-total_count:])
     message_history.append(user_message)
     return message_history
 
-def create_message_payload(user_message, system_message, messages=[], max_tokens=3000):  # IMPORTANT
-    """Get the message history for the conversation.
-    # NOTE: Include user message {role=user,content=user_q} in the message history
+def create_message_payload(user_message, system_message, messages=[], max_tokens=3000, max_messages=None):  # IMPORTANT
+    """Get the message history for the conversation, limited by a token budget.
 
     Args:
-        message_payload (dict, optional): Formatted RAG prompt to add (temporarily) to the conversation. Defaults to {}.
-        max_tokens (int, optional): Maximum number of tokens to limit the message history to. Defaults to 3000.
+        user_message (dict): User message, always added at the end of the payload.
+        system_message (dict): System message, always added at the beginning of the payload.
+        messages (list, optional): List of previous messages. Defaults to [].
+        max_tokens (int, optional): Token budget of the whole payload. Defaults to 3000.
+        max_messages (int, optional): Maximum number of question/answer pairs to include. Defaults to no limit.
 
     Returns:
         list: message history
 
-    NOTE: 
-        - System-Prompt is always added to the beginning of the message history
-        - message_payload is added to the end of the message history (if provided)
-
+    NOTE:
+        - The most recent previous messages are kept, as many as fit in what the system
+          and user messages leave of the budget.
+        - Previous messages are counted with their stored token count when they have one.
     """
-    message_history = []
-    total_tokens = 0
-    system_token_count = count_tokens([system_message])
-    max_tokens -= system_token_count  # subtract the system prompt tokens
-    if len(user_message) > 0:
-        messages = messages + [user_message]
-    else:
-        messages = messages
+    if max_messages is not None:
+        messages = messages[-max_messages * 2:]
+    remaining_tokens = max_tokens - count_tokens([system_message, user_message] if user_message else [system_message])
+    model = get_settings().model
 
+    message_history = []
     for message in reversed(messages):
-        message_tokens = count_tokens([message])
-        if total_tokens + message_tokens <= max_tokens:
-            total_tokens += message_tokens
-            # This inserts the message at the beginning of the list
-            message_history.insert(0, message)
-        else:
+        message_tokens = count_message_tokens(message, model)
+        if message_tokens > remaining_tokens:
+            increment("prompt.history.truncated")
             break
+        remaining_tokens -= message_tokens
+        message_history.append(without_token_count(message))
+    message_history.reverse()
     message_history.insert(0, system_message)
+    if user_message:
+        message_history.append(user_message)
     return message_history
 
+def without_token_count(message):
+    return {key: value for key, value in message.items() if key != "tokens"}
+
+def format_previous_message(message):
+    """
+    Formats a stored message the way it is sent as conversation history, or returns None to leave it out.
+    """
+    if message['role'] == 'user':
+        return {"role": "user", "content": f"Question: {message['content']}"}
+    elif message['role'] == 'assistant':
+        return {"role": "assistant", "content": message['content']}
+    return None
+
 def format_previous_messages(messages):
     """
-    Format previous messages for display
+    Format previous messages for display, keeping their stored token counts
     """
     formatted_messages = []
     for message in messages:
-        if message['role'] == 'user':
-            formatted_messages.append({"role":"user", "content":f"Question: {message['content']}"})
-        elif message['role'] == 'assistant':
-            formatted_messages.append({"role":"assistant", "content":message['content']})
+        formatted_message = format_previous_message(message)
+        if formatted_message is not None:
+            if "tokens" in message:
+                formatted_message["tokens"] = message["tokens"]
+            formatted_messages.append(formatted_message)
     return formatted_messages
 
 
-def check_bot_intent(query: str, context: str):
+async def run_with_bot_intent_check(query: str, context: str, build_payload):
+    """
+    Builds the message payload while checking, concurrently, whether the query is about the bot persona.
+
+    Retrieval and prompt assembly run speculatively during the intent call. If the query
+    is about the bot, the speculative work is cancelled and the persona answer is returned.
 
-    enable_bot_intent = get_from_env_or_config("llm", "enable_bot_intent", None)
-    logger.debug(f"enable_bot_intent: {enable_bot_intent}")
-    if enable_bot_intent.lower() == "false":
-        return None
+    Returns:
+        A (message_payload, answer) tuple, see `get_query_message_payload`.
+    """
+    if not get_settings().enable_bot_intent:
+        return await build_payload
 
-    intent_prompt = get_from_env_or_config("llm", "intent_prompt")
-    intent_response = call_chat_model(
-        messages=[{"role": "system", "content": intent_prompt}, {"role": "user", "content": query}]
+    payload_task = asyncio.ensure_future(build_payload)
+    # A failed payload is ignored when the persona answer wins, do not report it as unretrieved
+    payload_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    try:
+        if await is_bot_intent(query):
+            payload_task.cancel()
+            return None, await get_bot_response(query, context)
+        return await payload_task
+    finally:
+        payload_task.cancel()
+
+
+async def is_bot_intent(query: str) -> bool:
+    prediction = await intent_classifier.apredict(query)
+    logger.info({"label": "intent_prediction", "is_bot_intent": prediction.is_bot_intent,
+                 "confidence": prediction.confidence, "source": prediction.source})
+    return prediction.is_bot_intent
+
+
+async def get_bot_response(query: str, context: str):
+    system_rules = get_settings().bot_prompts.get(context)
+    logger.debug(f"Intent System Rules : {system_rules}")
+    response = await call_chat_model(
+        messages=[
+            {"role": "system", "content": system_rules},
+            {"role": "user", "content": query}
+        ]
     )
-    logger.info({"label": "intent_response", "intent_response": intent_response})
-    if intent_response.lower() == "yes":
-        bot_prompt_config = get_from_env_or_config("llm", "bot_prompt", "")
-        logger.debug(f"bot_prompt_config: {bot_prompt_config}")
-        bot_prompt_dict = ast.literal_eval(bot_prompt_config)
-        system_rules = bot_prompt_dict.get(context)
-        logger.debug(f"Intent System Rules : {system_rules}")
-        response = call_chat_model(
-            messages=[
-                {"role": "system", "content": system_rules},
-                {"role": "user", "content": query}
-            ]
-        )
-        logger.info({"label": "llm_bot_response", "bot_response": response})
-        return response
-    else:
-        return None
-            
- 
+    logger.info({"label": "llm_bot_response", "bot_response": response})
+    return response
+
 
 def get_score_filtered_documents(documents: List[Tuple[Document, Any]], min_score=0.0):
     return [(document, search_score) for document, search_score in documents if search_score > min_score]
 
 
+def format_source(text: str, file_name: Any, page_label: Any) -> str:
+    return f"> {text.strip()}\nSource: {file_name},  page# {page_label};\n\n"
+
+
+def format_document(document: Document) -> str:
+    return format_source(document.page_content, document.metadata.get('file_name'), document.metadata.get('page_label'))
+
+
 def get_formatted_documents(documents: List[Tuple[Document, Any]]):
-    sources = ""
+    return "".join(format_document(document) for document, _ in documents)
+
+
+def merge_overlapping_text(first: str, second: str):
+    """
+    Joins two chunks when one contains the other or the end of `first` is the start of
+    `second`, as with neighbouring chunks of `split_documents`. Returns None otherwise.
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    head = second[:MIN_CHUNK_OVERLAP]
+    start = first.find(head, max(0, len(first) - len(second)))
+    while start != -1:
+        if second.startswith(first[start:]):
+            return first + second[len(first) - start:]
+        start = first.find(head, start + 1)
+    return None
+
+
+def merge_page_segments(segments: List[str], text: str) -> List[str]:
+    """Adds a chunk to the segments of a page, merging it with every segment it overlaps."""
+    for i, segment in enumerate(segments):
+        merged = merge_overlapping_text(segment, text) or merge_overlapping_text(text, segment)
+        if merged is not None:
+            increment("prompt.documents.merged")
+            return merge_page_segments(segments[:i] + segments[i + 1:], merged)
+    return segments + [text]
+
+
+def get_context_passages(documents: List[Tuple[Document, Any]]) -> List[Tuple[str, Any, Any]]:
+    """
+    Groups the hits by page, best page first, and removes the text they share.
+
+    Duplicate and contained chunks are dropped, overlapping neighbours are merged, and the
+    remaining segments of a page are joined under a single source line.
+
+    Returns:
+        A list of (text, file_name, page_label) passages in score order.
+    """
+    pages = {}
     for document, _ in documents:
-        sources += f"""
-            > {document.page_content} \n Source: {document.metadata['file_name']},  page# {document.metadata['page_label']};\n\n
-            """
-    return sources
+        text = document.page_content.strip()
+        page = (document.metadata.get('file_name'), document.metadata.get('page_label'))
+        if page not in pages:
+            pages[page] = [text]
+        elif any(text in segment for segment in pages[page]):
+            increment("prompt.documents.deduplicated")
+        else:
+            pages[page] = merge_page_segments(pages[page], text)
+    return [(PAGE_SEGMENT_SEPARATOR.join(segments), file_name, page_label)
+            for (file_name, page_label), segments in pages.items()]
+
+
+def get_context_token_budget(system_prompt: str, user_message: dict) -> int:
+    """
+    Returns how many tokens of the prompt budget are left for the documents once the
+    system prompt and the user message are in.
+    """
+    empty_prompt = {"role": "system", "content": system_prompt.format(contexts="")}
+    return get_settings().prompt_token_budget - count_tokens([empty_prompt, user_message])
+
+
+def pack_documents(documents: List[Tuple[Document, Any]], max_tokens: int) -> str:
+    """
+    Formats the documents as deduplicated passages, one per page, and adds them best
+    score first as long as they fit in `max_tokens`. A passage that does not fit is
+    skipped so that a shorter one with a lower score can still be used.
+    """
+    model = get_settings().model
+    sources = []
+    for text, file_name, page_label in get_context_passages(documents):
+        source = format_source(text, file_name, page_label)
+        source_tokens = count_text_tokens(source, model)
+        if source_tokens > max_tokens:
+            increment("prompt.documents.truncated")
+            continue
+        max_tokens -= source_tokens
+        sources.append(source)
+    return "".join(sources)
 
 
 def generate_source_format(documents: List[Tuple[Document, Any]]) -> str:
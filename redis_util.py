@@ -1,30 +1,206 @@
+import json
 import redis
+import redis.asyncio as aioredis
 import zlib
 import pickle
 import os
+from functools import lru_cache
+from typing import List
 
-from utils import get_from_env_or_config
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.asyncio.sentinel import Sentinel as AsyncSentinel
+from redis.backoff import ExponentialBackoff
+from redis.cluster import RedisCluster
+from redis.retry import Retry
+from redis.sentinel import Sentinel
+
+from logger import logger
+from utils import get_from_env_or_config, increment
 
 # Connect to Redis
 REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
 REDIS_PORT = os.environ.get('REDIS_PORT', 6379)
 REDIS_DB = os.environ.get('REDIS_DB', 0)
+REDIS_USERNAME = os.environ.get('REDIS_USERNAME')
+REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD')
+REDIS_SSL = os.environ.get('REDIS_SSL', 'false').lower() == "true"
+# Comma separated host:port list of the sentinels, and the name of the monitored master
+REDIS_SENTINELS = os.environ.get('REDIS_SENTINELS', '')
+REDIS_SENTINEL_SERVICE_NAME = os.environ.get('REDIS_SENTINEL_SERVICE_NAME', 'mymaster')
+REDIS_SENTINEL_PASSWORD = os.environ.get('REDIS_SENTINEL_PASSWORD')
 REDIS_TTL = get_from_env_or_config('redis', 'ttl') # 12 hours (TTL in seconds)
-redis_client = redis.Redis(host=REDIS_HOST, port=int(REDIS_PORT), db=int(REDIS_DB))
-
-def store_messages_in_redis(key, message, ttl=int(REDIS_TTL)):
-    """Compresses a message using gzip and stores it in Redis."""
-    redis_key = f"msg_{key}"
-    serialized_json = pickle.dumps(message)
-    compressed_data = zlib.compress(serialized_json)
-    redis_client.setex(redis_key, ttl, compressed_data)
-
-def read_messages_from_redis(key):
-    """Retrieves a compressed message from Redis and decompresses it."""
-    redis_key = f"msg_{key}"
-    compressed_data = redis_client.get(redis_key)
-    if compressed_data:
-        decompressed_data = zlib.decompress(compressed_data)
-        return pickle.loads(decompressed_data)
-    else:
-        return []  # Handle the case where the key doesn't exis
+# standalone, sentinel or cluster
+REDIS_MODE = get_from_env_or_config('redis', 'redis_mode', 'standalone').lower()
+REDIS_MAX_CONNECTIONS = int(get_from_env_or_config('redis', 'redis_max_connections', 50))
+# How long a command waits for a free connection when all of them are in use
+REDIS_POOL_TIMEOUT = float(get_from_env_or_config('redis', 'redis_pool_timeout_seconds', 5))
+REDIS_SOCKET_TIMEOUT = float(get_from_env_or_config('redis', 'redis_socket_timeout_seconds', 2))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(get_from_env_or_config('redis', 'redis_socket_connect_timeout_seconds', 2))
+REDIS_HEALTH_CHECK_INTERVAL = int(get_from_env_or_config('redis', 'redis_health_check_interval_seconds', 30))
+REDIS_MAX_RETRIES = int(get_from_env_or_config('redis', 'redis_max_retries', 2))
+# Look for pickled histories written by previous versions and move them to the list format on first read
+MIGRATE_LEGACY_HISTORY = get_from_env_or_config('redis', 'migrate_legacy_history', 'true').lower() == "true"
+# Redis Cluster has no MULTI/EXEC across nodes, so multi-command writes are plain pipelines there
+USE_TRANSACTIONS = REDIS_MODE != "cluster"
+
+if REDIS_MODE not in ("standalone", "sentinel", "cluster"):
+    raise ValueError(f"Unsupported redis_mode '{REDIS_MODE}', expected standalone, sentinel or cluster")
+
+
+def get_sentinel_addresses():
+    addresses = []
+    for address in REDIS_SENTINELS.split(","):
+        if address.strip():
+            host, _, port = address.strip().rpartition(":")
+            addresses.append((host, int(port)))
+    if not addresses:
+        raise ValueError("REDIS_SENTINELS must list at least one host:port when redis_mode is sentinel")
+    return addresses
+
+
+def get_connection_kwargs(retry_class) -> dict:
+    """Connection settings shared by every deployment mode, sync and asyncio."""
+    return {
+        "username": REDIS_USERNAME,
+        "password": REDIS_PASSWORD,
+        "socket_timeout": REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT,
+        "socket_keepalive": True,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        "retry": retry_class(ExponentialBackoff(cap=1, base=0.05), REDIS_MAX_RETRIES),
+    }
+
+
+def create_async_redis_client():
+    """
+    Creates the asyncio client used on the request path, for the configured deployment mode.
+
+    Standalone and sentinel clients draw from a bounded pool that makes callers wait up to
+    `redis_pool_timeout_seconds` for a free connection instead of opening more.
+    """
+    connection_kwargs = get_connection_kwargs(AsyncRetry)
+    if REDIS_MODE == "cluster":
+        return AsyncRedisCluster(host=REDIS_HOST, port=int(REDIS_PORT), ssl=REDIS_SSL,
+                                 max_connections=REDIS_MAX_CONNECTIONS, **connection_kwargs)
+    if REDIS_MODE == "sentinel":
+        sentinel = AsyncSentinel(get_sentinel_addresses(), sentinel_kwargs={
+            "password": REDIS_SENTINEL_PASSWORD,
+            "socket_timeout": REDIS_SOCKET_TIMEOUT,
+            "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT
+        })
+        return sentinel.master_for(REDIS_SENTINEL_SERVICE_NAME, db=int(REDIS_DB), ssl=REDIS_SSL,
+                                   max_connections=REDIS_MAX_CONNECTIONS, **connection_kwargs)
+    pool = aioredis.BlockingConnectionPool(host=REDIS_HOST, port=int(REDIS_PORT), db=int(REDIS_DB),
+                                           max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT,
+                                           connection_class=aioredis.SSLConnection if REDIS_SSL else aioredis.Connection,
+                                           **connection_kwargs)
+    return aioredis.Redis(connection_pool=pool)
+
+
+@lru_cache(maxsize=None)
+def get_redis_client():
+    """
+    Returns the synchronous client, for scripts such as `index_documents.py`.
+
+    It is created on first use because a cluster client discovers the nodes when it is created.
+    """
+    connection_kwargs = get_connection_kwargs(Retry)
+    if REDIS_MODE == "cluster":
+        return RedisCluster(host=REDIS_HOST, port=int(REDIS_PORT), ssl=REDIS_SSL,
+                            max_connections=REDIS_MAX_CONNECTIONS, **connection_kwargs)
+    if REDIS_MODE == "sentinel":
+        sentinel = Sentinel(get_sentinel_addresses(), sentinel_kwargs={
+            "password": REDIS_SENTINEL_PASSWORD,
+            "socket_timeout": REDIS_SOCKET_TIMEOUT,
+            "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT
+        })
+        return sentinel.master_for(REDIS_SENTINEL_SERVICE_NAME, db=int(REDIS_DB), ssl=REDIS_SSL,
+                                   max_connections=REDIS_MAX_CONNECTIONS, **connection_kwargs)
+    pool = redis.BlockingConnectionPool(host=REDIS_HOST, port=int(REDIS_PORT), db=int(REDIS_DB),
+                                        max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT,
+                                        connection_class=redis.SSLConnection if REDIS_SSL else redis.Connection,
+                                        **connection_kwargs)
+    return redis.Redis(connection_pool=pool)
+
+
+# Used by the API request path so that Redis round trips never block the event loop
+async_redis_client = create_async_redis_client()
+
+
+async def check_redis_connection() -> bool:
+    """Pings Redis once, so that a wrong address or password shows up in the logs at startup."""
+    try:
+        await async_redis_client.ping()
+        return True
+    except Exception as e:
+        logger.warning(f"Redis ({REDIS_MODE}) is not reachable: {e}")
+        return False
+
+def get_history_key(key):
+    """Redis list holding the chat history of a session, one JSON encoded message per item."""
+    return f"chat_{key}"
+
+def get_legacy_history_key(key):
+    """
+    Key of the pickled and compressed history blob written by previous versions, which
+    used the session key without the cluster hash tag.
+    """
+    return f"msg_{key.strip('{}')}"
+
+def encode_message(message: dict) -> str:
+    return json.dumps(message, ensure_ascii=False)
+
+def decode_messages(items) -> List[dict]:
+    return [json.loads(item) for item in items]
+
+def decode_legacy_messages(compressed_data) -> List[dict]:
+    """Decodes a legacy history blob. These blobs were written by this service, never by clients."""
+    return pickle.loads(zlib.decompress(compressed_data))
+
+async def read_chat_history(key, max_length: int, ttl=int(REDIS_TTL)) -> List[dict]:
+    """
+    Returns the last `max_length` messages of a session in a single round trip.
+
+    A legacy history of the session, if any, is moved to the list format on the way.
+    """
+    history_key = get_history_key(key)
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        pipe.lrange(history_key, -max_length, -1)
+        if MIGRATE_LEGACY_HISTORY:
+            pipe.get(get_legacy_history_key(key))
+        results = await pipe.execute()
+
+    messages = decode_messages(results[0])
+    if not messages and MIGRATE_LEGACY_HISTORY and results[1]:
+        messages = decode_legacy_messages(results[1])[-max_length:]
+        await migrate_legacy_history(key, messages, max_length, ttl)
+    return messages
+
+async def append_chat_turn(key, messages: List[dict], max_length: int, ttl=int(REDIS_TTL)):
+    """
+    Appends messages to the history of a session, keeping only the last `max_length` ones.
+
+    RPUSH, LTRIM and EXPIRE run in one pipeline (MULTI/EXEC outside of a cluster), so a write costs one
+    round trip regardless of the length of the conversation.
+    """
+    history_key = get_history_key(key)
+    async with async_redis_client.pipeline(transaction=USE_TRANSACTIONS) as pipe:
+        pipe.rpush(history_key, *[encode_message(message) for message in messages])
+        pipe.ltrim(history_key, -max_length, -1)
+        pipe.expire(history_key, ttl)
+        await pipe.execute()
+
+async def migrate_legacy_history(key, messages: List[dict], max_length: int, ttl=int(REDIS_TTL)):
+    """Replaces the legacy history blob of a session with the list format."""
+    history_key = get_history_key(key)
+    async with async_redis_client.pipeline(transaction=USE_TRANSACTIONS) as pipe:
+        pipe.delete(history_key)
+        if messages:
+            pipe.rpush(history_key, *[encode_message(message) for message in messages])
+            pipe.ltrim(history_key, -max_length, -1)
+            pipe.expire(history_key, ttl)
+        pipe.delete(get_legacy_history_key(key))
+        await pipe.execute()
+    increment("chat_history.migrated")
+    logger.info({"label": "chat_history_migrated", "session_id": key, "messages": len(messages)})
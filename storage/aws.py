@@ -1,13 +1,16 @@
 import os
 import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 from logger import logger
 from typing import Union, Optional
 
-from storage.base import BaseStorageClass
+from storage.base import BaseStorageClass, StorageFile
 
 
 class AwsS3BucketClass(BaseStorageClass):
+    # Public URLs are built from the bucket and object name, without calling the service
+    deterministic_public_url = True
+
     def __init__(self):
         super().__init__(boto3.client(
             's3',
@@ -16,15 +19,17 @@ class AwsS3BucketClass(BaseStorageClass):
             aws_access_key_id=os.getenv("BUCKET_ACCESS_KEY_ID"),
         ))
 
-    def upload_to_storage(self, file_name: str, object_name: Optional[str] = None) -> bool:
-        if object_name is None:
-            object_name = os.path.basename(file_name)
-
+    def upload_to_storage(self, file: StorageFile, object_name: Optional[str] = None,
+                          content_type: str = "audio/mpeg") -> bool:
+        object_name = self.get_object_name(file, object_name)
+        extra_args = {'ACL': 'public-read', "ContentType": content_type}
         try:
-            self.client.upload_file(file_name, self.bucket_name, object_name,
-                                    ExtraArgs={'ACL': 'public-read', "ContentType": "audio/mpeg"})
+            if isinstance(file, str):
+                self.client.upload_file(file, self.bucket_name, object_name, ExtraArgs=extra_args)
+            else:
+                self.client.upload_fileobj(self.as_file_object(file), self.bucket_name, object_name, ExtraArgs=extra_args)
             logger.info(f"File uploaded to AWS S3 bucket: {self.bucket_name}")
-        except ClientError as e:
+        except (ClientError, BotoCoreError) as e:
             logger.error(f"Exception uploading a file: {e}", exc_info=True)
             return False
         return True
@@ -37,4 +42,9 @@ class AwsS3BucketClass(BaseStorageClass):
         except Exception as e:
             logger.error(f"Exception Preparing public URL: {e}", exc_info=True)
             return None, "Error while generating public URL"
+
+    async def agenerate_public_url(self, object_name: str):
+        # The URL is built locally, so there is no need to hop to a worker thread
+        return self.generate_public_url(object_name)
+
     # Additional AWS-specific methods can be implemented here
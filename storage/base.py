@@ -1,18 +1,43 @@
+import asyncio
+import io
 import os
+import uuid
 from abc import ABC, abstractmethod
-from typing import Optional, Union
+from typing import Awaitable, BinaryIO, Callable, Optional, Set, Union
+
+from starlette.concurrency import run_in_threadpool
+
+from logger import logger
+from utils import get_from_env_or_config, increment
+
+# A local file path, the content itself, or a binary file-like object
+StorageFile = Union[str, bytes, BinaryIO]
+
+UPLOAD_RETRIES = int(get_from_env_or_config('storage', 'upload_retries', 2))
+UPLOAD_RETRY_BACKOFF = float(get_from_env_or_config('storage', 'upload_retry_backoff_seconds', 0.5))
+
 
 class BaseStorageClass(ABC):
+    # Whether `generate_public_url` can build the URL of an object that is not uploaded yet
+    deterministic_public_url = False
+
     def __init__(self, client_type):
         self.client = client_type
         self.bucket_name = os.environ["BUCKET_NAME"]
+        self.pending_uploads: Set[asyncio.Future] = set()
 
     def create_bucket(self):
         pass
 
     @abstractmethod
-    def upload_to_storage(self, file_name: str, object_name: Optional[str] = None) -> bool:
-        pass
+    def upload_to_storage(self, file: StorageFile, object_name: Optional[str] = None,
+                          content_type: str = "audio/mpeg") -> bool:
+        """
+        Uploads a local file, bytes or a binary file-like object.
+
+        When `object_name` is not given, the file's base name is used for a path,
+        and a random unique name otherwise.
+        """
 
     def download_from_storage(self):
         pass
@@ -27,3 +52,62 @@ class BaseStorageClass(ABC):
     def generate_public_url(self, object_name: str):
         pass
 
+    @staticmethod
+    def get_object_name(file: StorageFile, object_name: Optional[str] = None) -> str:
+        if object_name is not None:
+            return object_name
+        if isinstance(file, str):
+            return os.path.basename(file)
+        return str(uuid.uuid4())
+
+    @staticmethod
+    def as_file_object(file: Union[bytes, BinaryIO]) -> BinaryIO:
+        return io.BytesIO(file) if isinstance(file, (bytes, bytearray)) else file
+
+    async def aupload_to_storage(self, file: StorageFile, object_name: Optional[str] = None,
+                                 content_type: str = "audio/mpeg") -> bool:
+        return await run_in_threadpool(self.upload_to_storage, file, object_name, content_type)
+
+    async def agenerate_public_url(self, object_name: str):
+        return await run_in_threadpool(self.generate_public_url, object_name)
+
+    def upload_in_background(self, content: bytes, object_name: str, content_type: str = "audio/mpeg",
+                             on_success: Optional[Callable[[], Awaitable]] = None) -> asyncio.Future:
+        """
+        Uploads `content` without making the caller wait, retrying failed attempts.
+
+        The upload is tracked until it completes, and `wait_for_uploads` lets the
+        service finish every pending upload before shutting down. `on_success` is
+        awaited once the object is stored.
+        """
+        upload = asyncio.ensure_future(self._aupload_with_retries(content, object_name, content_type, on_success))
+        self.pending_uploads.add(upload)
+        upload.add_done_callback(self.pending_uploads.discard)
+        return upload
+
+    async def _aupload_with_retries(self, content: bytes, object_name: str, content_type: str,
+                                    on_success: Optional[Callable[[], Awaitable]]) -> bool:
+        for attempt in range(UPLOAD_RETRIES + 1):
+            try:
+                uploaded = await self.aupload_to_storage(content, object_name, content_type)
+            except Exception as e:
+                logger.error(f"Exception uploading {object_name}: {e}", exc_info=True)
+                uploaded = False
+            if uploaded:
+                increment("storage.background_upload.success")
+                if on_success is not None:
+                    await on_success()
+                return True
+            if attempt < UPLOAD_RETRIES:
+                await asyncio.sleep(UPLOAD_RETRY_BACKOFF * 2 ** attempt)
+        increment("storage.background_upload.failed")
+        logger.error(f"Giving up uploading {object_name} after {UPLOAD_RETRIES + 1} attempts")
+        return False
+
+    async def wait_for_uploads(self, timeout: Optional[float] = None) -> None:
+        """
+        Waits for the uploads started with `upload_in_background` to finish.
+        """
+        if self.pending_uploads:
+            logger.info(f"Waiting for {len(self.pending_uploads)} pending uploads")
+            await asyncio.wait(set(self.pending_uploads), timeout=timeout)
@@ -3,7 +3,7 @@ from typing import Optional, Union
 from logger import logger
 from google.cloud import storage
 
-from storage.base import BaseStorageClass
+from storage.base import BaseStorageClass, StorageFile
 
 
 class GcpBucketClass(BaseStorageClass):
@@ -11,10 +11,16 @@ class GcpBucketClass(BaseStorageClass):
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.getenv("GCP_CONFIG_PATH")
         super().__init__(storage.Client())
 
-    def upload_to_storage(self, file_name: str, object_name: Optional[str] = None) -> bool:
+    def upload_to_storage(self, file: StorageFile, object_name: Optional[str] = None,
+                          content_type: str = "audio/mpeg") -> bool:
+        object_name = self.get_object_name(file, object_name)
+
         bucket = self.client.bucket(self.bucket_name)
-        blob = bucket.blob(file_name)
-        blob.upload_from_filename(file_name)
+        blob = bucket.blob(object_name)
+        if isinstance(file, str):
+            blob.upload_from_filename(file, content_type=content_type)
+        else:
+            blob.upload_from_file(self.as_file_object(file), content_type=content_type, rewind=True)
 
         return True
 
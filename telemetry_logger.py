@@ -1,8 +1,12 @@
+import gzip
+import json
+import threading
 import time
 import uuid
 import os
+from collections import deque
 import requests
-from utils import get_from_env_or_config
+from utils import get_from_env_or_config, increment
 from logger import logger
 
 telemetryURL = os.getenv('TELEMETRY_ENDPOINT_URL')
@@ -14,16 +18,146 @@ actor_id = get_from_env_or_config('telemetry', 'actor_id', None)
 channel = get_from_env_or_config('telemetry', 'channel', None)
 pdata_id = get_from_env_or_config('telemetry', 'pdata_id', None)
 events_threshold = get_from_env_or_config('telemetry', 'events_threshold', None)
+max_queue_size = int(get_from_env_or_config('telemetry', 'telemetry_max_queue_size', 10000))
+flush_interval = float(get_from_env_or_config('telemetry', 'telemetry_flush_interval_seconds', 5))
+max_retries = int(get_from_env_or_config('telemetry', 'telemetry_max_retries', 3))
+retry_backoff = float(get_from_env_or_config('telemetry', 'telemetry_retry_backoff_seconds', 0.5))
+request_timeout = float(get_from_env_or_config('telemetry', 'telemetry_request_timeout_seconds', 10))
+
+
+class TelemetryShipper:
+    """
+    Ships telemetry events in the background.
+
+    Events are kept in a bounded queue; when it is full the oldest event is dropped and counted.
+    A daemon thread sends a gzip compressed batch whenever `batch_size` events are queued or
+    the oldest queued event is `flush_interval` seconds old, retrying failed batches with
+    exponential backoff over a reused HTTP session. Callers never wait on the network.
+    """
+
+    def __init__(self, url, batch_size, max_queue_size=max_queue_size, flush_interval=flush_interval,
+                 max_retries=max_retries, retry_backoff=retry_backoff, timeout=request_timeout):
+        self.url = url
+        self.batch_size = batch_size
+        self.max_queue_size = max_queue_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+        self.events = deque()  # (enqueued_at, event)
+        self.condition = threading.Condition()
+        self.session = requests.Session()
+        self.thread = None
+        self.stopped = False
+
+    def add_event(self, event):
+        with self.condition:
+            if self.stopped:
+                increment("telemetry.events.dropped")
+                return
+            if len(self.events) >= self.max_queue_size:
+                self.events.popleft()
+                increment("telemetry.events.dropped")
+            self.events.append((time.monotonic(), event))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="telemetry-shipper", daemon=True)
+                self.thread.start()
+            if len(self.events) >= self.batch_size:
+                self.condition.notify()
+
+    def _next_batch(self):
+        """
+        Waits until a batch is due and takes it off the queue. Returns None once stopped and drained.
+        """
+        with self.condition:
+            while True:
+                if self.events:
+                    age = time.monotonic() - self.events[0][0]
+                    if self.stopped or len(self.events) >= self.batch_size or age >= self.flush_interval:
+                        size = min(self.batch_size, len(self.events))
+                        return [self.events.popleft()[1] for _ in range(size)]
+                    self.condition.wait(self.flush_interval - age)
+                elif self.stopped:
+                    return None
+                else:
+                    self.condition.wait()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self.send_logs(batch)
+
+    def send_logs(self, events):
+        """
+        Sends a batch of telemetry events, retrying with exponential backoff.
+        """
+        data = {
+            "id": telemetry_id,
+            "ver": telemetry_ver,
+            "params": {"msgid": str(uuid.uuid4())},
+            "ets": int(time.time() * 1000),
+            "events": events
+        }
+        payload = gzip.compress(json.dumps(data, default=str).encode("utf-8"))
+        headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(self.url + "/v1/telemetry", data=payload, headers=headers, timeout=self.timeout)
+                response.raise_for_status()
+                logger.debug(f"Telemetry API request data: {data}")
+                logger.info(f"Telemetry logs sent successfully! ({len(events)} events)")
+                increment("telemetry.events.sent", len(events))
+                return True
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error sending telemetry log (attempt {attempt + 1}): {e}")
+                if attempt < self.max_retries and not self.stopped:
+                    time.sleep(self.retry_backoff * 2 ** attempt)
+        increment("telemetry.events.failed", len(events))
+        return False
+
+    def shutdown(self, timeout=None):
+        """
+        Stops accepting events and waits for the queued ones to be sent.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.session.close()
+
+
+_shippers = {}
+_shippers_lock = threading.Lock()
+
+
+def get_shipper(url, batch_size):
+    """Returns the shipper shared by every TelemetryLogger that sends to `url`."""
+    with _shippers_lock:
+        if url not in _shippers:
+            _shippers[url] = TelemetryShipper(url, batch_size)
+        return _shippers[url]
+
+
+def shutdown_telemetry(timeout=None):
+    """Flushes and stops every telemetry shipper. Called when the service shuts down."""
+    with _shippers_lock:
+        shippers = list(_shippers.values())
+    for shipper in shippers:
+        shipper.shutdown(timeout)
+
 
 class TelemetryLogger:
     """
-    A class to capture and send telemetry logs using the requests library with threshold limit.
+    A class to capture telemetry logs and hand them to a background shipper with threshold limit.
     """
 
     def __init__(self, url=telemetryURL, threshold=int(events_threshold)):
         self.url = url
-        self.events = []  # Store multiple events before exceeding threshold
         self.threshold = threshold
+        self.shipper = get_shipper(url, threshold)
 
     def add_event(self, event):
         """
@@ -37,32 +171,8 @@ class TelemetryLogger:
         if not TELEMETRY_LOG_ENABLED:
             return
 
-        self.events.append(event)
-        # Send logs if exceeding threshold
-        if len(self.events) >= self.threshold:
-            self.send_logs()
-
-    def send_logs(self):
-        """
-        Sends the captured telemetry logs using the requests library.
-        """
-        try:
-            data = {
-                "id": telemetry_id,
-                "ver": telemetry_ver,
-                "params": {"msgid": str(uuid.uuid4())},
-                "ets": int(time.time() * 1000),
-                "events": self.events
-            }
-            headers = {"Content-Type": "application/json"}
-            response = requests.post(self.url + "/v1/telemetry", json=data, headers=headers)
-            response.raise_for_status()
-            logger.debug(f"Telemetry API request data: {data}")
-            logger.info("Telemetry logs sent successfully!")
-            # Reset captured events after sending
-            self.events = []
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error sending telemetry log: {e}", exc_info=True)
+        # Sent in batches by the background shipper
+        self.shipper.add_event(event)
 
     def prepare_log_event(self, eventInput: dict, etype="api_access", elevel="INFO", message=""):
         """
@@ -1,62 +1,131 @@
 import time
 import json
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import Message
-from fastapi import Request
+from starlette.datastructures import Headers, MutableHeaders, URL
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from logger import logger
-from utils import get_from_env_or_config
+from utils import get_from_env_or_config, is_url
 from telemetry_logger import TelemetryLogger
 
 
-# https://github.com/tiangolo/fastapi/issues/394 
-# Stream response does not work => https://github.com/tiangolo/fastapi/issues/394#issuecomment-994665859
-async def set_body(request: Request, body: bytes):
-    async def receive() -> Message:
-        return {"type": "http.request", "body": body}
+telemetryLogger =  TelemetryLogger()
+telemetry_log_enabled = get_from_env_or_config('telemetry', 'telemetry_log_enabled', None).lower() == "true"
 
-    request._receive = receive
+# Request headers copied into the telemetry event (see TelemetryLogger.prepare_log_event)
+TELEMETRY_HEADERS = ("x-request-id", "x-device-id", "x-consumer-id", "x-source")
+# Body fields reported in the telemetry event. An audio URL is reported, a base64 audio payload is blanked.
+TELEMETRY_BODY_FIELDS = {
+    "input": ("language", "text", "audio", "context"),
+    "output": ("format",)
+}
+# Bodies above this size have their audio value cut out before being parsed
+MAX_PARSED_BODY_SIZE = 64 * 1024
 
 
-async def get_body(request: Request) -> bytes:
-    body = await request.body()
-    await set_body(request, body)
-    return body
+def strip_audio_value(body: bytes) -> bytes:
+    """
+    Removes the value of the "audio" field from a raw JSON body without parsing it.
+    """
+    key_start = body.find(b'"audio"')
+    if key_start == -1:
+        return body
+    value_start = body.find(b'"', key_start + 7)
+    if value_start == -1 or body[key_start + 7:value_start].strip() != b":":
+        return body
+    value_end = body.find(b'"', value_start + 1)
+    if value_end == -1:
+        return body
+    return body[:value_start + 1] + body[value_end:]
 
-telemetryLogger =  TelemetryLogger()
-telemetry_log_enabled = get_from_env_or_config('telemetry', 'telemetry_log_enabled', None).lower() == "true"
 
-class TelemetryMiddleware(BaseHTTPMiddleware):
+def get_telemetry_body(body: bytes) -> dict:
+    """
+    Extracts the body fields needed by telemetry from a raw JSON request body.
+    """
+    if not body:
+        return {}
+    if len(body) > MAX_PARSED_BODY_SIZE:
+        body = strip_audio_value(body)
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return {}
+    if not isinstance(payload, dict):
+        return {}
+
+    telemetry_body = {}
+    for section, fields in TELEMETRY_BODY_FIELDS.items():
+        values = payload.get(section)
+        if isinstance(values, dict):
+            telemetry_body[section] = {field: values[field] for field in fields if field in values}
+    audio = telemetry_body.get("input", {}).get("audio")
+    if isinstance(audio, str) and audio and not is_url(audio):
+        telemetry_body["input"]["audio"] = ""
+    return telemetry_body
+
+
+class TelemetryMiddleware:
+    """
+    Pure ASGI middleware that adds the X-Process-Time header and logs a telemetry event for every API call.
+
+    The request body is captured while the application reads it, and the response
+    is passed through untouched, so streaming responses are not buffered.
+    """
+
     def __init__(
             self,
-            app
+            app: ASGIApp
     ):
-        super().__init__(app)
-        
-    async def dispatch(self, request: Request, call_next):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         start_time = time.time()
-        await set_body(request, await request.body())
-        body = await get_body(request)
-        if body.decode("utf-8"):
-            body = json.loads(body)
-        response = await call_next(request)
-        process_time = time.time() - start_time
-        response.headers["X-Process-Time"] = str(process_time)
-        if "v1" in str(request.url):
-            event: dict = {
-                "status_code": response.status_code,
-                "duration": round(process_time * 1000),
-                "body": body,
-                "method": request.method,
-                "url": request.url
-            }
-            event.update(request.headers)
-            logger.info({"label": "api_call", "event": event})
-
-            if telemetry_log_enabled:
-                if response.status_code == 200:
-                    event = telemetryLogger.prepare_log_event(eventInput=event, message="success")
-                else:
-                    event = telemetryLogger.prepare_log_event(eventInput=event, elevel="ERROR", message="failed")
-                telemetryLogger.add_event(event)
-        return response
\ No newline at end of file
+        is_api_call = "v1" in scope["path"]
+        body_chunks = []
+        status_code = 500
+
+        async def receive_with_body() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                body_chunks.append(message.get("body", b""))
+            return message
+
+        async def send_with_process_time(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Process-Time", str(time.time() - start_time))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_with_body if is_api_call else receive, send_with_process_time)
+        finally:
+            if is_api_call:
+                # Duration covers the whole response, including streamed bodies
+                self.log_api_call(scope, b"".join(body_chunks), status_code, time.time() - start_time)
+
+    def log_api_call(self, scope: Scope, body: bytes, status_code: int, process_time: float) -> None:
+        event: dict = {
+            "status_code": status_code,
+            "duration": round(process_time * 1000),
+            "body": get_telemetry_body(body),
+            "method": scope["method"],
+            "url": URL(scope=scope)
+        }
+        headers = Headers(scope=scope)
+        for header in TELEMETRY_HEADERS:
+            if header in headers:
+                event[header] = headers[header]
+        logger.info({"label": "api_call", "event": event})
+
+        if telemetry_log_enabled:
+            if status_code == 200:
+                event = telemetryLogger.prepare_log_event(eventInput=event, message="success")
+            else:
+                event = telemetryLogger.prepare_log_event(eventInput=event, elevel="ERROR", message="failed")
+            telemetryLogger.add_event(event)
@@ -14,19 +14,24 @@ if TYPE_CHECKING:
     from translation.google import (
         GoogleCloudTranslationClass
     )
+    from translation.cache import (
+        CachedTranslationClass
+    )
 
 # __all__ = [
 #     "BaseTranslationClass",
 #     "BhashiniTranslationClass",
 #     "DhruvaTranslationClass",
 #     "GoogleCloudTranslationClass",
+#     "CachedTranslationClass",
 # ]
 
 _module_lookup = {
     "BaseTranslationClass" : "translation.base",
     "BhashiniTranslationClass": "translation.bhashini",
     "DhruvaTranslationClass": "translation.dhruva",
-    "GoogleCloudTranslationClass": "translation.google"
+    "GoogleCloudTranslationClass": "translation.google",
+    "CachedTranslationClass": "translation.cache"
 }
 
 def __getattr__(name: str) -> Any:
@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 from typing import Any
 
+from starlette.concurrency import run_in_threadpool
+
 class BaseTranslationClass(ABC):
     """
     This abstract class defines the interface for a translation service.
@@ -60,4 +62,56 @@ class BaseTranslationClass(ABC):
 
         Raises:
             NotImplementedError: If the subclass does not implement this method.
-        """
\ No newline at end of file
+        """
+
+    async def atranslate_text(self, text: str, source: str, destination: str):
+        """
+        Asynchronously translates a text string to another language.
+
+        The default implementation runs `translate_text` in a worker thread so that
+        the event loop is never blocked. Subclasses with a native async client should override it.
+
+        Args:
+            text: The text string to be translated (str).
+            source: The language of the text (str).
+            destination: The target language (str).
+
+        Returns:
+            The translated text string.
+        """
+        return await run_in_threadpool(self.translate_text, text=text, source=source, destination=destination)
+
+    async def atext_to_speech(self, language: str, text: str) -> Any:
+        """
+        Asynchronously converts text to speech in a specified language.
+
+        The default implementation runs `text_to_speech` in a worker thread.
+
+        Args:
+            language: The target language for the speech (str).
+            text: The text to be converted to speech (str).
+
+        Returns:
+            The speech representation of the text (type varies depending on subclass).
+        """
+        return await run_in_threadpool(self.text_to_speech, language=language, text=text)
+
+    async def aspeech_to_text(self, audio_file: Any, input_language: str):
+        """
+        Asynchronously converts speech from an audio file to text.
+
+        The default implementation runs `speech_to_text` in a worker thread.
+
+        Args:
+            audio_file: The audio file containing the speech (type varies depending on subclass).
+            input_language: The language of the speech in the audio file (str).
+
+        Returns:
+            The transcribed text from the audio file (str).
+        """
+        return await run_in_threadpool(self.speech_to_text, audio_file=audio_file, input_language=input_language)
+
+    async def aclose(self) -> None:
+        """
+        Releases any network resources held by the translation client.
+        """
@@ -1,10 +1,11 @@
-import json
-import time
+import base64
 from typing import Any
 
+from starlette.concurrency import run_in_threadpool
+
 from utils import get_from_env_or_config
 from translation.base import BaseTranslationClass
-from translation.telemetry import *
+from translation.http_client import PipelineHttpClient
 from translation.translation_utils import *
 
 
@@ -47,58 +48,42 @@ class BhashiniTranslationClass(BaseTranslationClass):
             "te": "ai4bharat/indic-tts-coqui-dravidian-gpu--t4"
         }
 
-    def translate_text(self, text: str, source: str, destination: str):
-        if source == destination:
-            return text
-        try:
-            start_time = time.time()
-            url = get_from_env_or_config('translator', 'BHASHINI_ENDPOINT_URL', None)
-            payload = {
-                "pipelineTasks": [
-                    {
-                        "taskType": "translation",
-                        "config": {
-                            "language": {
-                                "sourceLanguage": source,
-                                "targetLanguage": destination
-                            },
-                            "serviceId": self.translation_serviceId
-                        }
+        self.http = PipelineHttpClient("bhashini")
+
+    def _get_url(self):
+        return get_from_env_or_config('translator', 'BHASHINI_ENDPOINT_URL', None)
+
+    def _get_headers(self):
+        return {
+            'Authorization': get_from_env_or_config('translator', 'BHASHINI_API_KEY', None),
+            'Content-Type': 'application/json'
+        }
+
+    def _translation_payload(self, text: str, source: str, destination: str):
+        return {
+            "pipelineTasks": [
+                {
+                    "taskType": "translation",
+                    "config": {
+                        "language": {
+                            "sourceLanguage": source,
+                            "targetLanguage": destination
+                        },
+                        "serviceId": self.translation_serviceId
                     }
-                ],
-                "inputData": {
-                    "input": [
-                        {
-                            "source": text
-                        }
-                    ]
                 }
+            ],
+            "inputData": {
+                "input": [
+                    {
+                        "source": text
+                    }
+                ]
             }
-            headers = {
-                'Authorization': get_from_env_or_config('translator', 'BHASHINI_API_KEY', None),
-                'Content-Type': 'application/json'
-            }
-
-            response = requests.request(
-                "POST", url, headers=headers, data=json.dumps(payload))
-            process_time = time.time() - start_time
-            response.raise_for_status()
-            log_success_telemetry_event(url, "POST", {
-                                        "taskType": "translation"}, process_time, status_code=response.status_code)
-            indic_text = json.loads(response.text)[
-                "pipelineResponse"][0]["output"][0]["target"]
-        except requests.exceptions.RequestException as e:
-            process_time = time.time() - start_time
-            log_failed_telemetry_event(url, "POST", {
-                                       "taskType": "translation"}, process_time, status_code=e.response.status_code, error=e.response.text)
-            raise RequestError(e.response) from e
-        return indic_text
+        }
 
-    def speech_to_text(self, audio_file: Any, input_language: str):
-        encoded_string, wav_file_content = get_encoded_string(audio_file)
-        start_time = time.time()
-        url = get_from_env_or_config('translator', 'BHASHINI_ENDPOINT_URL', None)
-        payload = {
+    def _asr_payload(self, encoded_string: str, input_language: str):
+        return {
             "pipelineTasks": [
                 {
                     "taskType": "asr",
@@ -118,74 +103,73 @@ class BhashiniTranslationClass(BaseTranslationClass):
                 ]
             }
         }
-        headers = {
-            'Authorization': get_from_env_or_config('translator', 'BHASHINI_API_KEY', None),
-            'Content-Type': 'application/json'
+
+    def _tts_payload(self, language: str, text: str, gender: str):
+        return {
+            "pipelineTasks": [
+                {
+                    "taskType": "tts",
+                    "config": {
+                        "language": {
+                            "sourceLanguage": language
+                        },
+                        "serviceId": self.tts_mapping[language],
+                        "gender": gender
+                    }
+                }
+            ],
+            "inputData": {
+                "input": [
+                    {
+                        "source": text
+                    }
+                ],
+                "audio": [
+                    {
+                        "audioContent": None
+                    }
+                ]
+            }
         }
 
-        try:
-            response = requests.request(
-                "POST", url, headers=headers, data=json.dumps(payload))
-            process_time = time.time() - start_time
-            response.raise_for_status()
-            log_success_telemetry_event(
-                url, "POST", {"taskType": "asr"}, process_time, status_code=response.status_code)
-            text = json.loads(response.text)[
-                "pipelineResponse"][0]["output"][0]["source"]
+    def translate_text(self, text: str, source: str, destination: str):
+        if source == destination:
             return text
-        except requests.exceptions.RequestException as e:
-            process_time = time.time() - start_time
-            log_failed_telemetry_event(url, "POST", {
-                                       "taskType": "asr"}, process_time, status_code=e.response.status_code, error=e.response.text)
-            raise RequestError(e.response) from e
+        response = self.http.post(self._get_url(), self._get_headers(), self._translation_payload(text, source, destination), "translation")
+        return response.json()["pipelineResponse"][0]["output"][0]["target"]
+
+    async def atranslate_text(self, text: str, source: str, destination: str):
+        if source == destination:
+            return text
+        response = await self.http.apost(self._get_url(), self._get_headers(), self._translation_payload(text, source, destination), "translation")
+        return response.json()["pipelineResponse"][0]["output"][0]["target"]
+
+    def speech_to_text(self, audio_file: Any, input_language: str):
+        encoded_string, wav_file_content = get_encoded_string(audio_file)
+        response = self.http.post(self._get_url(), self._get_headers(), self._asr_payload(encoded_string, input_language), "asr")
+        return response.json()["pipelineResponse"][0]["output"][0]["source"]
+
+    async def aspeech_to_text(self, audio_file: Any, input_language: str):
+        # Audio decoding shells out to ffmpeg, keep it off the event loop
+        encoded_string, wav_file_content = await run_in_threadpool(get_encoded_string, audio_file)
+        response = await self.http.apost(self._get_url(), self._get_headers(), self._asr_payload(encoded_string, input_language), "asr")
+        return response.json()["pipelineResponse"][0]["output"][0]["source"]
 
     def text_to_speech(self, language: str, text: str, gender='female'):
         try:
-            start_time = time.time()
-            url = get_from_env_or_config('translator', 'BHASHINI_ENDPOINT_URL', None)
-            payload = {
-                "pipelineTasks": [
-                    {
-                        "taskType": "tts",
-                        "config": {
-                            "language": {
-                                "sourceLanguage": language
-                            },
-                            "serviceId": self.tts_mapping[language],
-                            "gender": gender
-                        }
-                    }
-                ],
-                "inputData": {
-                    "input": [
-                        {
-                            "source": text
-                        }
-                    ],
-                    "audio": [
-                        {
-                            "audioContent": None
-                        }
-                    ]
-                }
-            }
-            headers = {
-                'Authorization': get_from_env_or_config('translator', 'BHASHINI_API_KEY', None),
-                'Content-Type': 'application/json'
-            }
-            response = requests.request(
-                "POST", url, headers=headers, data=json.dumps(payload))
-            process_time = time.time() - start_time
-            response.raise_for_status()
-            log_success_telemetry_event(
-                url, "POST", {"taskType": "tts"}, process_time, status_code=response.status_code)
-            audio_content = response.json(
-            )["pipelineResponse"][0]['audio'][0]['audioContent']
-            audio_content = base64.b64decode(audio_content)
-        except requests.exceptions.RequestException as e:
-            process_time = time.time() - start_time
-            log_failed_telemetry_event(url, "POST", {
-                                       "taskType": "tts"}, process_time, status_code=e.response.status_code, error=e.response.text)
-            audio_content = None
-            # audio_content = google_text_to_speech(text, language)
-        return audio_content
+            response = self.http.post(self._get_url(), self._get_headers(), self._tts_payload(language, text, gender), "tts")
+        except RequestError:
+            return None
+        audio_content = response.json()["pipelineResponse"][0]['audio'][0]['audioContent']
+        return base64.b64decode(audio_content)
+
+    async def atext_to_speech(self, language: str, text: str, gender='female'):
+        try:
+            response = await self.http.apost(self._get_url(), self._get_headers(), self._tts_payload(language, text, gender), "tts")
+        except RequestError:
+            return None
+        audio_content = response.json()["pipelineResponse"][0]['audio'][0]['audioContent']
+        return base64.b64decode(audio_content)
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
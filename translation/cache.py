@@ -0,0 +1,63 @@
+import unicodedata
+from typing import Any
+
+from translation.base import BaseTranslationClass
+from utils import TwoTierCache, make_cache_key, increment
+
+
+class CachedTranslationClass(BaseTranslationClass):
+    """
+    Memoizing wrapper around another translation class.
+
+    `translate_text` results are cached per (provider, source, destination, normalized text)
+    in an in-process LRU and in Redis. Speech methods are delegated unchanged.
+    """
+
+    def __init__(self, translator: BaseTranslationClass, provider: str, redis_client=None,
+                 ttl: int = 604800, max_size: int = 4096, enabled: bool = True) -> None:
+        self.translator = translator
+        self.provider = provider
+        self.cache = TwoTierCache("translation", redis_client, ttl=ttl, max_size=max_size, enabled=enabled)
+
+    def _get_key(self, text: str, source: str, destination: str) -> str:
+        normalized_text = unicodedata.normalize("NFC", text).strip()
+        return make_cache_key("translation", self.provider, source, destination, normalized_text)
+
+    def translate_text(self, text: str, source: str, destination: str):
+        # Sync callers only use the in-process tier, Redis is reached through the async path
+        if source == destination:
+            increment("cache.translation.skip")
+            return text
+        key = self._get_key(text, source, destination)
+        translated_text = self.cache.local.get(key) if self.cache.enabled else None
+        if translated_text is None:
+            translated_text = self.translator.translate_text(text=text, source=source, destination=destination)
+            if self.cache.enabled and translated_text is not None:
+                self.cache.local.set(key, translated_text)
+        return translated_text
+
+    async def atranslate_text(self, text: str, source: str, destination: str):
+        if source == destination:
+            increment("cache.translation.skip")
+            return text
+        key = self._get_key(text, source, destination)
+        translated_text = await self.cache.get(key)
+        if translated_text is None:
+            translated_text = await self.translator.atranslate_text(text=text, source=source, destination=destination)
+            await self.cache.set(key, translated_text)
+        return translated_text
+
+    def text_to_speech(self, language: str, text: str, **kwargs: Any) -> Any:
+        return self.translator.text_to_speech(language=language, text=text, **kwargs)
+
+    async def atext_to_speech(self, language: str, text: str, **kwargs: Any) -> Any:
+        return await self.translator.atext_to_speech(language=language, text=text, **kwargs)
+
+    def speech_to_text(self, audio_file: Any, input_language: str):
+        return self.translator.speech_to_text(audio_file=audio_file, input_language=input_language)
+
+    async def aspeech_to_text(self, audio_file: Any, input_language: str):
+        return await self.translator.aspeech_to_text(audio_file=audio_file, input_language=input_language)
+
+    async def aclose(self) -> None:
+        await self.translator.aclose()
@@ -0,0 +1,161 @@
+import asyncio
+import importlib.util
+import json
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+from logger import logger
+from utils import get_from_env_or_config, increment
+from translation.telemetry import log_success_telemetry_event, log_failed_telemetry_event
+from translation.translation_utils import RequestError
+
+# Status codes worth another attempt: throttling and transient upstream failures
+RETRYABLE_STATUS_CODES = (429, 502, 503, 504)
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of the recent request volume.
+
+    Every request deposits `ratio` tokens and every retry withdraws one, so a provider
+    outage can add at most `ratio` extra load instead of multiplying it by the retry count.
+    `min_per_second` tokens are added over time so that a quiet worker can still retry.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, amount: float) -> None:
+        now = time.monotonic()
+        amount += (now - self.updated_at) * self.min_per_second
+        self.updated_at = now
+        self.tokens = min(self.max_tokens, self.tokens + amount)
+
+    def deposit(self) -> None:
+        with self.lock:
+            self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            self._refill(0)
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class PipelineHttpClient:
+    """
+    Pooled keep-alive HTTP client for the ULCA pipeline APIs (Bhashini, Dhruva).
+
+    Holds one sync and one async connection pool for the lifetime of the provider, with
+    connection limits, connect/read timeouts and budgeted retries taken from the
+    `[translator]` section of config.ini. Every call is logged as a telemetry event.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.max_retries = int(get_from_env_or_config('translator', 'http_max_retries', 2))
+        self.retry_backoff = float(get_from_env_or_config('translator', 'http_retry_backoff_seconds', 0.2))
+        self.retry_budget = RetryBudget(ratio=float(get_from_env_or_config('translator', 'http_retry_budget_ratio', 0.2)))
+        limits = httpx.Limits(
+            max_connections=int(get_from_env_or_config('translator', 'http_max_connections', 20)),
+            max_keepalive_connections=int(get_from_env_or_config('translator', 'http_max_keepalive_connections', 10)),
+            keepalive_expiry=float(get_from_env_or_config('translator', 'http_keepalive_expiry_seconds', 30))
+        )
+        read_timeout = float(get_from_env_or_config('translator', 'http_read_timeout_seconds', 30))
+        timeout = httpx.Timeout(
+            read_timeout,
+            connect=float(get_from_env_or_config('translator', 'http_connect_timeout_seconds', 5)),
+            pool=read_timeout
+        )
+        http2 = get_from_env_or_config('translator', 'http2', 'false').lower() == "true"
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested for the translator but the `h2` package is not installed, using HTTP/1.1")
+            http2 = False
+        self.client = httpx.Client(limits=limits, timeout=timeout, http2=http2)
+        self.async_client = httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+    def _should_retry(self, attempt: int, error: httpx.HTTPError) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if isinstance(error, httpx.HTTPStatusError):
+            if error.response.status_code not in RETRYABLE_STATUS_CODES:
+                return False
+        elif not isinstance(error, httpx.TransportError):
+            return False
+        if not self.retry_budget.withdraw():
+            increment(f"translator.{self.name}.retry_budget_exhausted")
+            return False
+        increment(f"translator.{self.name}.retry")
+        return True
+
+    def _log_failure(self, url: str, task_type: str, process_time: float, error: httpx.HTTPError) -> Optional[httpx.Response]:
+        error_response = getattr(error, "response", None) if isinstance(error, httpx.HTTPStatusError) else None
+        log_failed_telemetry_event(url, "POST", {"taskType": task_type}, process_time,
+                                   status_code=error_response.status_code if error_response is not None else None,
+                                   error=error_response.text if error_response is not None else str(error))
+        return error_response
+
+    def post(self, url: str, headers: dict, payload: dict, task_type: str) -> httpx.Response:
+        """
+        Posts a pipeline payload, retrying transient failures.
+
+        Raises:
+            RequestError: When the request failed after the allowed retries.
+        """
+        content = json.dumps(payload)
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            start_time = time.time()
+            try:
+                response = self.client.post(url, headers=headers, content=content)
+                response.raise_for_status()
+                log_success_telemetry_event(url, "POST", {"taskType": task_type}, time.time() - start_time, status_code=response.status_code)
+                return response
+            except httpx.HTTPError as e:
+                error_response = self._log_failure(url, task_type, time.time() - start_time, e)
+                if not self._should_retry(attempt, e):
+                    raise RequestError(error_response) from e
+            time.sleep(self.retry_backoff * 2 ** attempt)
+            attempt += 1
+
+    async def apost(self, url: str, headers: dict, payload: dict, task_type: str) -> httpx.Response:
+        """
+        Asynchronously posts a pipeline payload, retrying transient failures.
+
+        Raises:
+            RequestError: When the request failed after the allowed retries.
+        """
+        content = json.dumps(payload)
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            start_time = time.time()
+            try:
+                response = await self.async_client.post(url, headers=headers, content=content)
+                response.raise_for_status()
+                log_success_telemetry_event(url, "POST", {"taskType": task_type}, time.time() - start_time, status_code=response.status_code)
+                return response
+            except httpx.HTTPError as e:
+                error_response = self._log_failure(url, task_type, time.time() - start_time, e)
+                if not self._should_retry(attempt, e):
+                    raise RequestError(error_response) from e
+            await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+            attempt += 1
+
+    def close(self) -> None:
+        self.client.close()
+
+    async def aclose(self) -> None:
+        self.client.close()
+        await self.async_client.aclose()
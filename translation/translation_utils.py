@@ -1,38 +1,101 @@
+import io
 import os
+import subprocess
+import tempfile
+import wave
 import requests
 import base64
 from pydub import AudioSegment
 from utils import *
 
+# Sample format expected by the ASR services: 16 kHz, mono, 16 bit little-endian PCM
+ASR_SAMPLE_RATE = 16000
+ASR_CHANNELS = 1
+ASR_SAMPLE_WIDTH = 2
+AUDIO_DOWNLOAD_TIMEOUT = 30
+TRANSCODE_TIMEOUT = 60
+# ffmpeg error of an mp4/m4a whose index (moov atom) comes after the media data
+SEEK_ONLY_ERROR = "moov atom not found"
 
-def get_encoded_string(audio):
+
+def read_audio_bytes(audio) -> bytes:
+    """
+    Returns the raw bytes of an audio input given as a URL, a base64 string or a local file path.
+    """
     if is_url(audio):
-        local_filename = generate_temp_filename("mp3")
-        with requests.get(audio) as r:
-            with open(local_filename, 'wb') as f:
-                f.write(r.content)
-    elif is_base64(audio):
-        local_filename = generate_temp_filename("mp3")
-        decoded_audio_content = base64.b64decode(audio)
-        output_mp3_file = open(local_filename, "wb")
-        output_mp3_file.write(decoded_audio_content)
-        output_mp3_file.close()
-    else:
-        local_filename = audio
-
-    output_file = AudioSegment.from_file(local_filename)
-    mp3_output_file = output_file.export(local_filename, format="mp3")
-    given_audio = AudioSegment.from_file(mp3_output_file)
-    given_audio = given_audio.set_frame_rate(16000)
-    given_audio = given_audio.set_channels(1)
-    tmp_wav_filename = generate_temp_filename("wav")
-    given_audio.export(tmp_wav_filename, format="wav", codec="pcm_s16le")
-    with open(tmp_wav_filename, "rb") as wav_file:
-        wav_file_content = wav_file.read()
-    encoded_string = base64.b64encode(wav_file_content)
-    encoded_string = str(encoded_string, 'ascii', 'ignore')
-    os.remove(local_filename)
-    os.remove(tmp_wav_filename)
+        response = requests.get(audio, timeout=AUDIO_DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+    if is_base64(audio):
+        return base64.b64decode(audio)
+    with open(audio, "rb") as audio_file:
+        return audio_file.read()
+
+
+def _run_ffmpeg(source: str, audio_bytes: bytes = None) -> subprocess.CompletedProcess:
+    command = [AudioSegment.converter, "-hide_banner", "-loglevel", "error"]
+    if audio_bytes is None:
+        command.append("-nostdin")
+    command.extend([
+        "-i", source,
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ac", str(ASR_CHANNELS), "-ar", str(ASR_SAMPLE_RATE),
+        "pipe:1"
+    ])
+    return subprocess.run(command, input=audio_bytes, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=TRANSCODE_TIMEOUT)
+
+
+def is_seek_only(audio_bytes: bytes, ffmpeg_error: str) -> bool:
+    """Whether audio that failed to decode from a pipe is an mp4/m4a container, which may need seeking."""
+    return audio_bytes[4:8] == b"ftyp" or SEEK_ONLY_ERROR in ffmpeg_error
+
+
+def decode_to_pcm(audio_bytes: bytes) -> bytes:
+    """
+    Decodes audio in any format ffmpeg understands straight to 16 kHz mono PCM, through pipes.
+
+    Containers that can only be parsed with seeking (mp4/m4a with the index at the end)
+    cannot be read from a pipe; only those fall back to a temporary file. Any other
+    decoding error is raised at once.
+    """
+    result = _run_ffmpeg("pipe:0", audio_bytes)
+    if result.returncode == 0 and result.stdout:
+        return result.stdout
+    ffmpeg_error = result.stderr.decode('utf-8', 'ignore').strip()
+    if not is_seek_only(audio_bytes, ffmpeg_error):
+        raise ValueError(f"Unable to decode audio: {ffmpeg_error or 'no audio samples'}")
+    with tempfile.NamedTemporaryFile(suffix=".audio") as audio_file:
+        audio_file.write(audio_bytes)
+        audio_file.flush()
+        result = _run_ffmpeg(audio_file.name)
+    if result.returncode != 0:
+        raise ValueError(f"Unable to decode audio: {result.stderr.decode('utf-8', 'ignore').strip()}")
+    return result.stdout
+
+
+def pcm_to_wav(pcm: bytes) -> bytes:
+    """
+    Wraps 16 kHz mono PCM samples in a WAV header.
+    """
+    wav_buffer = io.BytesIO()
+    with wave.open(wav_buffer, "wb") as wav_file:
+        wav_file.setnchannels(ASR_CHANNELS)
+        wav_file.setsampwidth(ASR_SAMPLE_WIDTH)
+        wav_file.setframerate(ASR_SAMPLE_RATE)
+        wav_file.writeframes(pcm)
+    return wav_buffer.getvalue()
+
+
+def get_encoded_string(audio):
+    """
+    Converts an audio input to the base64 encoded 16 kHz mono WAV expected by the ASR services.
+
+    The audio is decoded once, in memory, without intermediate files.
+
+    Returns:
+        A (base64 encoded wav, wav bytes) tuple.
+    """
+    wav_file_content = pcm_to_wav(decode_to_pcm(read_audio_bytes(audio)))
+    encoded_string = base64.b64encode(wav_file_content).decode("ascii")
     return encoded_string, wav_file_content
 
 
@@ -10,6 +10,10 @@ from utils.utils import (
     prepare_redis_key,
     convert_chat_messages
 )
+from utils.metrics import increment, get_metrics
+from utils.cache import LRUCache, TwoTierCache, make_cache_key
+from utils.settings import Settings, get_settings, reload_settings
+from utils.tokens import get_encoding, count_text_tokens, count_message_tokens
 
 
 __all__ = [
@@ -18,5 +22,16 @@ __all__ = [
     "is_url",
     "generate_temp_filename",
     "prepare_redis_key",
-    "convert_chat_messages"
+    "convert_chat_messages",
+    "increment",
+    "get_metrics",
+    "LRUCache",
+    "TwoTierCache",
+    "make_cache_key",
+    "Settings",
+    "get_settings",
+    "reload_settings",
+    "get_encoding",
+    "count_text_tokens",
+    "count_message_tokens"
 ]
\ No newline at end of file
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from logger import logger
+from utils.metrics import increment
+
+
+def make_cache_key(namespace: str, *parts: Any) -> str:
+    """
+    Builds a compact, stable cache key by hashing the given parts.
+
+    Args:
+        namespace: Prefix for the key, e.g. "answer".
+        parts: Values that identify the cached entry.
+
+    Returns:
+        A key of the form "<namespace>:<sha256 hex digest>".
+    """
+    material = json.dumps(parts, ensure_ascii=False, separators=(",", ":"), default=str)
+    return f"{namespace}:{hashlib.sha256(material.encode('utf-8')).hexdigest()}"
+
+
+class LRUCache:
+    """
+    Thread safe, size bounded in-process cache with per entry TTL.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[int] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TwoTierCache:
+    """
+    Cache with an in-process LRU in front of a shared Redis tier.
+
+    Values must be JSON serializable. Redis failures are logged and treated as a miss,
+    so the cache never fails a request. Hits and misses are counted per tier under
+    "cache.<name>.*" in `utils.metrics`.
+    """
+
+    def __init__(self, name: str, redis_client, ttl: int, max_size: int = 1024, enabled: bool = True):
+        self.name = name
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.enabled = enabled
+        self.local = LRUCache(max_size=max_size, ttl=ttl)
+
+    async def get(self, key: str) -> Any:
+        if not self.enabled:
+            return None
+
+        value = self.local.get(key)
+        if value is not None:
+            increment(f"cache.{self.name}.hit.local")
+            return value
+
+        if self.redis_client is not None:
+            try:
+                data = await self.redis_client.get(key)
+            except Exception as e:
+                logger.warning(f"Redis read failed for {self.name} cache: {e}")
+                data = None
+            if data is not None:
+                try:
+                    value = json.loads(data)
+                except ValueError as e:
+                    # A corrupt or foreign value is dropped and counted as a miss
+                    logger.warning(f"Invalid value in {self.name} cache for {key}, deleting it: {e}")
+                    increment(f"cache.{self.name}.invalid")
+                    try:
+                        await self.redis_client.delete(key)
+                    except Exception as e:
+                        logger.warning(f"Redis delete failed for {self.name} cache: {e}")
+                else:
+                    self.local.set(key, value)
+                    increment(f"cache.{self.name}.hit.redis")
+                    return value
+
+        increment(f"cache.{self.name}.miss")
+        return None
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        if not self.enabled or value is None:
+            return
+        ttl = ttl or self.ttl
+        self.local.set(key, value, ttl)
+        if self.redis_client is not None:
+            try:
+                await self.redis_client.setex(key, ttl, json.dumps(value, ensure_ascii=False))
+            except Exception as e:
+                logger.warning(f"Redis write failed for {self.name} cache: {e}")
+        increment(f"cache.{self.name}.set")
@@ -7,9 +7,21 @@ config_file_path = os.getenv('CONFIG_INI_PATH', 'config.ini')  # Update with you
 config = ConfigParser()
 config.read(config_file_path)
 
+
+def reload_config() -> ConfigParser:
+    """
+    Re-reads the config file. The previous configuration is kept until the new one is fully parsed.
+    """
+    global config
+    new_config = ConfigParser()
+    new_config.read(config_file_path)
+    config = new_config
+    return config
+
+
 def get_from_env_or_config(section: str, key: str, default=None):
     # Check if the key exists in the environment variables
-    value = os.getenv(key.upper(), default)
+    value = os.getenv(key.upper())
 
     # If the key is not in the environment variables, try reading from a config file
     if value is None or value == "":
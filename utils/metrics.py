@@ -0,0 +1,20 @@
+import threading
+from collections import Counter
+from typing import Dict
+
+# Process wide counters (cache hits, skipped calls, dropped events, ...).
+# Each uvicorn worker keeps its own copy.
+_counters = Counter()
+_lock = threading.Lock()
+
+
+def increment(name: str, value: int = 1) -> None:
+    """Increments the counter `name` by `value`."""
+    with _lock:
+        _counters[name] += value
+
+
+def get_metrics() -> Dict[str, int]:
+    """Returns a snapshot of all counters."""
+    with _lock:
+        return dict(sorted(_counters.items()))
@@ -0,0 +1,166 @@
+import ast
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from dotenv import load_dotenv
+
+from logger import logger
+from utils import env
+from utils.cache import make_cache_key
+from utils.env import get_from_env_or_config
+from utils.metrics import increment
+
+# How often `get_settings` checks whether the config file changed
+SETTINGS_CHECK_SECONDS = 5
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Immutable snapshot of the request time configuration.
+
+    Built once from the environment and config.ini, so request handlers never parse
+    configuration themselves. A reload builds a new snapshot and swaps it in whole.
+    """
+    default_language: str
+    indices: Mapping[str, str]
+    top_docs_to_fetch: int
+    docs_min_score: float
+    temperature: float
+    max_messages: int
+    model: Optional[str]
+    prompt_token_budget: int
+    enable_bot_intent: bool
+    intent_prompt: str
+    chat_intent_prompt: str
+    activity_prompts: Mapping[str, str]
+    bot_prompts: Mapping[str, str]
+    prompt_versions: Mapping[str, str]
+
+    def get_index_id(self, context: str) -> Optional[str]:
+        return self.indices.get(context.lower())
+
+    def get_prompt_version(self, context: str) -> str:
+        """
+        Returns a fingerprint of everything, besides the documents, that shapes an answer for the given context.
+        """
+        return self.prompt_versions.get(context) or self._compute_prompt_version(context)
+
+    def _compute_prompt_version(self, context: str) -> str:
+        return make_cache_key(
+            "prompt",
+            self.activity_prompts.get(context),
+            self.bot_prompts.get(context),
+            (self.intent_prompt, os.getenv("INTENT_CLASSIFIER_TYPE")) if self.enable_bot_intent else None,
+            self.temperature,
+            self.top_docs_to_fetch,
+            self.docs_min_score,
+            self.prompt_token_budget,
+            os.getenv("LLM_TYPE"),
+            self.model,
+            context,
+        )
+
+
+def _parse_prompts(value: Optional[str]) -> Mapping[str, str]:
+    return MappingProxyType(ast.literal_eval(value)) if value else MappingProxyType({})
+
+
+def _get_prompt_token_budget(budgets: Mapping[str, int], model: Optional[str]) -> int:
+    """
+    Returns the prompt token budget of a model, matching the longest configured model name
+    prefix so that e.g. "gpt-4-0613" uses the "gpt-4" budget.
+    """
+    matches = [name for name in budgets if name != "default" and model and model.startswith(name)]
+    if matches:
+        return int(budgets[max(matches, key=len)])
+    return int(budgets.get("default", 3000))
+
+
+def load_settings() -> Settings:
+    """
+    Builds a settings snapshot from the environment and the config file.
+    """
+    load_dotenv()
+    indices = json.loads(get_from_env_or_config("database", "indices", "{}"))
+    model = os.getenv("GPT_MODEL") or os.getenv("AZURE_MODEL") or os.getenv("LLM_MODEL")
+    prompt_token_budgets = json.loads(get_from_env_or_config("llm", "prompt_token_budgets", "{}"))
+    settings = Settings(
+        default_language=get_from_env_or_config("default", "language", None),
+        indices=MappingProxyType({context.lower(): index_id for context, index_id in indices.items()}),
+        top_docs_to_fetch=int(get_from_env_or_config("database", "top_docs_to_fetch", None)),
+        docs_min_score=float(get_from_env_or_config("database", "docs_min_score", None)),
+        temperature=float(get_from_env_or_config("llm", "temperature", None)),
+        max_messages=int(get_from_env_or_config("llm", "max_messages", None)),
+        model=model,
+        prompt_token_budget=_get_prompt_token_budget(prompt_token_budgets, model),
+        enable_bot_intent=get_from_env_or_config("llm", "enable_bot_intent", "false").lower() == "true",
+        intent_prompt=get_from_env_or_config("llm", "intent_prompt", None),
+        chat_intent_prompt=get_from_env_or_config("llm", "chat_intent_prompt", None),
+        activity_prompts=_parse_prompts(get_from_env_or_config("llm", "activity_prompt", None)),
+        bot_prompts=_parse_prompts(get_from_env_or_config("llm", "bot_prompt", None)),
+        prompt_versions=MappingProxyType({})
+    )
+    contexts = set(settings.activity_prompts) | set(settings.bot_prompts)
+    contexts.update(get_from_env_or_config("request", "supported_context", "").split(","))
+    prompt_versions = {context: settings._compute_prompt_version(context) for context in contexts if context}
+    return replace(settings, prompt_versions=MappingProxyType(prompt_versions))
+
+
+def _get_config_mtime() -> Optional[float]:
+    try:
+        return os.stat(env.config_file_path).st_mtime
+    except OSError:
+        return None
+
+
+_settings: Optional[Settings] = None
+_config_mtime: Optional[float] = None
+_next_check = 0.0
+_reload_lock = threading.Lock()
+
+
+def reload_settings() -> Settings:
+    """
+    Re-reads the configuration and atomically replaces the current snapshot.
+
+    Requests that already hold the previous snapshot keep using it. If the new
+    configuration cannot be parsed, the previous snapshot stays in place.
+    """
+    global _settings, _config_mtime
+    with _reload_lock:
+        config_mtime = _get_config_mtime()
+        env.reload_config()
+        try:
+            settings = load_settings()
+        except Exception as e:
+            if _settings is None:
+                raise
+            logger.error(f"Unable to reload settings, keeping the previous ones: {e}", exc_info=True)
+            increment("settings.reload.failed")
+            return _settings
+        _settings, _config_mtime = settings, config_mtime
+        increment("settings.reload")
+        logger.info("Settings loaded")
+        return settings
+
+
+def get_settings() -> Settings:
+    """
+    Returns the current settings snapshot, reloading it when the config file has changed.
+    """
+    global _next_check
+    settings = _settings
+    if settings is None:
+        return reload_settings()
+    now = time.monotonic()
+    if now >= _next_check:
+        _next_check = now + SETTINGS_CHECK_SECONDS
+        if _get_config_mtime() != _config_mtime:
+            return reload_settings()
+    return settings
@@ -0,0 +1,58 @@
+import math
+from functools import lru_cache
+from typing import Dict, Optional
+
+import tiktoken
+
+from logger import logger
+
+# Tokenizer used for models unknown to tiktoken (Ollama models, new OpenAI model names)
+DEFAULT_ENCODING = "cl100k_base"
+# Rough number of characters per token, used when no tokenizer can be loaded
+CHARS_PER_TOKEN = 4
+# Every message follows <im_start>{role/name}\n{content}<im_end>\n
+TOKENS_PER_MESSAGE = 4
+# Every reply is primed with <im_start>assistant
+TOKENS_PER_REPLY = 2
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: Optional[str] = None) -> Optional[tiktoken.Encoding]:
+    """
+    Returns the tokenizer of a model, loaded once per process.
+
+    Returns None when the tokenizer cannot be loaded (e.g. no network access to fetch
+    the BPE file), in which case token counts are estimated from the text length.
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(DEFAULT_ENCODING)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logger.warning(f"Unable to load the tokenizer for {model}, estimating token counts instead: {e}")
+        return None
+
+
+def count_text_tokens(text: str, model: Optional[str] = None) -> int:
+    """Counts the tokens of a string."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message: Dict[str, str], model: Optional[str] = None) -> int:
+    """
+    Counts the tokens a chat message takes in a prompt.
+
+    A token count already stored with the message under "tokens" is returned as is.
+    """
+    if "tokens" in message:
+        return message["tokens"]
+    num_tokens = TOKENS_PER_MESSAGE
+    for key, value in message.items():
+        num_tokens += count_text_tokens(value, model)
+        if key == "name":  # if there's a name, the role is omitted
+            num_tokens -= 1  # role is always required and always 1 token
+    return num_tokens
@@ -43,7 +43,8 @@ def prepare_redis_key(x_source, x_consumer_id, context):
     if context is not None:
          key += f"_{context}"
 
-    return key
+    # Hash tag, so that all the keys of a session map to the same Redis Cluster slot
+    return "{" + key + "}"
 
 def convert_chat_messages(messages: Sequence[Dict[str, Any]]) -> List[BaseMessage]:
     """Convert dictionaries representing common messages to LangChain format.
@@ -8,6 +8,15 @@ if TYPE_CHECKING:
     from vectorstores.marqo import (
         MarqoVectorStore
     )
+    from vectorstores.local import (
+        LocalVectorStore
+    )
+    from vectorstores.lexical import (
+        LexicalStore
+    )
+    from vectorstores.hybrid import (
+        HybridVectorStore
+    )
 
 # __all__ = [
 #     "BaseVectorStore",
@@ -16,7 +25,10 @@ if TYPE_CHECKING:
 
 _module_lookup = {
     "BaseVectorStore" : "vectorstores.base",
-    "MarqoVectorStore": "vectorstores.marqo"
+    "MarqoVectorStore": "vectorstores.marqo",
+    "LocalVectorStore": "vectorstores.local",
+    "LexicalStore": "vectorstores.lexical",
+    "HybridVectorStore": "vectorstores.hybrid"
 }
 
 def __getattr__(name: str) -> Any:
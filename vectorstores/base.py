@@ -1,9 +1,13 @@
 from abc import ABC, abstractmethod
 from typing import (
+    Callable,
+    Iterable,
     List,
+    Optional,
     Tuple
 )
 from langchain.docstore.document import Document
+from starlette.concurrency import run_in_threadpool
 
 
 class BaseVectorStore(ABC):
@@ -43,7 +47,8 @@ class BaseVectorStore(ABC):
         return [document[i: i + batch_size] for i in range(0, len(document), batch_size)]
 
     @abstractmethod
-    def add_documents(self, documents: List[Document], fresh_collection: bool = False) -> List[str]:
+    def add_documents(self, documents: List[Document], fresh_collection: bool = False,
+                      ids: Optional[List[str]] = None) -> List[str]:
         """
         Adds a list of documents to the vector store.
 
@@ -51,13 +56,62 @@ class BaseVectorStore(ABC):
 
         Args:
             documents: A list of documents to be added.
+            fresh_collection: Whether to replace the existing collection (default: False).
+            ids: IDs of the documents, generated by the vector store when not given (default: None).
+                A document added with the ID of an existing one replaces it.
 
         Returns:
             A list of document IDs for the added documents.
         """
 
+    def add_document_batches(self, batches: Iterable[Tuple[List[Document], List[str]]],
+                             fresh_collection: bool = False,
+                             get_ids_to_delete: Optional[Callable[[], List[str]]] = None,
+                             run_id: Optional[str] = None) -> int:
+        """
+        Adds documents streamed as (documents, ids) batches, consuming the batches as they come.
+
+        The default implementation calls `add_documents` per batch, only the first one replacing
+        the collection when `fresh_collection` is set, then deletes the documents returned by
+        `get_ids_to_delete`. Subclasses that rewrite the whole collection on every call should
+        override it, and apply the additions and deletions in one write.
+
+        Args:
+            batches: An iterable of (documents, ids) tuples.
+            fresh_collection: Whether to replace the existing collection (default: False).
+            get_ids_to_delete: Called once every batch was consumed, returns the IDs of the
+                existing documents to delete (default: None).
+            run_id: Identifies the documents of the call, so that a store resuming interrupted
+                uploads only resumes the same ones (default: None).
+
+        Returns:
+            The number of documents added.
+        """
+        count = 0
+        first_batch = True
+        for documents, ids in batches:
+            self.add_documents(documents, fresh_collection and first_batch, ids=ids)
+            first_batch = False
+            count += len(documents)
+        ids_to_delete = get_ids_to_delete() if get_ids_to_delete else []
+        if ids_to_delete:
+            self.delete_documents(ids_to_delete)
+        return count
+
     @abstractmethod
-    def similarity_search_with_score(self, query: str, collection_name: str, k: int = 20) -> List[Tuple[Document, float]]:
+    def delete_documents(self, ids: List[str]) -> None:
+        """
+        Deletes documents from the collection by ID. Unknown IDs are ignored.
+
+        This method should be overridden by subclasses to implement their specific logic for deleting documents.
+
+        Args:
+            ids: The IDs of the documents to be deleted.
+        """
+
+    @abstractmethod
+    def similarity_search_with_score(self, query: str, collection_name: str, k: int = 20,
+                                     min_score: Optional[float] = None) -> List[Tuple[Document, float]]:
         """
         Performs a similarity search on the vector store and returns documents with their scores.
 
@@ -67,7 +121,27 @@ class BaseVectorStore(ABC):
             query: The query string to search for.
             collection_name: The name of the collection within the vector store to search in.
             k: The maximum number of documents to fetch from the vector store (default: 20).
+            min_score: Only documents scoring above it are returned (default: None, no threshold).
+
+        Returns:
+            A list of tuples, where each tuple contains a document and its corresponding score.
+        """
+
+    async def asimilarity_search_with_score(self, query: str, collection_name: str, k: int = 20,
+                                            min_score: Optional[float] = None) -> List[Tuple[Document, float]]:
+        """
+        Asynchronously performs a similarity search on the vector store and returns documents with their scores.
+
+        The default implementation runs `similarity_search_with_score` in a worker thread so that
+        the event loop is never blocked. Subclasses with a native async client should override it.
+
+        Args:
+            query: The query string to search for.
+            collection_name: The name of the collection within the vector store to search in.
+            k: The maximum number of documents to fetch from the vector store (default: 20).
+            min_score: Only documents scoring above it are returned (default: None, no threshold).
 
         Returns:
             A list of tuples, where each tuple contains a document and its corresponding score.
         """
+        return await run_in_threadpool(self.similarity_search_with_score, query, collection_name, k=k, min_score=min_score)
@@ -0,0 +1,129 @@
+import asyncio
+import json
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple
+)
+
+from langchain.docstore.document import Document
+from starlette.concurrency import run_in_threadpool
+
+from utils import get_from_env_or_config, increment
+from vectorstores.base import BaseVectorStore
+from vectorstores.lexical import LexicalStore
+
+# Normalized BM25 score above which a document is a lexical hit, 1 being a match of every query term
+LEXICAL_MIN_SCORE = float(get_from_env_or_config('database', 'lexical_min_score', 0.6))
+# Rank constant of reciprocal rank fusion, larger values flatten the weight of the top ranks
+RRF_K = int(get_from_env_or_config('database', 'rrf_k', 60))
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Tuple[Document, float]]], k: int,
+                           rank_constant: int = 60) -> List[Tuple[Document, float]]:
+    """
+    Merges ranked result lists into one, scoring every document by the sum of
+    1 / (rank_constant + rank) over the lists it appears in.
+
+    Returns:
+        The `k` best (document, fused score) tuples, best first.
+    """
+    fused: Dict[Tuple[str, str], List] = {}
+    for results in result_lists:
+        for rank, (document, _) in enumerate(results, start=1):
+            key = (document.page_content, json.dumps(document.metadata, sort_keys=True))
+            if key in fused:
+                fused[key][1] += 1 / (rank_constant + rank)
+            else:
+                fused[key] = [document, 1 / (rank_constant + rank)]
+    ranked = sorted(fused.values(), key=lambda item: item[1], reverse=True)
+    return [(document, score) for document, score in ranked[:k]]
+
+
+class HybridVectorStore(BaseVectorStore):
+    """
+    Wrapper around another vector store that also searches a BM25 index of the same
+    collection and merges both result lists with reciprocal rank fusion.
+
+    Each leg applies its own threshold: the vector leg `min_score` (`docs_min_score`) and
+    the lexical leg `lexical_min_score`. Exact terms such as activity names, which an
+    embedding can rank below the threshold, are recovered by the lexical leg without
+    fetching more vector hits. The returned scores are fused scores, not similarities.
+    """
+
+    def __init__(self, vector_store: BaseVectorStore, lexical_store: Optional[LexicalStore] = None):
+        self.vector_store = vector_store
+        self.lexical_store = lexical_store or LexicalStore()
+
+    @property
+    def collection_name(self) -> str:
+        return self.vector_store.collection_name
+
+    def get_client(self):
+        return self.vector_store.get_client()
+
+    def add_documents(self, documents: List[Document], fresh_collection: bool = False,
+                      ids: Optional[List[str]] = None) -> List[str]:
+        added_ids = self.vector_store.add_documents(documents, fresh_collection, ids=ids)
+        self.lexical_store.add_documents(documents, self.collection_name, fresh_collection, ids=ids)
+        return added_ids
+
+    def add_document_batches(self, batches: Iterable[Tuple[List[Document], List[str]]],
+                             fresh_collection: bool = False,
+                             get_ids_to_delete: Optional[Callable[[], List[str]]] = None,
+                             run_id: Optional[str] = None) -> int:
+        """
+        Adds the batches to the vector store and writes one new version of the lexical index,
+        with the additions and the deletions, once the vector store is done.
+        """
+        lexical_writer = self.lexical_store.get_writer(self.collection_name, fresh_collection)
+        ids_to_delete = []
+
+        def write_lexical_batches():
+            # Every batch is spilled to the new lexical version on its way to the vector store
+            for documents, ids in batches:
+                lexical_writer.write(documents, ids)
+                yield documents, ids
+
+        def get_vector_ids_to_delete():
+            ids_to_delete.extend(get_ids_to_delete() if get_ids_to_delete else [])
+            return ids_to_delete
+
+        try:
+            count = self.vector_store.add_document_batches(write_lexical_batches(), fresh_collection,
+                                                           get_vector_ids_to_delete, run_id)
+        except Exception:
+            lexical_writer.discard()
+            raise
+        lexical_writer.drop(ids_to_delete)
+        lexical_writer.publish()
+        return count
+
+    def delete_documents(self, ids: List[str]) -> None:
+        self.vector_store.delete_documents(ids)
+        self.lexical_store.delete_documents(ids, self.collection_name)
+
+    def fuse(self, vector_results: List[Tuple[Document, float]], lexical_results: List[Tuple[Document, float]],
+             k: int) -> List[Tuple[Document, float]]:
+        vector_keys = {document.page_content for document, _ in vector_results}
+        lexical_only = sum(1 for document, _ in lexical_results if document.page_content not in vector_keys)
+        if lexical_only:
+            increment("vectorstore.hybrid.lexical_only", lexical_only)
+        return reciprocal_rank_fusion([vector_results, lexical_results], k, RRF_K)
+
+    def similarity_search_with_score(self, query: str, collection_name: str, k: int = 20,
+                                     min_score: Optional[float] = None) -> List[Tuple[Document, float]]:
+        vector_results = self.vector_store.similarity_search_with_score(query, collection_name, k=k, min_score=min_score)
+        lexical_results = self.lexical_store.search(query, collection_name, k, LEXICAL_MIN_SCORE)
+        return self.fuse(vector_results, lexical_results, k)
+
+    async def asimilarity_search_with_score(self, query: str, collection_name: str, k: int = 20,
+                                            min_score: Optional[float] = None) -> List[Tuple[Document, float]]:
+        vector_results, lexical_results = await asyncio.gather(
+            self.vector_store.asimilarity_search_with_score(query, collection_name, k=k, min_score=min_score),
+            run_in_threadpool(self.lexical_store.search, query, collection_name, k, LEXICAL_MIN_SCORE)
+        )
+        return self.fuse(vector_results, lexical_results, k)
@@ -0,0 +1,316 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple
+)
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from logger import logger
+from utils import get_from_env_or_config, increment
+from vectorstores.versions import get_current_version, stage_version, switch_version
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = float(get_from_env_or_config('database', 'bm25_k1', 1.2))
+BM25_B = float(get_from_env_or_config('database', 'bm25_b', 0.75))
+# How often a worker checks whether a lexical index was rebuilt
+RELOAD_CHECK_SECONDS = int(get_from_env_or_config('database', 'local_reload_check_seconds', 10))
+MAX_TERM_FREQUENCY = np.iinfo(np.uint16).max
+# Documents added to a new version, written to its staging directory until the index is built
+SPILL_FILE = "added_documents.jsonl"
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+a about above after again all am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers herself
+him himself his how i if in into is it its itself just me more most my myself no nor not now of off on once only
+or other our ours ourselves out over own same she should so some such than that the their theirs them themselves
+then there these they this those through to too under until up very was we were what when where which while who
+whom why will with would you your yours yourself yourselves
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into lowercase terms, without stopwords.
+
+    Plurals are folded into the singular ("colours" -> "colour") so that a question and
+    an activity phrased differently still share their terms.
+    """
+    terms = []
+    for term in TOKEN_PATTERN.findall(text.lower()):
+        if term in STOPWORDS:
+            continue
+        if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+
+def inverse_document_frequency(document_frequency, document_count: int):
+    return np.log1p((document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+class BM25Index:
+    """
+    Read-only snapshot of one version of a lexical index.
+
+    Postings are stored per term as two memory-mapped arrays (document, term frequency)
+    delimited by `term_offsets`, so a query only reads the postings of its own terms.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "terms.json"), encoding="utf-8") as terms_file:
+            self.terms = {term: term_id for term_id, term in enumerate(json.load(terms_file))}
+        self.term_offsets = np.load(os.path.join(path, "term_offsets.npy"))
+        self.posting_documents = np.load(os.path.join(path, "posting_documents.npy"), mmap_mode="r")
+        self.posting_frequencies = np.load(os.path.join(path, "posting_frequencies.npy"), mmap_mode="r")
+        with open(os.path.join(path, "documents.jsonl"), encoding="utf-8") as documents_file:
+            self.documents = [json.loads(line) for line in documents_file]
+
+        document_lengths = np.load(os.path.join(path, "document_lengths.npy")).astype(np.float32)
+        average_length = max(float(document_lengths.mean()), 1.0) if len(document_lengths) else 1.0
+        # Denominator term of BM25 that only depends on the document
+        self.length_norms = BM25_K1 * (1 - BM25_B + BM25_B * document_lengths / average_length)
+
+    def score_documents(self, query: str) -> np.ndarray:
+        """
+        BM25 score of every document, divided by the score of a document of average length
+        that contains every query term once (the sum of their idf).
+
+        Query terms missing from the index count towards that reference score, so a query
+        whose distinctive words the corpus never uses does not match on its common words alone.
+        """
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        reference_score = 0.0
+        for term in set(tokenize(query)):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                reference_score += float(inverse_document_frequency(0, len(self.documents)))
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            documents = self.posting_documents[start: end]
+            frequencies = np.asarray(self.posting_frequencies[start: end], dtype=np.float32)
+            idf = float(inverse_document_frequency(end - start, len(self.documents)))
+            scores[documents] += idf * frequencies * (BM25_K1 + 1) / (frequencies + self.length_norms[documents])
+            reference_score += idf
+        return scores / reference_score if reference_score else scores
+
+    def search(self, query: str, k: int, min_score: Optional[float] = None) -> List[Tuple[dict, float]]:
+        scores = self.score_documents(query)
+        candidates = np.flatnonzero(scores > (min_score if min_score is not None else 0))
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.documents[i], float(scores[i])) for i in candidates]
+
+
+def write_bm25_index(path: str, documents: Iterable[dict]) -> int:
+    """
+    Writes `documents` and their postings to the directory `path`, reading the documents once.
+
+    Only the postings are kept in memory while the documents stream to `documents.jsonl`.
+
+    Returns:
+        The number of documents written.
+    """
+    term_ids: Dict[str, int] = {}
+    posting_terms, posting_documents = array("i"), array("i")
+    posting_frequencies = array("H")
+    document_lengths = array("I")
+    with open(os.path.join(path, "documents.jsonl"), "w", encoding="utf-8") as documents_file:
+        for document_id, document in enumerate(documents):
+            documents_file.write(json.dumps(document, ensure_ascii=False) + "\n")
+            terms = tokenize(document["text"])
+            document_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+                posting_documents.append(document_id)
+                posting_frequencies.append(min(frequency, MAX_TERM_FREQUENCY))
+
+    # Terms are numbered in alphabetical order so that rebuilding the same corpus gives the same files
+    terms = sorted(term_ids)
+    term_order = np.empty(len(terms), dtype=np.int32)
+    term_order[[term_ids[term] for term in terms]] = np.arange(len(terms))
+    posting_terms = term_order[np.frombuffer(posting_terms, dtype=np.int32)]
+    posting_documents = np.frombuffer(posting_documents, dtype=np.int32)
+    postings = np.lexsort((posting_documents, posting_terms))
+    term_offsets = np.concatenate([[0], np.cumsum(np.bincount(posting_terms, minlength=len(terms)))]).astype(np.int64)
+
+    with open(os.path.join(path, "terms.json"), "w", encoding="utf-8") as terms_file:
+        json.dump(terms, terms_file, ensure_ascii=False)
+    np.save(os.path.join(path, "term_offsets.npy"), term_offsets)
+    np.save(os.path.join(path, "posting_documents.npy"), posting_documents[postings])
+    np.save(os.path.join(path, "posting_frequencies.npy"), np.frombuffer(posting_frequencies, dtype=np.uint16)[postings])
+    np.save(os.path.join(path, "document_lengths.npy"), np.frombuffer(document_lengths, dtype=np.uint32))
+    return len(document_lengths)
+
+
+def read_documents(documents_path: str, dropped_ids: Optional[Set[str]] = None) -> Iterator[dict]:
+    """Reads a documents file one document at a time, skipping those whose ID is in `dropped_ids`."""
+    with open(documents_path, encoding="utf-8") as documents_file:
+        for line in documents_file:
+            document = json.loads(line)
+            if not dropped_ids or document.get("_id") not in dropped_ids:
+                yield document
+
+
+class LexicalIndexWriter:
+    """
+    Writes a new version of the lexical index of a collection from batches of documents.
+
+    The batches are appended to a spill file in the staging directory of the new version
+    as they come. `publish` then builds the index in a second pass over the documents kept
+    from the current version and the spill file, so the documents are never all in memory.
+    """
+
+    def __init__(self, collection_path: str, fresh_collection: bool = False):
+        self.collection_path = collection_path
+        self.fresh_collection = fresh_collection
+        self.previous_version = get_current_version(collection_path)
+        # IDs of the documents of the current version that are not kept, replaced or deleted
+        self.dropped_ids: Set[str] = set()
+        self.staging_path = stage_version(collection_path, self.previous_version)
+        self.spill_path = os.path.join(self.staging_path, SPILL_FILE)
+        self.spill_file = open(self.spill_path, "w", encoding="utf-8")
+
+    def write(self, documents: List[Document], ids: Optional[List[str]] = None) -> None:
+        for i, document in enumerate(documents):
+            document_id = ids[i] if ids else None
+            if document_id is not None:
+                self.dropped_ids.add(document_id)
+            self.spill_file.write(json.dumps({"_id": document_id, "text": document.page_content,
+                                              "metadata": document.metadata or {}}, ensure_ascii=False) + "\n")
+
+    def drop(self, ids: Iterable[str]) -> None:
+        self.dropped_ids.update(ids)
+
+    def iter_documents(self) -> Iterator[dict]:
+        if self.previous_version is not None and not self.fresh_collection:
+            yield from read_documents(os.path.join(self.collection_path, self.previous_version, "documents.jsonl"),
+                                      self.dropped_ids)
+        yield from read_documents(self.spill_path)
+
+    def publish(self) -> str:
+        """Builds the new version from the current one and the written batches, and switches to it."""
+        self.spill_file.close()
+        try:
+            document_count = write_bm25_index(self.staging_path, self.iter_documents())
+        except Exception:
+            self.discard()
+            raise
+        os.remove(self.spill_path)
+        version = switch_version(self.collection_path, self.previous_version)
+        print(f"Lexical index {os.path.basename(self.collection_path)} version {version}: {document_count} documents.")
+        return version
+
+    def discard(self) -> None:
+        self.spill_file.close()
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+
+
+class LexicalStore:
+    """
+    BM25 indexes of the collections, built next to the vector indexes by `index_documents.py`.
+
+    Every collection is a directory under LEXICAL_INDEX_PATH holding versions of its index,
+    switched and reloaded by the API workers like the local vector store.
+    """
+
+    def __init__(self, store_path: Optional[str] = None):
+        self.store_path = store_path or os.getenv("LEXICAL_INDEX_PATH", "lexical_data")
+        self.indexes: Dict[str, Tuple[Optional[str], Optional[BM25Index]]] = {}
+        self.next_checks: Dict[str, float] = {}
+        self.indexes_lock = threading.Lock()
+
+    def get_collection_path(self, collection_name: str) -> str:
+        return os.path.join(self.store_path, collection_name)
+
+    def get_index(self, collection_name: str) -> Optional[BM25Index]:
+        """Returns the current version of a lexical index, None when the collection has none."""
+        now = time.monotonic()
+        loaded = self.indexes.get(collection_name)
+        if loaded is not None and now < self.next_checks.get(collection_name, 0):
+            return loaded[1]
+
+        with self.indexes_lock:
+            self.next_checks[collection_name] = now + RELOAD_CHECK_SECONDS
+            version = get_current_version(self.get_collection_path(collection_name))
+            loaded = self.indexes.get(collection_name)
+            if loaded is None or loaded[0] != version:
+                if version is None:
+                    logger.warning(f"No lexical index for {collection_name} in {self.store_path}, "
+                                   f"searching by vector only")
+                    index = None
+                else:
+                    index = BM25Index(os.path.join(self.get_collection_path(collection_name), version))
+                    increment("vectorstore.lexical.load")
+                    logger.info(f"Loaded lexical index {collection_name} version {version}: "
+                                f"{len(index.documents)} documents, {len(index.terms)} terms")
+                loaded = (version, index)
+                self.indexes[collection_name] = loaded
+            return loaded[1]
+
+    def get_writer(self, collection_name: str, fresh_collection: bool = False) -> LexicalIndexWriter:
+        return LexicalIndexWriter(self.get_collection_path(collection_name), fresh_collection)
+
+    def iter_documents(self, collection_name: str) -> Iterator[dict]:
+        """Reads the documents of the current version of a lexical index from disk, one at a time."""
+        collection_path = self.get_collection_path(collection_name)
+        version = get_current_version(collection_path)
+        if version is not None:
+            yield from read_documents(os.path.join(collection_path, version, "documents.jsonl"))
+
+    def add_documents(self, documents: List[Document], collection_name: str, fresh_collection: bool = False,
+                      ids: Optional[List[str]] = None) -> str:
+        """
+        Writes a new version of the lexical index of a collection.
+
+        Unless `fresh_collection` is set, the documents of the current version are kept, as
+        they are in the vector index, except those replaced by a document with the same ID.
+
+        Returns:
+            The name of the new version.
+        """
+        writer = self.get_writer(collection_name, fresh_collection)
+        try:
+            writer.write(documents, ids)
+        except Exception:
+            writer.discard()
+            raise
+        return writer.publish()
+
+    def delete_documents(self, ids: List[str], collection_name: str) -> None:
+        deleted_ids = set(ids)
+        if not any(document.get("_id") in deleted_ids for document in self.iter_documents(collection_name)):
+            return
+        writer = self.get_writer(collection_name)
+        writer.drop(deleted_ids)
+        writer.publish()
+
+    def search(self, query: str, collection_name: str, k: int = 20,
+               min_score: Optional[float] = None) -> List[Tuple[Document, float]]:
+        """
+        Returns up to `k` documents whose normalized BM25 score is above `min_score`, best first.
+
+        A score of 1 is a full match of the query (see `BM25Index.score_documents`). A
+        collection without a lexical index returns no documents.
+        """
+        index = self.get_index(collection_name)
+        if index is None:
+            return []
+        return [(Document(page_content=document["text"], metadata=document["metadata"]), score)
+                for document, score in index.search(query, k, min_score)]
@@ -0,0 +1,353 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple
+)
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from logger import logger
+from utils import LRUCache, get_from_env_or_config, increment
+from vectorstores.base import BaseVectorStore
+from vectorstores.versions import get_current_version, publish_version
+
+# float16 halves the memory and disk used by the embeddings, scores are computed in float32
+LOCAL_STORE_DTYPE = get_from_env_or_config('database', 'local_store_dtype', 'float16')
+# Collections with at least this many chunk embeddings also get an IVF index
+IVF_MIN_VECTORS = int(get_from_env_or_config('database', 'local_ivf_min_vectors', 50000))
+# Number of IVF lists searched per query
+IVF_NPROBE = int(get_from_env_or_config('database', 'local_ivf_nprobe', 16))
+IVF_TRAINING_ITERATIONS = 10
+IVF_TRAINING_POINTS_PER_LIST = 64
+# How often a worker checks whether a collection was re-indexed
+RELOAD_CHECK_SECONDS = int(get_from_env_or_config('database', 'local_reload_check_seconds', 10))
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+# Rows scored at once, bounds the float32 copy made of a float16 matrix
+SEARCH_BLOCK_ROWS = 16384
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+
+def cosine_to_score(cosine):
+    """Score reported by Marqo 1.x for a cosine similarity (Lucene engine, cosinesimil space)."""
+    return (1 + cosine) / 2
+
+
+def split_text(text: str, split_length: int, split_overlap: int) -> List[str]:
+    """
+    Splits a document into chunks of `split_length` sentences, like Marqo's "sentence"
+    text preprocessing, so that a document scores as its best matching chunk.
+    """
+    sentences = [sentence for sentence in SENTENCE_PATTERN.split(text.strip()) if sentence]
+    if not sentences:
+        return []
+    step = max(1, split_length - split_overlap)
+    return [" ".join(sentences[i: i + split_length]) for i in range(0, max(1, len(sentences) - split_overlap), step)]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def assign_to_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Returns the closest centroid of every vector, computed by blocks."""
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+        block = np.asarray(vectors[start: start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+        assignment[start: start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+def train_ivf(vectors: np.ndarray, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Clusters the embeddings with spherical k-means into about sqrt(n) lists.
+
+    Returns:
+        The centroids, the offsets of each list in the list order, and the chunk
+        indices sorted by list.
+    """
+    rng = np.random.default_rng(seed)
+    list_count = max(1, int(np.sqrt(len(vectors))))
+    sample_size = min(len(vectors), list_count * IVF_TRAINING_POINTS_PER_LIST)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), list_count, replace=False)]
+    for _ in range(IVF_TRAINING_ITERATIONS):
+        assignment = assign_to_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=list_count)
+        # Empty lists keep their previous centroid
+        centroids = np.where(counts[:, None] > 0, normalize(sums), centroids)
+
+    assignment = assign_to_lists(vectors, centroids)
+    list_chunks = np.argsort(assignment, kind="stable").astype(np.int32)
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=list_count))]).astype(np.int64)
+    return centroids, list_offsets, list_chunks
+
+
+class LocalIndex:
+    """
+    Read-only snapshot of one version of a collection.
+
+    The embeddings are memory-mapped, so all the workers of a host share one copy
+    through the page cache instead of each loading the matrix.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        # Index of the document of every chunk, the chunks of a document are contiguous
+        self.chunk_documents = np.load(os.path.join(path, "chunk_documents.npy"))
+        with open(os.path.join(path, "documents.jsonl"), encoding="utf-8") as documents_file:
+            self.documents = [json.loads(line) for line in documents_file]
+        self.document_starts = np.flatnonzero(np.r_[True, np.diff(self.chunk_documents) != 0])
+
+        self.ivf_centroids = None
+        if os.path.exists(os.path.join(path, "ivf_centroids.npy")):
+            self.ivf_centroids = np.load(os.path.join(path, "ivf_centroids.npy"))
+            self.ivf_offsets = np.load(os.path.join(path, "ivf_offsets.npy"))
+            self.ivf_chunks = np.load(os.path.join(path, "ivf_chunks.npy"), mmap_mode="r")
+
+    def score_chunks(self, query_vector: np.ndarray) -> np.ndarray:
+        """Exact cosine similarity of the query with every chunk."""
+        scores = np.empty(len(self.embeddings), dtype=np.float32)
+        for start in range(0, len(self.embeddings), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.embeddings[start: start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores[start: start + len(block)] = block @ query_vector
+        return scores
+
+    def score_documents(self, query_vector: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every document, as the best score of its chunks."""
+        if self.ivf_centroids is None:
+            return np.maximum.reduceat(self.score_chunks(query_vector), self.document_starts)
+
+        lists = np.argsort(-(self.ivf_centroids @ query_vector))[:IVF_NPROBE]
+        candidates = np.sort(np.concatenate([self.ivf_chunks[self.ivf_offsets[i]: self.ivf_offsets[i + 1]] for i in lists]))
+        scores = np.full(len(self.documents), -np.inf, dtype=np.float32)
+        np.maximum.at(scores, self.chunk_documents[candidates],
+                      np.asarray(self.embeddings[candidates], dtype=np.float32) @ query_vector)
+        return scores
+
+    def subset(self, keep_documents: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[dict]]:
+        """Returns the embeddings, chunk documents and documents of the documents selected by a boolean mask."""
+        keep_chunks = keep_documents[self.chunk_documents]
+        positions = (np.cumsum(keep_documents) - 1).astype(np.int32)
+        return (np.asarray(self.embeddings[keep_chunks]), positions[self.chunk_documents[keep_chunks]],
+                [document for document, keep in zip(self.documents, keep_documents) if keep])
+
+    def search(self, query_vector: np.ndarray, k: int, min_score: Optional[float] = None) -> List[Tuple[dict, float]]:
+        if not self.documents:
+            return []
+        scores = cosine_to_score(self.score_documents(query_vector))
+        candidates = np.flatnonzero(scores > (min_score if min_score is not None else -np.inf))
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.documents[i], float(scores[i])) for i in candidates]
+
+
+class LocalVectorStore(BaseVectorStore):
+    """
+    In-process vector store for corpora that fit in memory, without a separate search service.
+
+    Every collection is a directory under VECTOR_STORE_PATH holding versions of the
+    index. Indexing writes a new version and switches the CURRENT file to it, and the
+    API workers pick it up within `local_reload_check_seconds`. Documents are split
+    and scored like Marqo: by sentence, each document scoring as its best chunk.
+    """
+
+    def __init__(self, embeddings=None):
+        self.store_path = os.getenv("VECTOR_STORE_PATH", "vector_data")
+        self.collection_name = os.environ["VECTOR_COLLECTION_NAME"]
+        self.embedding_model = os.environ["EMBEDDING_MODEL"]
+
+        if not self.collection_name:
+            raise ValueError("Missing environment variable VECTOR_COLLECTION_NAME.")
+
+        if not self.embedding_model:
+            raise ValueError("Missing environment variable EMBEDDING_MODEL.")
+
+        self.embeddings = embeddings or self.create_embeddings()
+        self.indexes: Dict[str, Tuple[str, LocalIndex]] = {}
+        self.next_checks: Dict[str, float] = {}
+        self.indexes_lock = threading.Lock()
+        self.query_embeddings = LRUCache(max_size=QUERY_EMBEDDING_CACHE_SIZE)
+
+    def create_embeddings(self):
+        try:
+            from langchain.embeddings import HuggingFaceEmbeddings
+            return HuggingFaceEmbeddings(model_name=self.embedding_model, encode_kwargs={"normalize_embeddings": True})
+        except ImportError as e:
+            raise ImportError(
+                "The local vector store computes embeddings with sentence-transformers. "
+                "Please install it with `pip install sentence-transformers`."
+            ) from e
+
+    def get_client(self):
+        return self.embeddings
+
+    def get_collection_path(self, collection_name: str) -> str:
+        return os.path.join(self.store_path, collection_name)
+
+    def get_current_version(self, collection_name: str) -> Optional[str]:
+        return get_current_version(self.get_collection_path(collection_name))
+
+    def get_index(self, collection_name: str) -> LocalIndex:
+        """Returns the current version of a collection, reloading it when it was re-indexed."""
+        now = time.monotonic()
+        loaded = self.indexes.get(collection_name)
+        if loaded is not None and now < self.next_checks.get(collection_name, 0):
+            return loaded[1]
+
+        with self.indexes_lock:
+            self.next_checks[collection_name] = now + RELOAD_CHECK_SECONDS
+            version = self.get_current_version(collection_name)
+            loaded = self.indexes.get(collection_name)
+            if version is None:
+                if loaded is not None:
+                    return loaded[1]
+                raise ValueError(f"Index {collection_name} does not exist in {self.store_path}.")
+            if loaded is None or loaded[0] != version:
+                index = LocalIndex(os.path.join(self.get_collection_path(collection_name), version))
+                loaded = (version, index)
+                self.indexes[collection_name] = loaded
+                increment("vectorstore.local.load")
+                logger.info(f"Loaded {collection_name} version {version}: {len(index.documents)} documents, "
+                            f"{len(index.embeddings)} chunks")
+            return loaded[1]
+
+    def embed_query(self, query: str) -> np.ndarray:
+        query_vector = self.query_embeddings.get(query)
+        if query_vector is None:
+            query_vector = normalize(self.embeddings.embed_query(query))
+            self.query_embeddings.set(query, query_vector)
+        return query_vector
+
+    def embed_documents(self, documents: List[Document],
+                        ids: Optional[List[str]] = None) -> Tuple[List[dict], List[np.ndarray], np.ndarray]:
+        """
+        Splits and embeds documents.
+
+        Returns:
+            The documents that have text, the embeddings of their chunks by batch, and the
+            index of the document of every chunk.
+        """
+        new_documents = []
+        chunks = []
+        chunk_documents = []
+        for i, d in enumerate(documents):
+            document_chunks = split_text(d.page_content, self.SPLIT_LENGTH, self.SPLIT_OVERLAP)
+            if not document_chunks:
+                continue
+            chunk_documents.extend([len(new_documents)] * len(document_chunks))
+            chunks.extend(document_chunks)
+            new_documents.append({"_id": ids[i] if ids else uuid.uuid4().hex, "text": d.page_content,
+                                  "metadata": d.metadata or {}})
+
+        embeddings = [normalize(self.embeddings.embed_documents(batch)).astype(LOCAL_STORE_DTYPE)
+                      for batch in self.chunk_list(chunks, self.BATCH_SIZE)]
+        return new_documents, embeddings, np.asarray(chunk_documents, dtype=np.int32)
+
+    def add_documents(self, documents=List[Document], fresh_collection: bool = False,
+                      ids: Optional[List[str]] = None) -> List[str]:
+        new_documents, embeddings, chunk_documents = self.embed_documents(documents, ids)
+        self.write_documents(new_documents, embeddings, [chunk_documents], fresh_collection)
+        return [document["_id"] for document in new_documents]
+
+    def add_document_batches(self, batches: Iterable[Tuple[List[Document], List[str]]],
+                             fresh_collection: bool = False,
+                             get_ids_to_delete: Optional[Callable[[], List[str]]] = None,
+                             run_id: Optional[str] = None) -> int:
+        """
+        Embeds the batches as they come and writes a single new version of the collection at
+        the end, without the documents returned by `get_ids_to_delete`.
+        """
+        new_documents = []
+        embeddings = []
+        chunk_documents = []
+        for documents, ids in batches:
+            batch_documents, batch_embeddings, batch_chunk_documents = self.embed_documents(documents, ids)
+            embeddings.extend(batch_embeddings)
+            chunk_documents.append(batch_chunk_documents + len(new_documents))
+            new_documents.extend(batch_documents)
+        ids_to_delete = get_ids_to_delete() if get_ids_to_delete else []
+        self.write_documents(new_documents, embeddings, chunk_documents, fresh_collection, ids_to_delete)
+        return len(new_documents)
+
+    def write_documents(self, new_documents: List[dict], embeddings: List[np.ndarray],
+                        chunk_documents: List[np.ndarray], fresh_collection: bool,
+                        ids_to_delete: Optional[List[str]] = None):
+        """
+        Writes a new version of the collection: the current documents, unless `fresh_collection`
+        or listed in `ids_to_delete`, then the new ones.
+        """
+        collection_path = self.get_collection_path(self.collection_name)
+        previous_version = self.get_current_version(self.collection_name)
+        if fresh_collection and previous_version is not None:
+            print("Existing Index will be replaced.")
+
+        all_documents = new_documents
+        if previous_version is not None and not fresh_collection:
+            previous = LocalIndex(os.path.join(collection_path, previous_version))
+            # Documents added again under the same ID are replaced
+            dropped_ids = {document["_id"] for document in new_documents}.union(ids_to_delete or [])
+            previous_embeddings, previous_chunk_documents, previous_documents = previous.subset(
+                np.array([document["_id"] not in dropped_ids for document in previous.documents], dtype=bool))
+            embeddings = [np.asarray(previous_embeddings, dtype=LOCAL_STORE_DTYPE)] + embeddings
+            chunk_documents = [previous_chunk_documents] + [chunks + len(previous_documents) for chunks in chunk_documents]
+            all_documents = previous_documents + new_documents
+        if not all_documents:
+            raise ValueError("No text to index.")
+
+        self.write_version(collection_path, previous_version, np.concatenate(embeddings),
+                           np.concatenate(chunk_documents), all_documents)
+
+    def delete_documents(self, ids: List[str]) -> None:
+        collection_path = self.get_collection_path(self.collection_name)
+        previous_version = self.get_current_version(self.collection_name)
+        if previous_version is None:
+            return
+        previous = LocalIndex(os.path.join(collection_path, previous_version))
+        deleted_ids = set(ids)
+        keep_documents = np.array([document["_id"] not in deleted_ids for document in previous.documents], dtype=bool)
+        if keep_documents.all():
+            return
+        embeddings, chunk_documents, documents = previous.subset(keep_documents)
+        self.write_version(collection_path, previous_version, embeddings, chunk_documents, documents)
+
+    def write_version(self, collection_path: str, previous_version: Optional[str], embeddings: np.ndarray,
+                      chunk_documents: np.ndarray, documents: List[dict]):
+        """Writes a new version of a collection next to the current one and switches to it."""
+        def write_files(staging_path: str):
+            np.save(os.path.join(staging_path, "embeddings.npy"), embeddings)
+            np.save(os.path.join(staging_path, "chunk_documents.npy"), chunk_documents)
+            with open(os.path.join(staging_path, "documents.jsonl"), "w", encoding="utf-8") as documents_file:
+                for document in documents:
+                    documents_file.write(json.dumps(document, ensure_ascii=False) + "\n")
+            if len(embeddings) >= IVF_MIN_VECTORS:
+                centroids, list_offsets, list_chunks = train_ivf(embeddings)
+                np.save(os.path.join(staging_path, "ivf_centroids.npy"), centroids)
+                np.save(os.path.join(staging_path, "ivf_offsets.npy"), list_offsets)
+                np.save(os.path.join(staging_path, "ivf_chunks.npy"), list_chunks)
+                print(f"IVF index built with {len(centroids)} lists.")
+
+        version = publish_version(collection_path, previous_version, write_files)
+        print(f"Index {self.collection_name} version {version}: {len(documents)} documents, {len(embeddings)} chunks.")
+
+    def similarity_search_with_score(self, query: str, collection_name: str, k: int = 20,
+                                     min_score: Optional[float] = None) -> List[Tuple[Document, float]]:
+        index = self.get_index(collection_name)
+        results = index.search(self.embed_query(query), k, min_score)
+        return [(Document(page_content=document["text"], metadata=document["metadata"]), score)
+                for document, score in results]
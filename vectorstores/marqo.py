@@ -1,20 +1,308 @@
+import hashlib
 import json
+import math
 import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import (
+    Callable,
     Dict,
+    Iterable,
+    Iterator,
     List,
+    NamedTuple,
+    Optional,
+    Set,
     Tuple
 )
 
 import marqo
 from langchain.docstore.document import Document
-from langchain.vectorstores.marqo import Marqo
 
+from logger import logger
+from utils import get_from_env_or_config, increment
 from vectorstores.base import BaseVectorStore
 
+# Upper bound of the number of hits requested from Marqo for one search
+MAX_SEARCH_K = int(get_from_env_or_config('database', 'max_search_k', 20))
+# Size the number of hits requested from the scores and duplicates seen on the index so far
+ADAPTIVE_SEARCH_K = get_from_env_or_config('database', 'adaptive_search_k', 'true').lower() == "true"
+# Weight of the latest search in the moving averages of the searcher
+SEARCH_STATS_SMOOTHING = 0.1
+# Hits requested per hit usually found above the score threshold
+SEARCH_K_HEADROOM = 2
+# Upload batches sent to Marqo at the same time
+UPLOAD_CONCURRENCY = int(get_from_env_or_config('database', 'marqo_upload_concurrency', 4))
+# The size of the upload batches is adjusted between these bounds so that a batch takes about
+# marqo_upload_target_batch_seconds, starting from BATCH_SIZE
+UPLOAD_MIN_BATCH_SIZE = int(get_from_env_or_config('database', 'marqo_upload_min_batch_size', 8))
+UPLOAD_MAX_BATCH_SIZE = int(get_from_env_or_config('database', 'marqo_upload_max_batch_size', 256))
+UPLOAD_TARGET_BATCH_SECONDS = float(get_from_env_or_config('database', 'marqo_upload_target_batch_seconds', 5))
+# Retries of the documents of a batch that failed, with exponential backoff
+UPLOAD_MAX_RETRIES = int(get_from_env_or_config('database', 'marqo_upload_max_retries', 3))
+UPLOAD_RETRY_BACKOFF_SECONDS = 1
+UPLOAD_PROGRESS_INTERVAL_SECONDS = 10
+
+
+class MarqoSearcher:
+    """
+    Searches one Marqo index. Kept for the lifetime of the process, so the index handle
+    and the score distribution observed on the index are reused across queries.
+    """
+    ATTRIBUTES_TO_RETRIEVE = ["text", "metadata"]
+
+    def __init__(self, client: marqo.Client, index_name: str, searchable_attributes: List[str]):
+        self.index = client.index(index_name)
+        self.index_name = index_name
+        self.searchable_attributes = searchable_attributes
+        # Average number of hits scoring above `min_score`, None until a search used a threshold
+        self.hits_above_min_score: Optional[float] = None
+        # Share of the hits above `min_score` that repeat a better scored hit (same text and metadata)
+        self.duplicate_rate = 0.0
+
+    def get_limit(self, k: int, min_score: Optional[float] = None) -> int:
+        """
+        Number of hits to request so that the `k` best distinct hits above `min_score` are
+        likely to come back.
+
+        Hits come sorted by score, so those past the first one below the threshold are never
+        used. With a threshold, the limit follows where the threshold usually cuts the hits
+        of the index, times SEARCH_K_HEADROOM and never below `k / SEARCH_K_HEADROOM`,
+        instead of always asking for `k`. It also grows with the duplicate rate of the
+        index, up to MAX_SEARCH_K.
+        """
+        if not ADAPTIVE_SEARCH_K:
+            return k
+        limit = max(k, min(MAX_SEARCH_K, k + math.ceil(k * self.duplicate_rate)))
+        if min_score is not None and self.hits_above_min_score is not None:
+            limit = min(limit, max(math.ceil(k / SEARCH_K_HEADROOM),
+                                   math.ceil(SEARCH_K_HEADROOM * self.hits_above_min_score)))
+        return limit
+
+    def record_search(self, hits: List[dict], limit: int, min_score: Optional[float],
+                      examined: int, duplicates: int) -> None:
+        """Updates the moving averages of the index with the hits of one search."""
+        if min_score is not None:
+            above = next((i for i, hit in enumerate(hits) if hit["_score"] <= min_score), len(hits))
+            # A full page above the threshold only tells that the cut is further, which lets the limit grow
+            observed = above + 1 if above == limit else above
+            if self.hits_above_min_score is None:
+                self.hits_above_min_score = float(observed)
+            else:
+                self.hits_above_min_score += SEARCH_STATS_SMOOTHING * (observed - self.hits_above_min_score)
+        if examined:
+            self.duplicate_rate += SEARCH_STATS_SMOOTHING * (duplicates / examined - self.duplicate_rate)
+
+    def search(self, query: str, k: int, min_score: Optional[float] = None) -> List[Tuple[Document, float]]:
+        """
+        Returns up to `k` distinct hits scoring above `min_score`, best first.
+
+        Only the text and the metadata of the hits are retrieved, without highlights, and
+        the metadata is parsed only for the hits that are returned.
+        """
+        limit = self.get_limit(k, min_score)
+        response = self.index.search(q=query, searchable_attributes=self.searchable_attributes, limit=limit,
+                                     attributes_to_retrieve=self.ATTRIBUTES_TO_RETRIEVE, show_highlights=False)
+        hits = response["hits"]
+        documents = []
+        seen = set()
+        examined = duplicates = 0
+        for hit in hits:
+            score = hit["_score"]
+            if min_score is not None and score <= min_score:
+                break  # Hits come sorted by score
+            examined += 1
+            key = (hit["text"], hit.get("metadata"))
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            metadata = json.loads(hit.get("metadata") or "{}")
+            documents.append((Document(page_content=hit["text"], metadata=metadata), score))
+            if len(documents) == k:
+                break
+
+        self.record_search(hits, limit, min_score, examined, duplicates)
+        if len(documents) < k and len(hits) == limit < k and hits[-1]["_score"] > min_score:
+            # This query had more hits above the threshold than the index usually has
+            increment("vectorstore.search.limited")
+        if duplicates:
+            increment("vectorstore.search.duplicates", duplicates)
+        increment("vectorstore.search.hits", len(hits))
+        return documents
+
+
+class UploadCheckpoint:
+    """
+    IDs of the documents an indexing run has uploaded, appended to a file after every
+    batch, so that a run that was interrupted or failed resumes where it stopped.
+
+    The first line of the file describes the run (`run`, e.g. its ID and whether it
+    replaces the collection). A checkpoint left by a different run is removed, not resumed.
+    """
+
+    def __init__(self, path: str, run: dict):
+        self.path = path
+        self.run = run
+        self.ids: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as checkpoint_file:
+                header = checkpoint_file.readline()
+                ids = {line.strip() for line in checkpoint_file if line.strip()}
+            try:
+                previous_run = json.loads(header)
+            except ValueError:
+                previous_run = None
+            if previous_run == run:
+                self.ids = ids
+            else:
+                print(f"Removing {path}, left by a different indexing run.")
+                os.remove(path)
+
+    def add(self, ids: List[str]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        new_file = not os.path.exists(self.path)
+        with open(self.path, "a", encoding="utf-8") as checkpoint_file:
+            if new_file:
+                checkpoint_file.write(json.dumps(self.run, sort_keys=True) + "\n")
+            checkpoint_file.write("".join(f"{document_id}\n" for document_id in ids))
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        self.ids.update(ids)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BatchResult(NamedTuple):
+    uploaded_ids: List[str]
+    failed: int
+    seconds: float
+    had_errors: bool
+
+
+class BatchUploader:
+    """
+    Uploads documents to a Marqo index with up to `concurrency` batches in flight.
+
+    The batch size follows the latency of the batches towards UPLOAD_TARGET_BATCH_SECONDS,
+    and is halved when a batch fails. The documents of a failed batch are retried on their
+    own, and the IDs of every uploaded batch go to the checkpoint as soon as it completes.
+    """
+
+    def __init__(self, index, tensor_fields: List[str], batch_size: int, concurrency: int = UPLOAD_CONCURRENCY,
+                 checkpoint: Optional[UploadCheckpoint] = None):
+        self.index = index
+        self.tensor_fields = tensor_fields
+        self.batch_size = min(max(batch_size, UPLOAD_MIN_BATCH_SIZE), UPLOAD_MAX_BATCH_SIZE)
+        self.concurrency = max(1, concurrency)
+        self.checkpoint = checkpoint
+        self.uploaded_ids: List[str] = []
+        self.failed = 0
+
+    def iter_batches(self, documents: Iterator[dict]) -> Iterator[List[dict]]:
+        batch = []
+        for document in documents:
+            batch.append(document)
+            # The size is read for every batch, it changes as batches complete
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def upload_batch(self, batch: List[dict]) -> BatchResult:
+        uploaded_ids = []
+        remaining = batch
+        rejected = 0
+        seconds = None
+        had_errors = False
+        for attempt in range(UPLOAD_MAX_RETRIES + 1):
+            if attempt:
+                increment("vectorstore.upload.retry")
+                time.sleep(UPLOAD_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            start = time.monotonic()
+            retry = []
+            try:
+                response = self.index.add_documents(documents=remaining, tensor_fields=self.tensor_fields)
+                for document, item in zip(remaining, response["items"]):
+                    status = item.get("status", 200)
+                    if status < 300:
+                        uploaded_ids.append(item["_id"])
+                    elif status == 429 or status >= 500:
+                        retry.append(document)
+                    else:
+                        # Rejected documents fail the same way on every attempt
+                        logger.error(f"Marqo rejected document {item.get('_id')}: {item.get('error')}")
+                        rejected += 1
+            except Exception as e:
+                logger.warning(f"Upload of {len(remaining)} documents failed (attempt {attempt + 1}): {e}")
+                retry = remaining
+            if seconds is None:
+                seconds = time.monotonic() - start
+            had_errors = had_errors or bool(retry) or bool(rejected)
+            remaining = retry
+            if not remaining:
+                break
+        return BatchResult(uploaded_ids, rejected + len(remaining), seconds, had_errors)
+
+    def resize(self, result: BatchResult, batch_size: int):
+        if result.had_errors:
+            new_size = batch_size // 2
+        else:
+            # At most doubles or halves at once, so that one slow batch does not swing the size
+            new_size = round(batch_size * min(2.0, max(0.5, UPLOAD_TARGET_BATCH_SECONDS / max(result.seconds, 1e-3))))
+        self.batch_size = min(max(new_size, UPLOAD_MIN_BATCH_SIZE), UPLOAD_MAX_BATCH_SIZE)
+
+    def complete(self, future, batch_size: int):
+        result = future.result()
+        if self.checkpoint is not None and result.uploaded_ids:
+            self.checkpoint.add(result.uploaded_ids)
+        self.uploaded_ids.extend(result.uploaded_ids)
+        self.failed += result.failed
+        self.resize(result, batch_size)
+
+    def run(self, documents: Iterable[dict]) -> int:
+        """
+        Uploads the documents, reading them from `documents` only as batches are sent.
+
+        Returns:
+            The number of documents uploaded. Those that still failed after the retries are
+            counted in `failed`.
+        """
+        start = last_report = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = {}
+            try:
+                for batch in self.iter_batches(iter(documents)):
+                    while len(pending) >= self.concurrency:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self.complete(future, pending.pop(future))
+                    pending[executor.submit(self.upload_batch, batch)] = len(batch)
+
+                    now = time.monotonic()
+                    if now - last_report >= UPLOAD_PROGRESS_INTERVAL_SECONDS:
+                        last_report = now
+                        print(f"Uploaded {len(self.uploaded_ids)} documents "
+                              f"({len(self.uploaded_ids) / (now - start):.1f} docs/s), "
+                              f"batch size {self.batch_size}, {len(pending)} batches in flight")
+            finally:
+                # Batches in flight are checkpointed even when reading the documents failed
+                for future in list(pending):
+                    self.complete(future, pending.pop(future))
+
+        elapsed = time.monotonic() - start
+        print(f"Uploaded {len(self.uploaded_ids)} documents in {elapsed:.1f}s "
+              f"({len(self.uploaded_ids) / max(elapsed, 1e-9):.1f} docs/s)")
+        return len(self.uploaded_ids)
+
 
 class MarqoVectorStore(BaseVectorStore):
     TENSOR_FIELDS: str = ["text"]
+    DELETE_BATCH_SIZE: int = 1000
     client: marqo.Client
 
     def __init__(self):
@@ -44,12 +332,69 @@ class MarqoVectorStore(BaseVectorStore):
             raise ValueError("Missing environment variable EMBEDDING_MODEL.")
 
         self.client = marqo.Client(url=self.client_url)
+        self.checkpoint_path = os.getenv("MARQO_CHECKPOINT_PATH", "index_checkpoints")
+        self.searchers: Dict[str, MarqoSearcher] = {}
+        self.searchers_lock = threading.Lock()
 
     def get_client(self) -> marqo.Client:
         return self.client
 
-    def add_documents(self, documents=List[Document], fresh_collection: bool = False) -> List[str]:
+    def add_documents(self, documents=List[Document], fresh_collection: bool = False,
+                      ids: Optional[List[str]] = None) -> List[str]:
+        if not ids:
+            # Without IDs the uploaded documents cannot be recognized again, so there is nothing to checkpoint
+            self.prepare_collection(fresh_collection)
+            uploader = BatchUploader(self.client.index(self.collection_name), self.TENSOR_FIELDS, self.BATCH_SIZE)
+            uploader.run(self.to_marqo_document(d) for d in documents)
+            self.check_upload(uploader, resumable=False)
+            return uploader.uploaded_ids
+
+        run_id = hashlib.sha256("\n".join(sorted(ids)).encode("utf-8")).hexdigest()
+        self.add_document_batches([(documents, ids)], fresh_collection, run_id=run_id)
+        return list(ids)
+
+    def add_document_batches(self, batches: Iterable[Tuple[List[Document], List[str]]],
+                             fresh_collection: bool = False,
+                             get_ids_to_delete: Optional[Callable[[], List[str]]] = None,
+                             run_id: Optional[str] = None) -> int:
+        """
+        Uploads the batches with several requests in flight, see BatchUploader, then deletes
+        the documents returned by `get_ids_to_delete`.
 
+        The IDs of the uploaded documents are kept in a checkpoint file under
+        MARQO_CHECKPOINT_PATH until every document is in. A run with the same `run_id` and
+        `fresh_collection` that finds a checkpoint resumes: it does not recreate the collection
+        and skips the documents already uploaded. Any other run removes the checkpoint.
+        """
+        checkpoint = UploadCheckpoint(os.path.join(self.checkpoint_path, f"{self.collection_name}.ids"),
+                                      {"fresh_collection": fresh_collection, "run_id": run_id})
+        if checkpoint.ids:
+            print(f"Resuming from {checkpoint.path}: {len(checkpoint.ids)} documents already uploaded.")
+        else:
+            self.prepare_collection(fresh_collection)
+
+        skipped = 0
+
+        def iter_documents():
+            nonlocal skipped
+            for documents, ids in batches:
+                for d, document_id in zip(documents, ids):
+                    if document_id in checkpoint.ids:
+                        skipped += 1
+                        continue
+                    yield self.to_marqo_document(d, document_id)
+
+        uploader = BatchUploader(self.client.index(self.collection_name), self.TENSOR_FIELDS, self.BATCH_SIZE,
+                                 checkpoint=checkpoint)
+        uploaded = uploader.run(iter_documents())
+        self.check_upload(uploader, resumable=True)
+        checkpoint.remove()
+        ids_to_delete = get_ids_to_delete() if get_ids_to_delete else []
+        if ids_to_delete:
+            self.delete_documents(ids_to_delete)
+        return uploaded + skipped
+
+    def prepare_collection(self, fresh_collection: bool):
         if fresh_collection:
             try:
                 self.client.index(self.collection_name).delete()
@@ -61,29 +406,42 @@ class MarqoVectorStore(BaseVectorStore):
                 self.collection_name, settings_dict=self.index_settings)
             print(f"Index {self.collection_name} created.")
 
-        docs: List[Dict[str, str]] = []
-        ids = []
-        for d in documents:
-            doc = {
-                "text": d.page_content,
-                "metadata": json.dumps(d.metadata) if d.metadata else json.dumps({}),
-            }
-            docs.append(doc)
-        chunks = list(self.chunk_list(docs, self.BATCH_SIZE))
-        for chunk in chunks:
-            response = self.client.index(self.collection_name).add_documents(
-                documents=chunk, client_batch_size=self.BATCH_SIZE, tensor_fields=self.TENSOR_FIELDS)
-            if response[0]["errors"]:
-                err_msg = (
-                    f"Error in upload for documents in index range"
-                    f"check Marqo logs."
-                )
-                raise RuntimeError(err_msg)
-            ids += [item["_id"] for item in response[0]["items"]]
-
-        return ids
-
-    def similarity_search_with_score(self, query: str, collection_name: str, k: int = 20) -> List[Tuple[Document, float]]:
-        docsearch = Marqo(self.client, index_name=collection_name, searchable_attributes=["text"])
-        documents = docsearch.similarity_search_with_score(query, k)
-        return documents
+    @staticmethod
+    def to_marqo_document(d: Document, document_id: Optional[str] = None) -> Dict[str, str]:
+        doc = {
+            "text": d.page_content,
+            "metadata": json.dumps(d.metadata) if d.metadata else json.dumps({}),
+        }
+        if document_id:
+            doc["_id"] = document_id
+        return doc
+
+    def check_upload(self, uploader: BatchUploader, resumable: bool):
+        if uploader.failed:
+            err_msg = (
+                f"Error in upload for {uploader.failed} documents of {self.collection_name}, "
+                f"check Marqo logs."
+            )
+            if resumable:
+                err_msg += f" Run again to retry them, the {len(uploader.uploaded_ids)} uploaded documents are skipped."
+            raise RuntimeError(err_msg)
+
+    def delete_documents(self, ids: List[str]) -> None:
+        for chunk in self.chunk_list(ids, self.DELETE_BATCH_SIZE):
+            response = self.client.index(self.collection_name).delete_documents(ids=chunk)
+            if response.get("status") == "failed":
+                raise RuntimeError(f"Error while deleting documents from {self.collection_name}, check Marqo logs.")
+
+    def get_searcher(self, collection_name: str) -> MarqoSearcher:
+        searcher = self.searchers.get(collection_name)
+        if searcher is None:
+            with self.searchers_lock:
+                searcher = self.searchers.get(collection_name)
+                if searcher is None:
+                    searcher = MarqoSearcher(self.client, collection_name, self.TENSOR_FIELDS)
+                    self.searchers[collection_name] = searcher
+        return searcher
+
+    def similarity_search_with_score(self, query: str, collection_name: str, k: int = 20,
+                                     min_score: Optional[float] = None) -> List[Tuple[Document, float]]:
+        return self.get_searcher(collection_name).search(query, k, min_score)
@@ -0,0 +1,73 @@
+import os
+import shutil
+from typing import (
+    Callable,
+    Optional
+)
+
+CURRENT_VERSION_FILE = "CURRENT"
+
+
+def get_current_version(collection_path: str) -> Optional[str]:
+    """Returns the name of the current version of an on-disk index, None if it was never written."""
+    try:
+        with open(os.path.join(collection_path, CURRENT_VERSION_FILE)) as current_file:
+            return current_file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def get_version_path(collection_path: str, previous_version: Optional[str]) -> str:
+    """Returns the directory of the version that follows `previous_version`."""
+    version = f"v{int(previous_version[1:]) + 1}" if previous_version else "v1"
+    return os.path.join(collection_path, version)
+
+
+def stage_version(collection_path: str, previous_version: Optional[str]) -> str:
+    """
+    Creates an empty staging directory for the version that follows `previous_version`.
+
+    Returns:
+        The path of the staging directory, to fill before calling `switch_version`.
+    """
+    staging_path = f"{get_version_path(collection_path, previous_version)}.tmp"
+    shutil.rmtree(staging_path, ignore_errors=True)
+    os.makedirs(staging_path)
+    return staging_path
+
+
+def switch_version(collection_path: str, previous_version: Optional[str]) -> str:
+    """
+    Makes the staged version that follows `previous_version` the current one.
+
+    The switch is an atomic rename of the CURRENT file, so readers never see a partially
+    written version. Versions older than the previous one are removed.
+
+    Returns:
+        The name of the new version.
+    """
+    version_path = get_version_path(collection_path, previous_version)
+    version = os.path.basename(version_path)
+    os.rename(f"{version_path}.tmp", version_path)
+    current_path = os.path.join(collection_path, CURRENT_VERSION_FILE)
+    with open(f"{current_path}.tmp", "w") as current_file:
+        current_file.write(version)
+    os.replace(f"{current_path}.tmp", current_path)
+
+    for name in os.listdir(collection_path):
+        if name.startswith("v") and name not in (version, previous_version):
+            shutil.rmtree(os.path.join(collection_path, name), ignore_errors=True)
+    return version
+
+
+def publish_version(collection_path: str, previous_version: Optional[str], write_files: Callable[[str], None]) -> str:
+    """
+    Writes a new version of an on-disk index next to the current one and switches to it.
+
+    `write_files` fills the staging directory, see `stage_version` and `switch_version`.
+
+    Returns:
+        The name of the new version.
+    """
+    write_files(stage_version(collection_path, previous_version))
+    return switch_version(collection_path, previous_version)